@@ -1,23 +1,34 @@
 from collections import OrderedDict
 from copy import copy
+from mapreduceutils.aggregates import AGGREGATES
+from mapreduceutils.combiners import Combiner
+from mapreduceutils.csvinput import CSVColumns, CSVRow
+from mapreduceutils.decoders import get_json_decoder
+from mapreduceutils.keys import KEY_ENCODINGS, encode_key
+from mapreduceutils.skew import KeySalter
 from mapreduceutils.modifiers import FieldModifier
 from mapreduceutils.propertymap import (
   KeyModelMatchRule,
   ModelRuleSet,
   PropertyMap
 )
-from mapreduceutils.writers import OutputWriter
+from mapreduceutils.compression import CompressedOutput
+from mapreduceutils.writers import MapperJSONEncoder, OutputWriter
+from google.appengine.api import datastore_types
+from google.appengine.datastore import entity_pb
 from google.appengine.ext import (
   db,
   ndb
 )
+import hashlib
 import json
 import logging
 from mapreduce import context
+from mapreduce import shard_life_cycle
 
 __all__ = [
   "PropertyMap", "KeyModelMatchRule", "ModelRuleSet", "FieldModifier",
-  "record_map", "OutputWriter"
+  "record_map", "OutputWriter", "MapperPlan", "RecordMapper"
 ]
 
 
@@ -39,6 +50,11 @@ def cached_property(f):
 
 class MapperRecord(object):
 
+  # (input type, record class) in lookup order, see register
+  _record_types = []
+  # concrete input type -> record class, filled by lookup_record_class
+  _dispatch = {}
+
   def __init__(self, input_obj):
     self._data = input_obj
     self._defaults = dict()
@@ -47,28 +63,80 @@ class MapperRecord(object):
     self._defaults = {} if defaults is None else defaults
 
   @classmethod
-  def create(cls, input_obj):
+  def register(cls, input_type, record_class):
+    """
+    Registers the record class wrapping input_type instances
 
-    if isinstance(input_obj, ndb.Model):
-      record = GAE_NDBRecord(input_obj)
+    Registrations take precedence over the previous ones, so a subclass of
+    an already registered type can get its own record class.
 
-    elif isinstance(input_obj, db.Model):
-      record = GAE_DBRecord(input_obj)
+    Args:
+      - input_type: (type) class of the input objects, subclasses included
+      - record_class: MapperRecord subclass, created with from_input
+    """
+    MapperRecord._record_types.insert(0, (input_type, record_class))
+    MapperRecord._dispatch.clear()
 
-    elif isinstance(input_obj, dict):
-      record = DictRecord(input_obj)
+  @classmethod
+  def lookup_record_class(cls, input_type):
+    """ Returns the record class of input_type, None if not supported """
+    try:
+      return MapperRecord._dispatch[input_type]
+    except KeyError:
+      record_class = None
+      for registered_type, registered_class in MapperRecord._record_types:
+        if issubclass(input_type, registered_type):
+          record_class = registered_class
+          break
+      MapperRecord._dispatch[input_type] = record_class
+      return record_class
 
-    elif isinstance(input_obj, basestring):
-      try:
-        record = MapperRecord(json.loads(input_obj))
-      except ValueError:
-        logging.warn(u"Unable to load json: {}".format(input_obj))
-        record = None
+  @classmethod
+  def from_input(cls, input_obj, **options):
+    """ Creates the record of input_obj, options are ignored by default """
+    return cls(input_obj)
 
-    return record
+  @classmethod
+  def create(cls, input_obj, **options):
+    """
+    Creates the record wrapping input_obj
+
+    The record class is looked up by the type of input_obj, only once per
+    concrete type, see register.
+
+    Args:
+      - input_obj: db.Model, ndb.Model, dict, string (JSON object) or an
+        instance of a registered type
+      - options: passed to the from_input method of the record class,
+        JSONRecord reads json_decoder
+
+    Returns:
+      MapperRecord, None if input_obj is invalid JSON
+
+    Raises:
+      TypeError if no record class is registered for the type of input_obj
+    """
+    # not type(), which is "instance" for old style classes like EntityProto
+    input_type = input_obj.__class__
+    record_class = cls.lookup_record_class(input_type)
+    if record_class is None:
+      msg = "No record class registered for input type '{}'"
+      raise TypeError(msg.format(input_type))
+    return record_class.from_input(input_obj, **options)
+
+  def mapper_key(self, mapper_spec, encoding='text'):
+    """
+    Generates the mapper key of the record
 
-  def mapper_key(self, mapper_spec):
+    Args:
+      - mapper_spec: (list) properties and modifiers composing the key
+      - encoding: (str) "text" joins the unicode values with "|", "tuple"
+        generates an order preserving key, see keys.encode_key
+    """
     props = self.pick_properties(mapper_spec)
+    if encoding == 'tuple':
+      return encode_key(props.values())
+
     values = [unicode(f) for f in props.values()]
     return u"|".join(values)
 
@@ -194,6 +262,18 @@ class MapperRecord(object):
     """
 
     obj = OrderedDict()
+    for _ in self.iter_properties(property_list, obj):
+      pass
+    return obj
+
+  def iter_properties(self, property_list, obj, concurrent=False):
+    """
+    Resolves property_list into obj, see pick_properties
+
+    With concurrent, asynchronous modifiers are evaluated with eval_async
+    and the futures they wait for are yielded, so callers can interleave the
+    evaluation of several records. obj is complete once exhausted.
+    """
     for k in property_list:
       if isinstance(k, basestring):
         obj[k] = getattr(self, k)
@@ -201,11 +281,13 @@ class MapperRecord(object):
         modifier_chain = copy(obj)  # copy previously resolved attrs
         for mod_def in k:
           mod = FieldModifier.from_dict(mod_def)
-          mod.eval(self, modifier_chain)
+          if concurrent:
+            for future in mod.eval_async(self, modifier_chain):
+              yield future
+          else:
+            mod.eval(self, modifier_chain)
         obj[mod_def['identifier']] = modifier_chain[mod_def['identifier']]
 
-    return obj
-
   def match_rule(self, property_map):
     """
     Tries to match one of the rules in property_map to the MapperRecord
@@ -341,14 +423,465 @@ class DictRecord(MapperRecord):
     return value
 
 
+class EntityProtoRecord(MapperRecord):
+  """
+  Record of a raw entity protocol buffer
+
+  Works on the entity_pb.EntityProto yielded by EntityProtoInputReader
+  without instantiating a model: property values are only converted when
+  they are read. Properties of ndb structured properties, stored as
+  "parent.child", resolve as dicts of their child values.
+  """
+
+  def __init__(self, input_obj):
+    self._data = input_obj
+    self._defaults = dict()
+    self._key = ndb.Key(reference=input_obj.key())
+    self._key_pairs = self._key.pairs()
+    self._properties = None  # name -> Property protos, see _property_protos
+    self._values = {}
+
+  @classmethod
+  def from_bytes(cls, data):
+    """ Creates the record of a serialized EntityProto """
+    return cls(entity_pb.EntityProto(data))
+
+  def _property_protos(self):
+    if self._properties is None:
+      self._properties = {}
+      for props in (self._data.property_list(),
+                    self._data.raw_property_list()):
+        for prop in props:
+          self._properties.setdefault(prop.name(), []).append(prop)
+    return self._properties
+
+  def _property_value(self, name):
+    """ Converted value of a property, KeyError if it's missing """
+    try:
+      return self._values[name]
+    except KeyError:
+      pass
+
+    protos = self._property_protos()
+    if name in protos:
+      props = protos[name]
+      values = [datastore_types.FromPropertyPb(prop) for prop in props]
+      value = values if props[0].multiple() else values[0]
+    else:
+      prefix = name + '.'
+      children = [n for n in protos if n.startswith(prefix)]
+      if not children:
+        raise KeyError(name)
+      value = dict((n[len(prefix):], self._property_value(n))
+                   for n in children)
+
+    self._values[name] = value
+    return value
+
+  def _resolve_value(self, obj, name):
+    if obj is self._data:
+      if name == 'key':
+        return self._key.urlsafe()
+      try:
+        value = self._property_value(name)
+      except KeyError:
+        value = self._defaults.get(name)
+    elif isinstance(obj, dict):
+      value = obj.get(name, self._defaults.get(name))
+    else:
+      value = getattr(obj, name, self._defaults.get(name))
+
+    if isinstance(value, datastore_types.Key):
+      value = ndb.Key.from_old_key(value)
+    if isinstance(value, ndb.Key):
+      value = value.urlsafe()
+
+    return value
+
+
+class JSONRecord(DictRecord):
+  """ DictRecord of a JSON object string """
+
+  @classmethod
+  def from_input(cls, input_obj, json_decoder=json.loads, **options):
+    """
+    Args:
+      - input_obj: (str) JSON object
+      - json_decoder: callable decoding JSON strings, see
+        decoders.get_json_decoder
+
+    Returns:
+      JSONRecord, None if input_obj is invalid JSON
+    """
+    try:
+      return cls(json_decoder(input_obj))
+    except ValueError:
+      logging.warn(u"Unable to load json: {}".format(input_obj))
+      return None
+
+
 class CSVRecord(MapperRecord):
-  def __init__(self, input_obj, mapping_obj):
-    msg = "Sorry :( CSV Records have not been implemented yet !"
-    raise NotImplemented(msg)
+  """
+  Record of a CSV row, attributes are resolved by column position
+
+  Empty or missing columns resolve to the rule defaults.
+  """
+
+  def __init__(self, input_obj, mapping_obj=None):
+    """
+    Args:
+      - input_obj: (list) row values, usually a csvinput.CSVRow
+      - mapping_obj: (CSVColumns) column index of the file, the one of the
+        CSVRow by default
+    """
+    self._data = input_obj
+    self._defaults = dict()
+    self._columns = mapping_obj if mapping_obj is not None else \
+      input_obj.columns
+
+  def __getattr__(self, name):
+    # files exported with a property map name their columns "parent.child"
+    if '.' in name and name in self._columns.positions:
+      return self._resolve_value(self._data, name)
+    return super(CSVRecord, self).__getattr__(name)
 
   def _resolve_value(self, obj, name):
-    msg = "Sorry :( CSV Records have not been implemented yet !"
-    raise NotImplemented(msg)
+    if obj is self._data:
+      value = self._columns.value(obj, name)
+    elif isinstance(obj, dict):  # "json" typed column
+      value = obj.get(name)
+    else:
+      value = None
+
+    if (value is None or value == u'') and name in self._defaults:
+      value = self._defaults[name]
+    return value
+
+
+MapperRecord.register(basestring, JSONRecord)
+MapperRecord.register(dict, DictRecord)
+MapperRecord.register(CSVRow, CSVRecord)
+MapperRecord.register(entity_pb.EntityProto, EntityProtoRecord)
+MapperRecord.register(db.Model, GAE_DBRecord)
+MapperRecord.register(ndb.Model, GAE_NDBRecord)
+
+
+class MapperPlan(object):
+  """
+  Mapper parameters resolved once per job
+
+  Holds the property map and resolves the output writer once, so records
+  don't pay for the writer lookup.
+  """
+
+  _cached = (None, None)  # (mapreduce_id, MapperPlan)
+
+  def __init__(self, params):
+    """
+    Args:
+      - params: (dict) mapper params containing property_map and optionally
+        output_format (JSON by default), writer_args, key_encoding ("text"
+        by default or "tuple", see MapperRecord.mapper_key) and the chunked
+        output params used by RecordMapper: chunk_rows, chunk_bytes,
+        output_compression ("gzip", "zstd" or "auto"), combine_max_keys and
+        the hot key salting params salt_hot_keys (number of sub-keys of
+        every hot key, disabled by default), hot_key_threshold and
+        hot_key_sample_rate. concurrency_window is the number of records
+        whose asynchronous modifiers are evaluated concurrently by
+        process_window (disabled by default). JSON input is decoded with
+        json_decoder ("json" by default, see decoders.get_json_decoder).
+        CSV input columns are typed with csv_column_types, see
+        csv_columns.
+    """
+    self.property_map = params.get('property_map')
+    self.output_format = params.get('output_format', 'JSON')
+    self.writer_args = params.get('writer_args', dict())
+    self.writer = OutputWriter.get_writer(self.output_format)
+    self.key_encoding = params.get('key_encoding', 'text')
+    if self.key_encoding not in KEY_ENCODINGS:
+      msg = "Unsupported key_encoding '{}', use one of {}"
+      raise ValueError(msg.format(self.key_encoding, KEY_ENCODINGS))
+
+    self.chunk_rows = int(params.get('chunk_rows', 1000))
+    self.chunk_bytes = int(params.get('chunk_bytes', 64 * 1024))
+    self.compression = params.get('output_compression')
+    if self.compression and self.writer.BATCH:
+      msg = "Output format {} can not be compressed with {}"
+      raise ValueError(msg.format(self.output_format, self.compression))
+    if self.writer.BATCH:
+      for rule in self.property_map or []:
+        if 'mapper_key_spec' in rule:
+          msg = "Output format {} only supports map only rules"
+          raise ValueError(msg.format(self.output_format))
+
+    self.json_decoder = get_json_decoder(params.get('json_decoder', 'json'))
+    self.csv_column_types = params.get('csv_column_types', dict())
+    self.combine_max_keys = int(params.get('combine_max_keys', 10000))
+    self.concurrency_window = int(params.get('concurrency_window', 0))
+    self.salt_hot_keys = int(params.get('salt_hot_keys', 0))
+    self.hot_key_threshold = float(params.get('hot_key_threshold', 0.01))
+    self.hot_key_sample_rate = float(params.get('hot_key_sample_rate', 0.1))
+    for rule in self.property_map or []:
+      if 'combine' in rule and rule['combine'] not in AGGREGATES:
+        msg = "Unsupported combine operation '{}', use one of {}"
+        raise ValueError(msg.format(rule['combine'], sorted(AGGREGATES)))
+
+  @classmethod
+  def from_context(cls, ctx):
+    """ Retrieves the plan for the mapreduce job running in ctx """
+    spec = ctx.mapreduce_spec
+    mapreduce_id, plan = cls._cached
+    if plan is None or mapreduce_id != spec.mapreduce_id:
+      plan = cls(spec.mapper.params)
+      cls._cached = (spec.mapreduce_id, plan)
+    return plan
+
+  @cached_property
+  def referenced_fields(self):
+    """ Top level record attributes read by the property map """
+    return frozenset(name.split('.')[0] for name in self.referenced_names)
+
+  @cached_property
+  def referenced_names(self):
+    """
+    Full (dotted) attribute names read by the property map
+
+    Attributes read by the match rules, filters, property lists, mapper
+    keys and the "model." operands of modifiers.
+    """
+    names = []
+    for rule in self.property_map or []:
+      match_rule = rule.get("model_match_rule", {})
+      names.extend(name for name, _ in match_rule.get("properties", []))
+      names.extend(f[0] for f in rule.get("property_filters") or [])
+      for spec in ("property_list", "mapper_key_spec"):
+        for k in rule.get(spec) or []:
+          if isinstance(k, basestring):
+            names.append(k)
+          elif isinstance(k, list):
+            for mod_def in k:
+              for operand in (mod_def.get('operands') or {}).values():
+                if (isinstance(operand, basestring)
+                   and operand.startswith('model.')):
+                  names.append(operand[len('model.'):])
+
+    return frozenset(names)
+
+  @cached_property
+  def keyed(self):
+    """ True if a rule defines a mapper_key_spec, its rows are shuffled """
+    return any('mapper_key_spec' in rule for rule in self.property_map or [])
+
+  @cached_property
+  def writes_header(self):
+    """ True if map only rows go to files starting with a writer header """
+    map_only = any('mapper_key_spec' not in rule
+                   for rule in self.property_map or [])
+    return map_only and bool(self.open_output().header())
+
+  def csv_columns(self, header):
+    """
+    Parses the header of a CSV file
+
+    Args:
+      - header: (str) header line or list of column names
+
+    Returns:
+      csvinput.CSVColumns typed with csv_column_types, with the referenced
+      fields resolved. Its rows are mapped as CSVRecords.
+    """
+    columns = CSVColumns.from_header(header, self.csv_column_types)
+    # dotted names are columns of exported files, or nested "json" columns
+    return columns.compile(self.referenced_names | self.referenced_fields)
+
+  def open_output(self, sync_marker=None):
+    """
+    Opens a per shard output stream joining map only rows into blocks
+
+    Args:
+      - sync_marker: (str) 16 bytes marker used by Avro output, it must be
+        the same for every slice of a shard.
+
+    Returns:
+      Stream object, see OutputWriter.open
+    """
+    writer_args = dict(self.writer_args)
+    if self.writer.BATCH:
+      writer_args['sync_marker'] = sync_marker
+
+    # Block writers need a single schema, the first rule defines it
+    property_list = []
+    if self.property_map:
+      property_list = self.property_map[0]["property_list"]
+    output = self.writer.open(property_list, block_rows=self.chunk_rows,
+                              block_size=self.chunk_bytes, **writer_args)
+
+    if self.compression:
+      return CompressedOutput(
+        self.writer, codec=self.compression, batch_rows=self.chunk_rows,
+        batch_bytes=self.chunk_bytes, writer_args=self.writer_args,
+        header=output.header())
+    return output
+
+  def create_combiner(self):
+    """ Creates the per shard combiner used for rules defining combine """
+    return Combiner(max_keys=self.combine_max_keys)
+
+  def create_salter(self):
+    """ Creates the per shard KeySalter, None if salting is disabled """
+    if self.salt_hot_keys < 2:
+      return None
+    return KeySalter(salts=self.salt_hot_keys,
+                     threshold=self.hot_key_threshold,
+                     sample_rate=self.hot_key_sample_rate,
+                     key_encoding=self.key_encoding)
+
+  def write_partials(self, partials):
+    """
+    Encodes (key, row) partial aggregates as (key, data) tuples
+
+    Partial states are not rows of the output format: whatever the writer,
+    data is a JSON object mapping every column to its serialized state,
+    which reducers merge with aggregates.merge_partials.
+    """
+    encoder = MapperJSONEncoder()
+    return [(key, encoder.encode(row)) for key, row in partials]
+
+  def match(self, data_record):
+    """
+    Creates the MapperRecord of data_record and matches it
+
+    Returns:
+      (record, map_rule) if a rule matches and its filters pass, None
+      otherwise
+    """
+    record = MapperRecord.create(data_record, json_decoder=self.json_decoder)
+    if record:
+      map_rule = record.match_rule(self.property_map)
+      if map_rule and record.matches_filters(
+          property_filters=map_rule.get("property_filters"),
+          key_filters=map_rule.get("key_filters")
+        ):
+        record.set_defaults(map_rule.get('defaults'))
+        return record, map_rule
+    return None
+
+  def emit(self, record, map_rule, row, output=None, combiner=None,
+           salter=None):
+    """ Writes the row picked from a matched record, see process """
+    if any(row.values()):
+      if 'mapper_key_spec' in map_rule:
+        key = record.mapper_key(map_rule.get('mapper_key_spec'),
+                                encoding=self.key_encoding)
+        if combiner is not None and 'combine' in map_rule:
+          partials = combiner.add(key, row, map_rule['combine'])
+          for pair in self.write_partials(partials):
+            yield pair
+        else:
+          if salter is not None:
+            key = salter.salt(key)
+          data = self.writer.write(row, **self.writer_args)
+          #logging.warn("Mapper pre yield MR: {}:{}".format(key, data))
+          yield (key, data)
+      else:
+        data = output.write(row) if output else self.writer.write(row)
+        #logging.warn("Mapper pre yield M: {}".format(data))
+        if data:
+          yield data
+
+  def process(self, data_record, output=None, combiner=None, salter=None):
+    """
+    Matches, filters and writes a single input record
+
+    Args:
+      - data_record: db.Model, ndb.Model, dict, string (JSON object),
+        entity_pb.EntityProto or any type registered with
+        MapperRecord.register
+      - output: optional stream returned by open_output, map only rows are
+        written to it and only full blocks are yielded
+      - combiner: optional Combiner, rows of rules defining "combine" are
+        aggregated by mapper key and only yielded when the combiner is full
+      - salter: optional KeySalter, hot mapper keys of rows which are not
+        combined are salted
+
+    Yields:
+      (key, data) tuples if the matched rule defines a mapper_key_spec,
+      written data otherwise
+    """
+    matched = self.match(data_record)
+    if matched:
+      record, map_rule = matched
+      try:
+        row = record.pick_properties(map_rule["property_list"])
+        for out in self.emit(record, map_rule, row, output=output,
+                             combiner=combiner, salter=salter):
+          yield out
+      except ValueError as m:
+        logging.warn("Skipping record due to modifier errors:{}".format(m))
+
+  def process_window(self, data_records, output=None, combiner=None,
+                     salter=None):
+    """
+    Processes records concurrently, in windows of concurrency_window records
+
+    The modifier chains of every record of a window are advanced in rounds:
+    each round waits for the pending future of every record (ndb RPCs run
+    concurrently while any of them is waited for) and resumes its chain up
+    to its next asynchronous modifier. Outputs are yielded in input order.
+
+    Args:
+      - data_records: iterable of records, see process
+      - output, combiner, salter: see process
+    """
+    window = []
+    for data_record in data_records:
+      window.append(data_record)
+      if len(window) >= self.concurrency_window:
+        for out in self._process_concurrently(window, output, combiner,
+                                              salter):
+          yield out
+        window = []
+
+    for out in self._process_concurrently(window, output, combiner, salter):
+      yield out
+
+  def _process_concurrently(self, data_records, output, combiner, salter):
+    # [record, map_rule, row, evaluation, pending future]
+    states = []
+    for data_record in data_records:
+      matched = self.match(data_record)
+      if matched:
+        record, map_rule = matched
+        row = OrderedDict()
+        evaluation = record.iter_properties(map_rule["property_list"], row,
+                                            concurrent=True)
+        states.append([record, map_rule, row, evaluation, None])
+
+    active = list(states)
+    while active:
+      waiting = []
+      for state in active:
+        try:
+          if state[4] is not None:
+            state[4].get_result()
+          state[4] = next(state[3])
+          waiting.append(state)
+        except StopIteration:
+          state[4] = None
+        except ValueError as m:
+          logging.warn("Skipping record due to modifier errors:{}".format(m))
+          state[2] = None
+      active = waiting
+
+    for record, map_rule, row, _, _ in states:
+      if row is None:
+        continue
+      try:
+        for out in self.emit(record, map_rule, row, output=output,
+                             combiner=combiner, salter=salter):
+          yield out
+      except ValueError as m:
+        logging.warn("Skipping record due to modifier errors:{}".format(m))
 
 
 def record_map(data_record):
@@ -361,33 +894,129 @@ def record_map(data_record):
 
   Args:
     - data_record: db.Model, ndb.Model or string (JSON object)
+
+  Raises:
+    ValueError if the output format is written in blocks or map only rows
+    need a header, use RecordMapper
   """
 
-  ctx = context.get()
-  property_map = ctx.mapreduce_spec.mapper.params.get('property_map')
-  output_format = ctx.mapreduce_spec.mapper.params.get('output_format', 'JSON')
-  writer_args = ctx.mapreduce_spec.mapper.params.get('writer_args', dict())
-
-  record = MapperRecord.create(data_record)
-  if record:
-    map_rule = record.match_rule(property_map)
-    if map_rule and record.matches_filters(
-        property_filters=map_rule.get("property_filters"),
-        key_filters=map_rule.get("key_filters")
-      ):
-      try:
-        record.set_defaults(map_rule.get('defaults'))
-        row = record.pick_properties(map_rule["property_list"])
-        if any(row.values()):
-          writer = OutputWriter.get_writer(output_format)
-          if 'mapper_key_spec' in map_rule:
-            key = record.mapper_key(map_rule.get('mapper_key_spec'))
-            data = writer.write(row, **writer_args)
-            #logging.warn("Mapper pre yield MR: {}:{}".format(key, data))
-            yield (key, data)
-          else:
-            data = writer.write(row)
-            #logging.warn("Mapper pre yield M: {}".format(data))
-            yield data
-      except ValueError as m:
-        logging.warn("Skipping record due to modifier errors:{}".format(m))
+  plan = MapperPlan.from_context(context.get())
+  if plan.writer.BATCH or plan.writes_header:
+    msg = "Output format {} is only written by RecordMapper"
+    raise ValueError(msg.format(plan.output_format))
+  for output in plan.process(data_record):
+    yield output
+
+
+class RecordMapper(shard_life_cycle._ShardLifeCycle):
+  """
+  Chunked variant of record_map
+
+  Map only rows are buffered per shard and yielded as a single block once
+  `chunk_rows` rows or `chunk_bytes` bytes are reached, pending rows are
+  emitted at the end of every slice. (key, data) tuples are yielded as
+  record_map does, unless the rule defines a "combine" operation: rows are
+  then aggregated by key and partial aggregates are emitted at the end of
+  every slice or once `combine_max_keys` keys are buffered.
+  Use "mapreduceutils.RecordMapper" as the mapper handler.
+
+  When "salt_hot_keys" is set, hot keys of the shard are salted, see
+  skew.KeySalter.
+
+  When "concurrency_window" is greater than 1, records are buffered and
+  their asynchronous modifiers (e.g. NdbQueryModifier) evaluated
+  concurrently window by window, see MapperPlan.process_window.
+
+  The handler instance is serialized between slices, only the flag telling
+  whether the output header was written and the key salter survive.
+  """
+
+  def __init__(self):
+    self._output = None
+    self._combiner = None
+    self._salter = None
+    self._window = []
+    self._shard_id = None
+    self._header_written = False
+
+  def __getstate__(self):
+    return {'_header_written': self._header_written, '_salter': self._salter}
+
+  def __setstate__(self, state):
+    self.__init__()
+    self._header_written = state.get('_header_written', False)
+    self._salter = state.get('_salter')
+
+  def begin_shard(self, shard_ctx):
+    self._header_written = False
+    self._salter = None
+
+  def begin_slice(self, slice_ctx):
+    self._output = None
+    self._combiner = None
+    self._shard_id = slice_ctx.shard_context.id
+
+  def end_slice(self, slice_ctx):
+    if self._window:
+      for output in self._process_window():
+        slice_ctx.emit(output)
+
+    plan = MapperPlan.from_context(context.get())
+    if self._combiner:
+      for pair in plan.write_partials(self._combiner.flush()):
+        slice_ctx.emit(pair)
+    self._combiner = None
+
+    data = self._output.flush() if self._output else ''
+    # output of keyed jobs is shuffled, the header only goes before rows
+    if data or not plan.keyed:
+      data = self._pending_header() + data
+    if data:
+      slice_ctx.emit(data)
+    self._output = None
+
+  def _open(self):
+    if self._output is None:
+      plan = MapperPlan.from_context(context.get())
+      marker = hashlib.md5(str(self._shard_id)).digest()
+      self._output = plan.open_output(sync_marker=marker)
+    return self._output
+
+  def _pending_header(self):
+    if self._header_written:
+      return ''
+    self._header_written = True
+    return self._open().header()
+
+  def _with_header(self, outputs):
+    for output in outputs:
+      if isinstance(output, tuple):
+        yield output
+      else:
+        yield self._pending_header() + output
+
+  def _process_window(self):
+    plan = MapperPlan.from_context(context.get())
+    window, self._window = self._window, []
+    return self._with_header(plan.process_window(
+      window, output=self._open(), combiner=self._combiner,
+      salter=self._salter))
+
+  def __call__(self, data_record):
+    plan = MapperPlan.from_context(context.get())
+    if self._combiner is None:
+      self._combiner = plan.create_combiner()
+    if self._salter is None:
+      self._salter = plan.create_salter()
+
+    if plan.concurrency_window > 1:
+      self._window.append(data_record)
+      if len(self._window) >= plan.concurrency_window:
+        for output in self._process_window():
+          yield output
+      return
+
+    for output in self._with_header(plan.process(
+        data_record, output=self._open(), combiner=self._combiner,
+        salter=self._salter)):
+      yield output
@@ -2,13 +2,20 @@
 """
 Modulo define funciones para reducir colecciones de valores a un unico valor
 """
+from aggregates import AvgAggregate, SumAggregate
 
 
 def average_values(values):
-  _floats = [float(x) for x in values]
-  return sum(_floats, 0.0) / len(_floats)
+  agg = AvgAggregate()
+  for x in values:
+    agg.add(float(x))
+  if not agg.count:
+    raise ZeroDivisionError("average of an empty sequence")
+  return agg.finalize()
 
 
 def sum_values(values):
-  _floats = [float(x) for x in values]
-  return sum(_floats, 0.0);
+  agg = SumAggregate()
+  for x in values:
+    agg.add(float(x))
+  return agg.finalize()
@@ -0,0 +1,552 @@
+"""
+Mergeable aggregate states
+
+Every state consumes values one at a time with `add`, so values never need
+to be kept in memory. States of different shards are combined with `merge`,
+transported with `serialize` / `deserialize` (JSON compatible values) and
+turned into their final result with `finalize`.
+
+Usage:
+  partial = create_aggregate('mean')
+  for value in values:
+    partial.add(value)
+  data = partial.serialize()  # shuffled / stored
+
+  total = merge_serialized('mean', [data, other_data])
+  total.finalize()
+"""
+from collections import OrderedDict
+import heapq
+import json
+import math
+from postprocess import streaming
+from sketches import HyperLogLog, SpaceSaving, TDigest
+
+__all__ = [
+  "AGGREGATES",
+  "aggregate_class",
+  "create_aggregate",
+  "merge_partials",
+  "merge_serialized"
+]
+
+
+def _float(value):
+  try:
+    return float(value)
+  except TypeError:
+    raise ValueError("Invalid numeric value {!r}".format(value))
+
+
+class Aggregate(object):
+  NAME = None
+
+  @classmethod
+  def convert(cls, value):
+    """
+    Returns a non null value as add uses it, ValueError if it's invalid
+
+    Combiners convert every column of a row before adding any of them.
+    """
+    return value
+
+  def add(self, value):
+    """ Adds a single value, None values are ignored """
+    raise NotImplementedError()
+
+  def merge(self, other):
+    """ Merges the state of another aggregate of the same type """
+    raise NotImplementedError()
+
+  def serialize(self):
+    """ Returns the state as a JSON compatible value """
+    raise NotImplementedError()
+
+  @classmethod
+  def deserialize(cls, data):
+    """ Creates an aggregate from the output of serialize """
+    raise NotImplementedError()
+
+  def finalize(self):
+    """ Returns the final result of the aggregate """
+    return self.serialize()
+
+
+class CountAggregate(Aggregate):
+  """ Number of non null values """
+  NAME = 'count'
+
+  def __init__(self):
+    self.count = 0
+
+  def add(self, value):
+    if value is not None:
+      self.count += 1
+
+  def merge(self, other):
+    self.count += other.count
+
+  def serialize(self):
+    return self.count
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.count = int(data)
+    return agg
+
+
+class SumAggregate(Aggregate):
+  """ Compensated (Kahan-Neumaier) sum, as accurate as math.fsum """
+  NAME = 'sum'
+  convert = staticmethod(_float)
+
+  def __init__(self):
+    self.total = 0.0
+    self.compensation = 0.0
+
+  def add(self, value):
+    if value is None:
+      return
+
+    value = _float(value)
+    total = self.total + value
+    if abs(self.total) >= abs(value):
+      self.compensation += (self.total - total) + value
+    else:
+      self.compensation += (value - total) + self.total
+    self.total = total
+
+  def merge(self, other):
+    self.add(other.total)
+    self.add(other.compensation)
+
+  def serialize(self):
+    return self.total + self.compensation
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.add(data)
+    return agg
+
+
+class AvgAggregate(Aggregate):
+  """ Average, serialized as [sum, count] """
+  NAME = 'avg'
+  convert = staticmethod(_float)
+
+  def __init__(self):
+    self.sum = SumAggregate()
+    self.count = 0
+
+  def add(self, value):
+    if value is not None:
+      self.sum.add(value)
+      self.count += 1
+
+  def merge(self, other):
+    self.sum.merge(other.sum)
+    self.count += other.count
+
+  def serialize(self):
+    return [self.sum.serialize(), self.count]
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.sum.add(data[0])
+    agg.count = int(data[1])
+    return agg
+
+  def finalize(self):
+    if not self.count:
+      return None
+    return self.sum.serialize() / self.count
+
+
+class MeanAggregate(Aggregate):
+  """
+  Mean and variance through Welford's online algorithm
+
+  Serialized as [count, mean, m2], m2 being the sum of squared differences
+  from the mean. States are merged with Chan's parallel formula.
+  """
+  NAME = 'mean'
+  convert = staticmethod(_float)
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+
+  def add(self, value):
+    if value is None:
+      return
+
+    value = _float(value)
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+
+  def merge(self, other):
+    if not other.count:
+      return
+
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / count
+    self.m2 += other.m2 + delta * delta * self.count * other.count / count
+    self.count = count
+
+  def serialize(self):
+    return [self.count, self.mean, self.m2]
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.count, agg.mean, agg.m2 = int(data[0]), float(data[1]), float(data[2])
+    return agg
+
+  def variance(self):
+    """ Sample variance, None with less than two values """
+    if self.count < 2:
+      return None
+    return self.m2 / (self.count - 1)
+
+  def finalize(self):
+    return self.mean if self.count else None
+
+
+class VarianceAggregate(MeanAggregate):
+  NAME = 'variance'
+
+  def finalize(self):
+    return self.variance()
+
+
+class StdDevAggregate(MeanAggregate):
+  NAME = 'stddev'
+
+  def finalize(self):
+    variance = self.variance()
+    return None if variance is None else math.sqrt(variance)
+
+
+class MinAggregate(Aggregate):
+  NAME = 'min'
+
+  def __init__(self):
+    self.current = None
+
+  def add(self, value):
+    if value is not None and (self.current is None or value < self.current):
+      self.current = value
+
+  def merge(self, other):
+    self.add(other.current)
+
+  def serialize(self):
+    return self.current
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.current = data
+    return agg
+
+
+class MaxAggregate(MinAggregate):
+  NAME = 'max'
+
+  def add(self, value):
+    if value is not None and (self.current is None or value > self.current):
+      self.current = value
+
+
+class DistinctAggregate(Aggregate):
+  """ Approximate distinct count, a 4 KB HyperLogLog """
+  NAME = 'distinct'
+
+  def __init__(self):
+    self.sketch = HyperLogLog()
+
+  def add(self, value):
+    if value is not None:
+      self.sketch.add(value)
+
+  def merge(self, other):
+    self.sketch.merge(other.sketch)
+
+  def serialize(self):
+    return self.sketch.serialize()
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.sketch = HyperLogLog.deserialize(data)
+    return agg
+
+  def finalize(self):
+    return self.sketch.count()
+
+
+class QuantileAggregate(Aggregate):
+  """ Approximate quantile, a t-digest of about 100 centroids """
+  QUANTILE = None
+  convert = staticmethod(_float)
+
+  def __init__(self):
+    self.sketch = TDigest()
+
+  def add(self, value):
+    if value is not None:
+      self.sketch.add(value)
+
+  def merge(self, other):
+    self.sketch.merge(other.sketch)
+
+  def serialize(self):
+    return self.sketch.serialize()
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.sketch = TDigest.deserialize(data)
+    return agg
+
+  def finalize(self):
+    return self.sketch.quantile(self.QUANTILE)
+
+
+class MedianAggregate(QuantileAggregate):
+  NAME = 'median'
+  QUANTILE = 0.5
+
+
+class P95Aggregate(QuantileAggregate):
+  NAME = 'p95'
+  QUANTILE = 0.95
+
+
+class P99Aggregate(QuantileAggregate):
+  NAME = 'p99'
+  QUANTILE = 0.99
+
+
+class TopKAggregate(Aggregate):
+  """
+  K highest values, kept in a bounded min heap
+
+  Serialized and finalized as the list of values from the highest down.
+  """
+  NAME = 'top_k'
+  K = 20
+
+  def __init__(self):
+    self.heap = []
+
+  def add(self, value):
+    if value is None:
+      return
+    if len(self.heap) < self.K:
+      heapq.heappush(self.heap, value)
+    elif value > self.heap[0]:
+      heapq.heapreplace(self.heap, value)
+
+  def merge(self, other):
+    for value in other.heap:
+      self.add(value)
+
+  def serialize(self):
+    return sorted(self.heap, reverse=True)
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    for value in data:
+      agg.add(value)
+    return agg
+
+
+class HeavyHittersAggregate(Aggregate):
+  """
+  Most frequent values, a Space Saving summary of CAPACITY counters
+
+  Finalizes to the K most frequent [value, count] pairs.
+  """
+  NAME = 'heavy_hitters'
+  K = 20
+  CAPACITY = 100
+
+  def __init__(self):
+    self.sketch = SpaceSaving(self.CAPACITY)
+
+  def add(self, value):
+    if value is not None:
+      self.sketch.add(value)
+
+  def merge(self, other):
+    self.sketch.merge(other.sketch)
+
+  def serialize(self):
+    return self.sketch.serialize()
+
+  @classmethod
+  def deserialize(cls, data):
+    agg = cls()
+    agg.sketch = SpaceSaving.deserialize(data)
+    return agg
+
+  def finalize(self):
+    return [[item, count] for item, count, _ in self.sketch.top(self.K)]
+
+
+AGGREGATES = dict((agg.NAME, agg) for agg in (
+  CountAggregate, SumAggregate, AvgAggregate, MeanAggregate,
+  VarianceAggregate, StdDevAggregate, MinAggregate, MaxAggregate,
+  DistinctAggregate, MedianAggregate, P95Aggregate, P99Aggregate,
+  TopKAggregate, HeavyHittersAggregate
+))
+
+
+def aggregate_class(name):
+  """ Returns the aggregate class registered as name """
+  try:
+    return AGGREGATES[name]
+  except KeyError:
+    raise ValueError("Aggregate '{}' is not supported".format(name))
+
+
+def create_aggregate(name):
+  """ Instances the aggregate registered as name """
+  return aggregate_class(name)()
+
+
+def merge_serialized(name, partials):
+  """
+  Merges serialized partial aggregates
+
+  Args:
+    - name: (str) name of the aggregate
+    - partials: iterable of serialized states, JSON strings are decoded
+
+  Returns:
+    Aggregate instance holding the merged state
+  """
+  return _merge_states(name, (json.loads(data)
+                              if isinstance(data, basestring) else data
+                              for data in partials))
+
+
+def _merge_states(name, states):
+  total = create_aggregate(name)
+  cls = type(total)
+  for data in states:
+    total.merge(cls.deserialize(data))
+  return total
+
+
+def merge_partials(name, partials):
+  """
+  Merges the partial rows yielded by combined rules
+
+  Args:
+    - name: (str) name of the aggregate of the rule
+    - partials: iterable of partial rows, JSON objects mapping every column
+      to its serialized state, see MapperPlan.write_partials
+
+  Returns:
+    OrderedDict mapping every column to the Aggregate merging its states
+  """
+  states = OrderedDict()
+  for row in partials:
+    if isinstance(row, basestring):
+      row = json.loads(row, object_pairs_hook=OrderedDict)
+    for col, data in row.iteritems():
+      states.setdefault(col, []).append(data)
+
+  # states are already decoded, text states of min or max are not JSON
+  return OrderedDict((col, _merge_states(name, data))
+                     for col, data in states.iteritems())
+
+
+def _finalizer(name):
+  @streaming
+  def finalize(values):
+    for k, v in values:
+      yield k, merge_serialized(name, [v]).finalize()
+
+  finalize.__name__ = 'finalize_{}'.format(name)
+  finalize.__doc__ = """
+  Post processing function finalizing serialized '{}' partials
+  """.format(name)
+  return finalize
+
+
+finalize_avg = _finalizer('avg')
+finalize_mean = _finalizer('mean')
+finalize_variance = _finalizer('variance')
+finalize_stddev = _finalizer('stddev')
+finalize_distinct = _finalizer('distinct')
+finalize_median = _finalizer('median')
+finalize_p95 = _finalizer('p95')
+finalize_p99 = _finalizer('p99')
+finalize_top_k = _finalizer('top_k')
+finalize_heavy_hitters = _finalizer('heavy_hitters')
+
+
+@streaming
+def approx_distinct(values):
+  """
+  Estimates the number of distinct values of the group
+
+  Memory is bounded by a HyperLogLog, the estimate is stored at group level.
+  """
+  agg = create_aggregate('distinct')
+  for k, v in values:
+    agg.add(v)
+  yield '', agg.finalize()
+
+
+@streaming
+def approx_quantiles(values):
+  """
+  Estimates the median, 95th and 99th percentiles of the group values
+
+  Memory is bounded by a t-digest, quantiles are stored under the "p50",
+  "p95" and "p99" keys.
+  """
+  agg = create_aggregate('median')
+  for k, v in values:
+    agg.add(float(v))
+  for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+    yield name, agg.sketch.quantile(q)
+
+
+@streaming
+def top_k(values, k=TopKAggregate.K):
+  """
+  Keeps the k records with the highest values of the group
+
+  A bounded heap is used, so memory depends on k and not on the size of the
+  group. Records are yielded from the highest value down. k is set from
+  postproc_funcs with ["mapreduceutils.aggregates.top_k", {"k": 5}].
+  """
+  for key, value in heapq.nlargest(int(k), values, key=lambda r: float(r[1])):
+    yield key, value
+
+
+@streaming
+def heavy_hitters(values, k=HeavyHittersAggregate.K):
+  """
+  Merges the serialized "heavy_hitters" partials of the group
+
+  Partials generated by map side combiners of different shards are merged
+  into a single Space Saving summary, the k most frequent values are
+  yielded as (value, count) records.
+  """
+  total = merge_serialized('heavy_hitters', (v for _, v in values))
+  for item, count, _ in total.sketch.top(int(k)):
+    yield item, count
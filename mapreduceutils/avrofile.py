@@ -0,0 +1,434 @@
+"""
+Avro object container file support
+
+Derives an Avro schema from a property list (plain attributes and modifier
+groups) and writes / reads binary encoded container files. Only the subset of
+the specification needed by the mapper output is implemented: records whose
+fields are unions of primitive types, with "null" and "deflate" codecs.
+
+References:
+  - https://avro.apache.org/docs/1.7.7/spec.html
+"""
+from collections import OrderedDict
+from cStringIO import StringIO
+import datetime
+import json
+import os
+import re
+import struct
+import zlib
+from modifiers import FieldModifier
+
+__all__ = [
+  "AvroContainerWriter",
+  "AvroReader",
+  "schema_for_property_list"
+]
+
+MAGIC = 'Obj\x01'
+SYNC_SIZE = 16
+
+# Union used for plain attributes, their type is only known at runtime
+ANY_TYPE = ["null", "long", "double", "boolean", "string"]
+
+# Maps FieldModifier.guess_return_type() names to Avro primitive types
+_GUESSED_TYPES = {
+  'int': 'long',
+  'long': 'long',
+  'float': 'double',
+  'bool': 'boolean',
+  'basestring': 'string',
+  'str': 'string',
+  'unicode': 'string'
+}
+
+_INVALID_NAME_CHARS = re.compile(r'[^A-Za-z0-9_]')
+
+
+def _field_name(name, used):
+  """ Converts a property name into a valid, unique Avro field name """
+  field = _INVALID_NAME_CHARS.sub('_', name)
+  if not field or field[0].isdigit():
+    field = '_' + field
+
+  candidate, idx = field, 1
+  while candidate in used:
+    idx += 1
+    candidate = "{}_{}".format(field, idx)
+  used.add(candidate)
+  return candidate
+
+
+def _modifier_type(mod_def):
+  """ Resolves the Avro union for the last modifier of a modifier group """
+  try:
+    mod = FieldModifier.from_dict(mod_def)
+    guessed = mod.guess_return_type()
+  except (ValueError, ImportError, TypeError):
+    return None, ["null", "string"]
+
+  doc = getattr(mod, 'META_NAME', None)
+  avro_type = _GUESSED_TYPES.get(guessed, 'string')
+  if avro_type == 'string':
+    return doc, ["null", "string"]
+
+  # Modifiers report conversion errors as messages, keep them readable
+  return doc, ["null", avro_type, "string"]
+
+
+def schema_for_property_list(property_list, name="MapperRecord",
+                             namespace="mapreduceutils"):
+  """
+  Derives an Avro record schema from a property list
+
+  Plain attributes are typed with a union of every primitive type, since
+  their type is only known once the record is resolved. Modifier groups are
+  typed after the `guess_return_type()` of the last modifier in the group.
+
+  Args:
+    - property_list: (list) property list as given in the property map rule
+    - name: (str) name of the generated Avro record
+    - namespace: (str) namespace of the generated Avro record
+
+  Returns:
+    dict containing the Avro schema, every field has an additional "source"
+    attribute holding the property name it was derived from.
+  """
+  fields = []
+  used = set()
+  for prop in property_list:
+    if isinstance(prop, basestring):
+      source, doc, avro_type = prop, None, list(ANY_TYPE)
+    elif isinstance(prop, list) and prop:
+      source = prop[-1]['identifier']
+      doc, avro_type = _modifier_type(prop[-1])
+    else:
+      continue
+
+    field = {"name": _field_name(source, used), "type": avro_type,
+             "default": None, "source": source}
+    if doc:
+      field["doc"] = doc
+    fields.append(field)
+
+  return {
+    "type": "record",
+    "name": name,
+    "namespace": namespace,
+    "fields": fields
+  }
+
+
+def _text(value):
+  """ Converts a value into the text written to Avro string fields """
+  if isinstance(value, unicode):
+    return value
+  if isinstance(value, str):
+    return value.decode('utf-8')
+  if isinstance(value, datetime.datetime):
+    return unicode(value.strftime("%Y-%m-%d %H:%M:%S"))
+  if isinstance(value, datetime.date):
+    return unicode(value.strftime("%Y-%m-%d"))
+  if isinstance(value, (dict, list, tuple)):
+    return unicode(json.dumps(value, default=unicode))
+  return unicode(value)
+
+
+class BinaryEncoder(object):
+  """ Avro binary encoding of primitive types """
+
+  def __init__(self, buf):
+    self.buf = buf
+
+  def write_long(self, n):
+    n = (n << 1) ^ (n >> 63)
+    out = []
+    while n & ~0x7F:
+      out.append(chr((n & 0x7F) | 0x80))
+      n >>= 7
+    out.append(chr(n))
+    self.buf.write(''.join(out))
+
+  def write_double(self, value):
+    self.buf.write(struct.pack('<d', value))
+
+  def write_boolean(self, value):
+    self.buf.write('\x01' if value else '\x00')
+
+  def write_bytes(self, value):
+    self.write_long(len(value))
+    self.buf.write(value)
+
+  def write_string(self, value):
+    self.write_bytes(_text(value).encode('utf-8'))
+
+
+class BinaryDecoder(object):
+  """ Avro binary decoding of primitive types """
+
+  def __init__(self, buf):
+    self.buf = buf
+
+  def read(self, size):
+    data = self.buf.read(size)
+    if len(data) != size:
+      raise EOFError("Expected {} bytes, got {}".format(size, len(data)))
+    return data
+
+  def read_long(self):
+    b = ord(self.read(1))
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+      b = ord(self.read(1))
+      n |= (b & 0x7F) << shift
+      shift += 7
+    return (n >> 1) ^ -(n & 1)
+
+  def read_double(self):
+    return struct.unpack('<d', self.read(8))[0]
+
+  def read_boolean(self):
+    return self.read(1) == '\x01'
+
+  def read_bytes(self):
+    return self.read(self.read_long())
+
+  def read_string(self):
+    return self.read_bytes().decode('utf-8')
+
+
+def _branch_for(value, union):
+  """ Picks the union branch index used to encode value """
+  if value is None:
+    return union.index("null")
+
+  if isinstance(value, bool):
+    wanted = 'boolean'
+  elif isinstance(value, (int, long)):
+    wanted = 'long' if 'long' in union else 'double'
+  elif isinstance(value, float):
+    wanted = 'double'
+  else:
+    wanted = 'string'
+
+  if wanted in union:
+    return union.index(wanted)
+  return union.index('string')
+
+
+def _write_datum(encoder, avro_type, value):
+  if isinstance(avro_type, list):
+    idx = _branch_for(value, avro_type)
+    encoder.write_long(idx)
+    _write_datum(encoder, avro_type[idx], value)
+  elif avro_type == 'null':
+    pass
+  elif avro_type == 'long':
+    encoder.write_long(int(value))
+  elif avro_type == 'double':
+    encoder.write_double(float(value))
+  elif avro_type == 'boolean':
+    encoder.write_boolean(value)
+  elif avro_type == 'bytes':
+    encoder.write_bytes(value)
+  elif avro_type == 'string':
+    encoder.write_string(value)
+  else:
+    raise ValueError("Unsupported Avro type '{}'".format(avro_type))
+
+
+def _read_datum(decoder, avro_type):
+  if isinstance(avro_type, list):
+    return _read_datum(decoder, avro_type[decoder.read_long()])
+  elif isinstance(avro_type, dict):
+    if avro_type.get('type') == 'record':
+      return OrderedDict((f['name'], _read_datum(decoder, f['type']))
+                         for f in avro_type['fields'])
+    return _read_datum(decoder, avro_type['type'])
+  elif avro_type == 'null':
+    return None
+  elif avro_type in ('long', 'int'):
+    return decoder.read_long()
+  elif avro_type == 'double':
+    return decoder.read_double()
+  elif avro_type == 'float':
+    return struct.unpack('<f', decoder.read(4))[0]
+  elif avro_type == 'boolean':
+    return decoder.read_boolean()
+  elif avro_type == 'bytes':
+    return decoder.read_bytes()
+  elif avro_type == 'string':
+    return decoder.read_string()
+  raise ValueError("Unsupported Avro type '{}'".format(avro_type))
+
+
+def _deflate(data):
+  compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+  return compressor.compress(data) + compressor.flush()
+
+
+def _inflate(data):
+  return zlib.decompress(data, -15)
+
+
+class AvroContainerWriter(object):
+  """
+  Incremental writer of Avro object container files
+
+  Records are encoded as they are appended and grouped in blocks, every
+  block is compressed with the file codec and terminated by the sync marker,
+  so the resulting file remains splittable.
+
+  Usage:
+    writer = AvroContainerWriter(schema)
+    out.write(writer.header())
+    for row in rows:
+      out.write(writer.write(row))
+    out.write(writer.flush())
+  """
+
+  CODECS = ('null', 'deflate')
+
+  def __init__(self, schema, codec='deflate', block_size=64 * 1024,
+               sync_marker=None, block_rows=None):
+    """
+    Args:
+      - schema: (dict) Avro record schema, see `schema_for_property_list`
+      - codec: (str) either "deflate" (default) or "null"
+      - block_size: (int) approximate size in bytes of uncompressed blocks
+      - sync_marker: (str) 16 bytes marker, a random one is used by default.
+        Writers appending to the same file must share the marker.
+      - block_rows: (int) optional maximum number of records per block
+    """
+    if codec not in self.CODECS:
+      raise ValueError("Avro codec '{}' is not supported".format(codec))
+
+    if sync_marker is None:
+      sync_marker = os.urandom(SYNC_SIZE)
+    elif len(sync_marker) != SYNC_SIZE:
+      raise ValueError("Sync marker should be {} bytes long".format(SYNC_SIZE))
+
+    self.schema = schema
+    self.codec = codec
+    self.block_size = block_size
+    self.block_rows = block_rows
+    self.sync_marker = sync_marker
+    self._fields = [(f.get('source', f['name']), f['type'])
+                    for f in schema['fields']]
+    self._buffer = StringIO()
+    self._encoder = BinaryEncoder(self._buffer)
+    self._count = 0
+
+  def header(self):
+    """ Returns the container file header """
+    buf = StringIO()
+    encoder = BinaryEncoder(buf)
+    buf.write(MAGIC)
+    meta = {
+      'avro.schema': json.dumps(self.schema),
+      'avro.codec': self.codec
+    }
+    encoder.write_long(len(meta))
+    for key, value in sorted(meta.items()):
+      encoder.write_string(key)
+      encoder.write_bytes(value)
+    encoder.write_long(0)
+    buf.write(self.sync_marker)
+    return buf.getvalue()
+
+  def write(self, data_obj):
+    """
+    Encodes a record into the current block
+
+    Args:
+      - data_obj: (dict) OrderedDict as generated by pick_properties
+
+    Returns:
+      The encoded block if the block size or rows were reached, an empty string
+      otherwise.
+    """
+    for source, avro_type in self._fields:
+      _write_datum(self._encoder, avro_type, data_obj.get(source))
+    self._count += 1
+
+    if (self._buffer.tell() >= self.block_size
+       or (self.block_rows and self._count >= self.block_rows)):
+      return self.flush()
+    return ''
+
+  def flush(self):
+    """ Returns the pending records as a block, or '' if there are none """
+    if not self._count:
+      return ''
+
+    data = self._buffer.getvalue()
+    if self.codec == 'deflate':
+      data = _deflate(data)
+
+    buf = StringIO()
+    encoder = BinaryEncoder(buf)
+    encoder.write_long(self._count)
+    encoder.write_long(len(data))
+    buf.write(data)
+    buf.write(self.sync_marker)
+
+    self._buffer = StringIO()
+    self._encoder = BinaryEncoder(self._buffer)
+    self._count = 0
+    return buf.getvalue()
+
+
+class AvroReader(object):
+  """
+  Reads records from an Avro object container file
+
+  Args:
+    - fileobj: file like object or string with the container file contents
+  """
+
+  def __init__(self, fileobj):
+    if isinstance(fileobj, basestring):
+      fileobj = StringIO(fileobj)
+
+    self._decoder = BinaryDecoder(fileobj)
+    if self._decoder.read(len(MAGIC)) != MAGIC:
+      raise ValueError("Not an Avro object container file")
+
+    self.metadata = self._read_metadata()
+    self.schema = json.loads(self.metadata['avro.schema'])
+    self.codec = self.metadata.get('avro.codec', 'null')
+    if self.codec not in AvroContainerWriter.CODECS:
+      raise ValueError("Avro codec '{}' is not supported".format(self.codec))
+    self.sync_marker = self._decoder.read(SYNC_SIZE)
+
+  def _read_metadata(self):
+    meta = {}
+    count = self._decoder.read_long()
+    while count:
+      if count < 0:  # block size follows negative counts
+        count = -count
+        self._decoder.read_long()
+      for _ in xrange(count):
+        key = self._decoder.read_string()
+        meta[key] = self._decoder.read_bytes()
+      count = self._decoder.read_long()
+    return meta
+
+  def __iter__(self):
+    while True:
+      try:
+        count = self._decoder.read_long()
+      except EOFError:
+        return
+
+      data = self._decoder.read(self._decoder.read_long())
+      if self._decoder.read(SYNC_SIZE) != self.sync_marker:
+        raise ValueError("Invalid sync marker, the file is corrupt")
+
+      if self.codec == 'deflate':
+        data = _inflate(data)
+
+      decoder = BinaryDecoder(StringIO(data))
+      for _ in xrange(count):
+        yield _read_datum(decoder, self.schema)
@@ -0,0 +1,71 @@
+"""
+Map side combiner
+
+Aggregates the rows generated for the same mapper key within a shard, so a
+single partial aggregate per key is shuffled instead of one value per record.
+"""
+from collections import OrderedDict
+from aggregates import aggregate_class, create_aggregate
+
+__all__ = ["Combiner"]
+
+
+class Combiner(object):
+  """
+  Per shard in memory aggregation of rows by mapper key
+
+  Every column of the rows is aggregated with the operation of the rule
+  (see aggregates.AGGREGATES). Partial aggregates are rows of serialized
+  states, returned when more than `max_keys` keys are buffered, and by
+  `flush` which should be called at the end of every slice.
+  """
+
+  def __init__(self, max_keys=10000):
+    self.max_keys = max_keys
+    self._keys = OrderedDict()
+
+  def __len__(self):
+    return len(self._keys)
+
+  def add(self, key, row, operation):
+    """
+    Aggregates a row into the partial aggregate of its key
+
+    Args:
+      - key: mapper key of the row
+      - row: (OrderedDict) row generated by pick_properties
+      - operation: (str) name of the aggregate applied to every column
+
+    Returns:
+      list of (key, row) partial aggregates if the memory limit was reached,
+      an empty list otherwise
+
+    Raises:
+      ValueError if a value can't be aggregated, no state is changed then
+    """
+    convert = aggregate_class(operation).convert
+    values = [(col, None if value is None else convert(value))
+              for col, value in row.iteritems()]
+
+    columns = self._keys.get(key)
+    if columns is None:
+      columns = OrderedDict((col, create_aggregate(operation)) for col in row)
+      self._keys[key] = columns
+
+    for col, value in values:
+      if col not in columns:
+        columns[col] = create_aggregate(operation)
+      columns[col].add(value)
+
+    if len(self._keys) > self.max_keys:
+      return self.flush()
+    return []
+
+  def flush(self):
+    """ Returns every buffered (key, row) partial aggregate and clears them """
+    partials = [
+      (key, OrderedDict((col, agg.serialize()) for col, agg in columns.iteritems()))
+      for key, columns in self._keys.iteritems()
+    ]
+    self._keys = OrderedDict()
+    return partials
@@ -0,0 +1,176 @@
+"""
+Streaming compression of writer output
+
+Rows generated by an OutputWriter are batched and compressed in independent
+frames (gzip members or zstd frames). Concatenated frames form a valid
+compressed stream, and since every frame can be decompressed on its own,
+files can still be split at frame boundaries.
+"""
+from cStringIO import StringIO
+import gzip
+import logging
+import zlib
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+__all__ = [
+  "CompressedOutput",
+  "decompress"
+]
+
+EXTENSIONS = {
+  'gzip': 'gz',
+  'zstd': 'zst'
+}
+
+
+def _resolve_codec(codec):
+  if codec == 'auto':
+    return 'zstd' if zstandard is not None else 'gzip'
+
+  if codec not in EXTENSIONS:
+    raise ValueError("Compression codec '{}' is not supported".format(codec))
+
+  if codec == 'zstd' and zstandard is None:
+    raise ValueError("zstd compression requires the zstandard package")
+
+  return codec
+
+
+def _gzip_frame(data, level):
+  buf = StringIO()
+  # mtime is fixed so identical batches generate identical frames
+  with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+    f.write(data)
+  return buf.getvalue()
+
+
+def decompress(data, codec='gzip'):
+  """
+  Decompresses a stream of concatenated frames
+
+  Args:
+    - data: (str) compressed data, one or more frames
+    - codec: (str) "gzip" or "zstd"
+
+  Returns:
+    String with the uncompressed data of all the frames
+  """
+  codec = _resolve_codec(codec)
+  out = []
+  while data:
+    if codec == 'gzip':
+      decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+      decompressor = zstandard.ZstdDecompressor().decompressobj()
+    out.append(decompressor.decompress(data))
+    data = decompressor.unused_data
+
+  return ''.join(out)
+
+
+class CompressedOutput(object):
+  """
+  Wraps an OutputWriter, compressing its output in batches
+
+  Usage:
+    output = CompressedOutput(OutputWriter.get_writer('csv'))
+    for row in rows:
+      out.write(output.write(row))
+    out.write(output.flush())
+    logging.info("compression ratio %.2f", output.ratio)
+  """
+
+  def __init__(self, writer, codec='gzip', batch_rows=1000,
+               batch_bytes=256 * 1024, level=6, writer_args=None, header=''):
+    """
+    Args:
+      - writer: (OutputWriter) writer class used to encode every row
+      - codec: (str) "gzip" (default), "zstd" or "auto" which prefers zstd
+        when the zstandard package is available
+      - batch_rows: (int) maximum number of rows compressed in a frame
+      - batch_bytes: (int) maximum uncompressed size of a frame
+      - level: (int) compression level given to the codec
+      - writer_args: (dict) keyword arguments passed to writer.write()
+      - header: (str) uncompressed header of the wrapped writer, e.g. the
+        column names of json_array output
+    """
+    self.writer = writer
+    self.codec = _resolve_codec(codec)
+    self.batch_rows = batch_rows
+    self.batch_bytes = batch_bytes
+    self.level = level
+    self.writer_args = writer_args or {}
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self._rows = []
+    self._size = 0
+    self._compressor = None
+    if self.codec == 'zstd':
+      self._compressor = zstandard.ZstdCompressor(level=level)
+    self._header = header
+    self._header_frame = None
+
+  @property
+  def extension(self):
+    return EXTENSIONS[self.codec]
+
+  @property
+  def ratio(self):
+    """ Uncompressed / compressed size of the frames generated so far """
+    if not self.bytes_out:
+      return 0.0
+    return float(self.bytes_in) / self.bytes_out
+
+  def header(self):
+    """
+    Returns the header of the wrapped writer compressed in its own frame
+
+    The frame is the same for every stream of a writer, so it can be
+    skipped when concatenating streams, see OutputWriter.open.
+    """
+    if not self._header:
+      return ''
+    if self._header_frame is None:
+      self._header_frame = self._compress(self._header)
+    return self._header_frame
+
+  def _compress(self, data):
+    if self.codec == 'zstd':
+      frame = self._compressor.compress(data)
+    else:
+      frame = _gzip_frame(data, self.level)
+
+    self.bytes_in += len(data)
+    self.bytes_out += len(frame)
+    logging.debug("Compressed %s bytes into a %s bytes %s frame",
+                  len(data), len(frame), self.codec)
+    return frame
+
+  def write(self, data_obj):
+    """
+    Encodes the row with the wrapped writer and adds it to the current batch
+
+    Returns:
+      A compressed frame if the batch is full, an empty string otherwise
+    """
+    data = self.writer.write(data_obj, **self.writer_args)
+    self._rows.append(data)
+    self._size += len(data)
+
+    if len(self._rows) >= self.batch_rows or self._size >= self.batch_bytes:
+      return self.flush()
+    return ''
+
+  def flush(self):
+    """ Compresses the pending rows into a frame, '' if there are none """
+    if not self._rows:
+      return ''
+
+    frame = self._compress(''.join(self._rows))
+    self._rows = []
+    self._size = 0
+    return frame
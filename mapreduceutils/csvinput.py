@@ -0,0 +1,140 @@
+"""
+CSV input
+
+The header of a CSV file is parsed once into a CSVColumns index mapping
+column names to their position and converter. Rows are the plain lists
+generated by csv.reader, wrapped in CSVRow so MapperRecord.create wraps them
+in a CSVRecord resolving attributes by position.
+
+Columns are text (unicode) unless typed with column_types, e.g.
+{"amount": "float", "quantity": "int"}. Empty typed cells are None.
+
+Usage:
+  columns = CSVColumns.from_header(f.readline(), {"amount": "float"})
+  for row in columns.rows(f):
+    record = MapperRecord.create(row)
+"""
+import csv
+import json
+import logging
+
+__all__ = [
+  "COLUMN_TYPES",
+  "CSVColumns",
+  "CSVRow"
+]
+
+_TRUE = frozenset(['1', 'true', 't', 'yes', 'y'])
+_FALSE = frozenset(['0', 'false', 'f', 'no', 'n'])
+
+
+def _text(value):
+  if isinstance(value, unicode):
+    return value
+  return value.decode('utf-8')
+
+
+def _bool(value):
+  value = value.strip().lower()
+  if value in _TRUE:
+    return True
+  if value in _FALSE:
+    return False
+  raise ValueError("Invalid boolean '{}'".format(value))
+
+
+COLUMN_TYPES = {
+  'text': _text,
+  'int': int,
+  'float': float,
+  'bool': _bool,
+  'json': json.loads
+}
+
+
+class CSVRow(list):
+  """ Values of a CSV row with the CSVColumns of its file """
+
+  def __init__(self, values, columns):
+    super(CSVRow, self).__init__(values)
+    self.columns = columns
+
+
+class CSVColumns(object):
+  """
+  Column index of a CSV file
+
+  Every column name resolves to a (position, converter) pair the first time
+  it's read, compile resolves the columns referenced by a plan up front.
+  """
+
+  def __init__(self, fieldnames, column_types=None):
+    """
+    Args:
+      - fieldnames: (list) unicode column names, in file order
+      - column_types: (dict) column name to type, one of COLUMN_TYPES.
+        Columns are "text" by default.
+    """
+    self.fieldnames = list(fieldnames)
+    self.positions = {}
+    for position, name in enumerate(self.fieldnames):
+      self.positions.setdefault(name, position)
+
+    self.column_types = dict(column_types or {})
+    for name, type_name in self.column_types.iteritems():
+      if type_name not in COLUMN_TYPES:
+        msg = "Unsupported type '{}' of column '{}', use one of {}"
+        raise ValueError(msg.format(type_name, name, sorted(COLUMN_TYPES)))
+    self._resolvers = {}
+
+  @classmethod
+  def from_header(cls, header, column_types=None):
+    """
+    Args:
+      - header: (str) header line or list of column names
+      - column_types: see __init__
+    """
+    if isinstance(header, basestring):
+      header = next(csv.reader([header]))
+    return cls([_text(name) for name in header], column_types)
+
+  def compile(self, names):
+    """ Resolves the columns names, returns self """
+    for name in names:
+      self.resolver(name)
+    return self
+
+  def resolver(self, name):
+    """ (position, converter) of a column, position is None if missing """
+    try:
+      return self._resolvers[name]
+    except KeyError:
+      converter = COLUMN_TYPES[self.column_types.get(name, 'text')]
+      resolver = self._resolvers[name] = (self.positions.get(name), converter)
+      return resolver
+
+  def value(self, row, name):
+    """ Converted value of column name, None if missing or empty """
+    position, converter = self.resolver(name)
+    if position is None or position >= len(row):
+      return None
+
+    value = row[position]
+    if converter is _text:
+      return _text(value)
+    if not value:
+      return None
+    try:
+      return converter(value)
+    except ValueError:
+      msg = u"Unable to convert column '{}' value '{}'"
+      logging.warn(msg.format(name, _text(value)))
+      return None
+
+  def row(self, values):
+    return CSVRow(values, self)
+
+  def rows(self, lines):
+    """ Yields the CSVRow of every line, lines can't contain the header """
+    for values in csv.reader(lines):
+      yield CSVRow(values, self)
@@ -0,0 +1,66 @@
+"""
+JSON input decoders
+
+JSON records are decoded by a pluggable decoder: the stdlib "json" module,
+"simplejson" or "ujson" when installed, "auto" picking the fastest one
+available, or the qualified name of any callable taking a string.
+
+Usage:
+  decoder = get_json_decoder('auto')
+  obj = decoder(line)
+"""
+import json
+from utils import for_name
+
+try:
+  import simplejson
+except ImportError:
+  simplejson = None
+
+try:
+  import ujson
+except ImportError:
+  ujson = None
+
+__all__ = [
+  "JSON_DECODERS",
+  "get_json_decoder"
+]
+
+JSON_DECODERS = {
+  'json': json.loads
+}
+if simplejson is not None:
+  JSON_DECODERS['simplejson'] = simplejson.loads
+if ujson is not None:
+  JSON_DECODERS['ujson'] = ujson.loads
+
+# fastest first, see get_json_decoder
+_PREFERENCE = ('ujson', 'simplejson', 'json')
+
+
+def get_json_decoder(name='json'):
+  """
+  Returns the decoder named name
+
+  Args:
+    - name: (str) one of JSON_DECODERS, "auto" for the fastest installed
+      one, or the qualified name of a decoding function
+
+  Raises:
+    ValueError if the decoder is not available
+  """
+  if name == 'auto':
+    name = next(n for n in _PREFERENCE if n in JSON_DECODERS)
+
+  if name in JSON_DECODERS:
+    return JSON_DECODERS[name]
+
+  if '.' in name:
+    try:
+      return for_name(name)
+    except ImportError:
+      pass
+
+  msg = "JSON decoder '{}' is not available, use one of {}"
+  raise ValueError(msg.format(name, sorted(JSON_DECODERS)))
@@ -0,0 +1,135 @@
+"""
+Streaming grouping of (group_key, item) pairs
+
+Groups are handed out as soon as they are complete, so memory is bounded by
+the largest group instead of the whole input. Sorted input is grouped as it
+streams, unsorted input goes through an external merge sort which spills
+sorted runs to temporary files.
+"""
+import cPickle as pickle
+import heapq
+import itertools
+from operator import itemgetter
+import tempfile
+
+__all__ = [
+  "ExternalSorter",
+  "group_pairs",
+  "merge_sorted"
+]
+
+_first = itemgetter(0)
+
+
+def _sorted_groups(pairs):
+  """ Groups consecutive pairs, checking group keys are ascending """
+  previous = None
+  for idx, (key, group) in enumerate(itertools.groupby(pairs, key=_first)):
+    if idx and key < previous:
+      msg = u"Input is not sorted, group '{}' found after '{}'"
+      raise ValueError(msg.format(key, previous))
+    previous = key
+    yield key, [item for _, item in group]
+
+
+def merge_sorted(iterables):
+  """
+  Merges iterables of (group_key, item) pairs sorted by group_key
+
+  Pairs with equal group keys keep the order of the iterables they come
+  from, items are never compared.
+  """
+  def decorate(idx, pairs):
+    for seq, (key, item) in enumerate(pairs):
+      yield key, idx, seq, item
+
+  merged = heapq.merge(*[decorate(i, it) for i, it in enumerate(iterables)])
+  for key, _, _, item in merged:
+    yield key, item
+
+
+class ExternalSorter(object):
+  """
+  Sorts (group_key, item) pairs by group key, spilling to temporary files
+
+  Pairs are kept in memory until `max_items` are buffered, the buffer is then
+  sorted and written as a run to a temporary file. Runs are merged while
+  iterating. The sort is stable: items sharing a group key keep their
+  insertion order.
+  """
+
+  def __init__(self, max_items=100000, tmpdir=None):
+    """
+    Args:
+      - max_items: (int) number of pairs buffered before spilling a run
+      - tmpdir: (str) directory for the temporary files, system default
+        if not given
+    """
+    self.max_items = max_items
+    self.tmpdir = tmpdir
+    self._buffer = []
+    self._runs = []
+    self._seq = 0
+
+  def add(self, key, item):
+    self._buffer.append((key, self._seq, item))
+    self._seq += 1
+    if len(self._buffer) >= self.max_items:
+      self._spill()
+
+  @property
+  def num_runs(self):
+    """ Number of runs spilled to temporary files """
+    return len(self._runs)
+
+  def _spill(self):
+    self._buffer.sort(key=itemgetter(0, 1))
+    run = tempfile.TemporaryFile(dir=self.tmpdir)
+    pickler = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL)
+    for entry in self._buffer:
+      pickler.dump(entry)
+      # the pickler memo would otherwise keep every entry in memory
+      pickler.clear_memo()
+    run.seek(0)
+    self._runs.append(run)
+    self._buffer = []
+
+  def _read_run(self, run):
+    unpickler = pickle.Unpickler(run)
+    while True:
+      try:
+        yield unpickler.load()
+      except EOFError:
+        run.close()
+        return
+
+  def __iter__(self):
+    self._buffer.sort(key=itemgetter(0, 1))
+    runs = [self._read_run(run) for run in self._runs]
+    runs.append(iter(self._buffer))
+    for key, _, item in heapq.merge(*runs):
+      yield key, item
+
+
+def group_pairs(pairs, sorted_input=False, max_items=100000, tmpdir=None):
+  """
+  Groups (group_key, item) pairs, yielding every group once complete
+
+  Args:
+    - pairs: iterable of (group_key, item) tuples
+    - sorted_input: (bool) True if pairs are sorted by group key, groups are
+      then streamed and ValueError is raised if the order is broken.
+    - max_items: (int) pairs buffered in memory by the external sort
+    - tmpdir: (str) directory for the external sort temporary files
+
+  Yields:
+    (group_key, items) tuples, in group key order. Items keep their input
+    order.
+  """
+  if not sorted_input:
+    sorter = ExternalSorter(max_items=max_items, tmpdir=tmpdir)
+    for key, item in pairs:
+      sorter.add(key, item)
+    pairs = sorter
+
+  return _sorted_groups(pairs)
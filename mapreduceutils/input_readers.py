@@ -0,0 +1,28 @@
+"""
+Mapper input readers
+
+EntityProtoInputReader yields the raw entity protocol buffers of a kind, so
+record_map and RecordMapper map them as EntityProtoRecords without
+instantiating models, see mapreduceutils.EntityProtoRecord.
+
+Usage, as the input reader of a mapreduce job:
+  "input_reader": "mapreduceutils.input_readers.EntityProtoInputReader",
+  "entity_kind": "Event"
+"""
+from mapreduce import datastore_range_iterators as db_iters
+from mapreduce.input_readers import RawDatastoreInputReader
+
+__all__ = [
+  "EntityProtoInputReader"
+]
+
+
+class EntityProtoInputReader(RawDatastoreInputReader):
+  """
+  Iterates over an entity kind and yields entity_pb.EntityProto
+
+  Accepts the parameters of RawDatastoreInputReader: entity_kind is the
+  kind name and filters only support equality.
+  """
+
+  _KEY_RANGE_ITER_CLS = db_iters.KeyRangeEntityProtoIterator
@@ -0,0 +1,187 @@
+"""
+Memory mapped JSON lines input
+
+The input file is memory mapped and an index with the offset of every line
+is built with a single scan, or loaded from the ".idx" file persisted next
+to it. Lines are then handed to the JSON decoder straight from the mapping,
+and any line range can be read without scanning the lines before it, which
+makes resharding and restarting from a checkpoint instant.
+
+Usage:
+  with MappedJSONLines('export.jsonl') as lines:
+    for record in lines.records(start=checkpoint):
+      ...
+"""
+from array import array
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+__all__ = [
+  "LineIndex",
+  "MappedJSONLines"
+]
+
+_MAGIC = 'MRULIDX1'
+# magic, indexed file size, indexed file mtime in microseconds
+_HEADER = struct.Struct('<8sQQ')
+# offsets are stored as little endian unsigned 64 bits integers. Python 2
+# arrays have no 'Q' code, 'L' is the 64 bits unsigned type on LP64 platforms
+_OFFSET_TYPE = 'L'
+_OFFSET_SIZE = 8
+
+
+def _offsets(values=()):
+  offsets = array(_OFFSET_TYPE, values)
+  if offsets.itemsize != _OFFSET_SIZE:
+    raise RuntimeError("Line indexes require 64 bits unsigned longs")
+  return offsets
+
+
+def _file_signature(path):
+  stat = os.stat(path)
+  return stat.st_size, int(stat.st_mtime * 10 ** 6)
+
+
+class LineIndex(object):
+  """
+  Offsets of the lines of a file
+
+  offsets holds the start of every line followed by the file size, so line
+  i spans offsets[i]:offsets[i + 1] (new line included).
+  """
+
+  def __init__(self, offsets):
+    self.offsets = offsets
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  @classmethod
+  def build(cls, data):
+    """ Indexes a string or mmap """
+    offsets = _offsets([0])
+    pos = data.find('\n')
+    while pos != -1:
+      offsets.append(pos + 1)
+      pos = data.find('\n', pos + 1)
+    if offsets[-1] != len(data):
+      offsets.append(len(data))
+    return cls(offsets)
+
+  def save(self, path, signature):
+    """ Writes the index, signature being the (size, mtime) of the file """
+    with open(path, 'wb') as f:
+      f.write(_HEADER.pack(_MAGIC, *signature))
+      offsets = self.offsets
+      if sys.byteorder != 'little':
+        offsets = _offsets(offsets)
+        offsets.byteswap()
+      offsets.tofile(f)
+
+  @classmethod
+  def load(cls, path, signature):
+    """ Reads an index, None if missing or stale """
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except IOError:
+      return None
+
+    if len(data) < _HEADER.size:
+      return None
+    magic, size, mtime = _HEADER.unpack_from(data)
+    if magic != _MAGIC or (size, mtime) != tuple(signature):
+      return None
+
+    count = (len(data) - _HEADER.size) // _OFFSET_SIZE
+    offsets = _offsets()
+    offsets.fromstring(data[_HEADER.size:_HEADER.size + count * _OFFSET_SIZE])
+    if sys.byteorder != 'little':
+      offsets.byteswap()
+    return cls(offsets)
+
+  def split(self, num_shards):
+    """ Splits the lines into up to num_shards (start, stop) line ranges """
+    size = len(self)
+    bounds = sorted(set(size * idx // num_shards
+                        for idx in range(num_shards + 1)))
+    return zip(bounds, bounds[1:])
+
+
+class MappedJSONLines(object):
+  """
+  Memory mapped newline delimited JSON file with a line index
+  """
+
+  def __init__(self, path, persist_index=True, decoder=json.loads):
+    """
+    Args:
+      - path: (str) JSON lines file
+      - persist_index: (bool) True to load the index from, and save it to,
+        path + ".idx"
+      - decoder: callable decoding a line into a record
+    """
+    self.path = path
+    self.index_path = path + '.idx'
+    self.decoder = decoder
+    self._file = open(path, 'rb')
+    signature = _file_signature(path)
+    self._data = ''
+    if signature[0]:
+      self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    self.index = None
+    if persist_index:
+      self.index = LineIndex.load(self.index_path, signature)
+    if self.index is None:
+      self.index = LineIndex.build(self._data)
+      if persist_index:
+        self.index.save(self.index_path, signature)
+
+  def __len__(self):
+    return len(self.index)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    if isinstance(self._data, mmap.mmap):
+      self._data.close()
+    self._file.close()
+
+  def line(self, idx):
+    """ Returns the line idx, new line included """
+    offsets = self.index.offsets
+    return self._data[offsets[idx]:offsets[idx + 1]]
+
+  def byte_range(self, start, stop):
+    """ Byte offsets of the lines [start, stop) """
+    offsets = self.index.offsets
+    return offsets[start], offsets[stop]
+
+  def lines(self, start=0, stop=None):
+    """ Yields (line number, line) of the non empty lines [start, stop) """
+    stop = len(self) if stop is None else min(stop, len(self))
+    for idx in xrange(start, stop):
+      line = self.line(idx)
+      if line.strip():
+        yield idx, line
+
+  def records(self, start=0, stop=None):
+    """
+    Yields the decoded records of lines [start, stop)
+
+    Lines which can't be decoded are logged and skipped.
+    """
+    for idx, line in self.lines(start, stop):
+      try:
+        yield self.decoder(line)
+      except ValueError:
+        logging.warn(u"Unable to load json at line {}: {}".format(idx, line))
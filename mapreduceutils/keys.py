@@ -0,0 +1,225 @@
+"""
+Order preserving tuple keys
+
+Mapper keys are encoded as byte strings whose byte order is the order of the
+tuples they encode, so the shuffle sorts and partitions them by value:
+numbers sort numerically, dates chronologically and strings may contain any
+character. Every value is prefixed by a type code, values of different
+types sort by type: None, booleans, numbers, dates, datetimes and strings.
+Integers and floats share the number type so mixed numeric columns sort by
+value, (10,) after (2.5,). Values of other types are encoded as their
+unicode string.
+
+Salted keys (see skew.KeySalter) end with a salt element, a SALT type code
+and a fixed width salt number. It can't be mistaken for value bytes since
+elements are parsed from the start of the key, and decode_key skips it.
+
+Usage:
+  key = encode_key([u"account", 2014, 3.5])
+  decode_key(key)  # (u"account", 2014, 3.5)
+"""
+import datetime
+import struct
+
+__all__ = [
+  "decode_key",
+  "encode_key",
+  "salt_encoded_key",
+  "split_salt",
+  "KEY_ENCODINGS"
+]
+
+KEY_ENCODINGS = ('text', 'tuple')
+
+NULL = '\x01'
+FALSE = '\x02'
+TRUE = '\x03'
+NUMBER = '\x10'
+DATE = '\x30'
+DATETIME = '\x31'
+STRING = '\x40'
+SALT = '\xfe'
+
+# kinds of numbers, following their sortable float: integral numbers are
+# followed by their exact 64 bits value and a marker telling ints from floats
+_INTEGRAL = '\x01'
+_FRACTIONAL = '\x02'
+_INT_MARKER = '\x00'
+_FLOAT_MARKER = '\x01'
+
+_SIGN = 1 << 63
+_MASK = (1 << 64) - 1
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _encode_int(value):
+  if not -_SIGN <= value < _SIGN:
+    raise ValueError(u"Integer {} does not fit in 64 bits".format(value))
+  return struct.pack('>Q', value + _SIGN)
+
+
+def _decode_int(data):
+  return struct.unpack('>Q', data)[0] - _SIGN
+
+
+def _encode_float(value):
+  bits = struct.unpack('>Q', struct.pack('>d', value))[0]
+  # negative floats have all their bits flipped so larger magnitudes sort
+  # first, positive floats only the sign bit
+  bits = bits ^ _MASK if bits & _SIGN else bits | _SIGN
+  return struct.pack('>Q', bits)
+
+
+def _decode_float(data):
+  bits = struct.unpack('>Q', data)[0]
+  bits = bits ^ _SIGN if bits & _SIGN else bits ^ _MASK
+  return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+def _encode_number(value):
+  """
+  Encodes ints and floats so their bytes sort as their values
+
+  The sortable float of the value comes first. Values rounding to the same
+  float, which only happens for integral values, are then ordered by their
+  exact integer value.
+  """
+  if isinstance(value, (int, long)):
+    exact = _encode_int(value)  # checks the 64 bits range first
+    return NUMBER + _encode_float(float(value)) + _INTEGRAL + exact + \
+      _INT_MARKER
+
+  if value == value and -_SIGN <= value < _SIGN and value == int(value):
+    return NUMBER + _encode_float(value) + _INTEGRAL + \
+      _encode_int(int(value)) + _FLOAT_MARKER
+  return NUMBER + _encode_float(value) + _FRACTIONAL
+
+
+def _encode_datetime(value):
+  if value.tzinfo is not None:
+    value = value.replace(tzinfo=None) - value.utcoffset()
+  delta = value - _EPOCH
+  micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+  return _encode_int(micros)
+
+
+def _decode_datetime(data):
+  return _EPOCH + datetime.timedelta(microseconds=_decode_int(data))
+
+
+def _encode_string(value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  # \x00 terminates the string, it's escaped as \x00\xff
+  return value.replace('\x00', '\x00\xff') + '\x00'
+
+
+def _encode_value(value):
+  if value is None:
+    return NULL
+  if isinstance(value, bool):
+    return TRUE if value else FALSE
+  if isinstance(value, (int, long, float)):
+    return _encode_number(value)
+  if isinstance(value, datetime.datetime):
+    return DATETIME + _encode_datetime(value)
+  if isinstance(value, datetime.date):
+    return DATE + struct.pack('>I', value.toordinal())
+  if isinstance(value, basestring):
+    return STRING + _encode_string(value)
+  return STRING + _encode_string(unicode(value))
+
+
+def encode_key(values):
+  """
+  Encodes a sequence of values into an order preserving key
+
+  Args:
+    - values: iterable of values, see the module docstring for the types
+
+  Returns:
+    str key, keys compare as the tuples of values they encode
+  """
+  return ''.join(_encode_value(value) for value in values)
+
+
+def salt_encoded_key(key, salt):
+  """ Appends the salt element of sub-key salt to a key of encode_key """
+  return key + SALT + struct.pack('>I', salt)
+
+
+def _iter_elements(key):
+  """ Yields (type code, data, offset) of every element of an encoded key """
+  pos = 0
+  while pos < len(key):
+    offset = pos
+    code = key[pos]
+    start = pos = pos + 1
+    if code == NUMBER:
+      kind = key[pos + 8:pos + 9]
+      pos += 9 if kind == _FRACTIONAL else 18
+    elif code == DATETIME:
+      pos += 8
+    elif code in (DATE, SALT):
+      pos += 4
+    elif code == STRING:
+      chunks = []
+      while True:
+        end = key.index('\x00', pos)
+        chunks.append(key[pos:end])
+        if key[end + 1:end + 2] == '\xff':
+          chunks.append('\x00')
+          pos = end + 2
+        else:
+          pos = end + 1
+          break
+      yield code, ''.join(chunks), offset
+      continue
+    elif code not in (NULL, FALSE, TRUE):
+      msg = u"Invalid key type code {!r} at {}"
+      raise ValueError(msg.format(code, offset))
+
+    if pos > len(key):
+      raise ValueError(u"Truncated key element at {}".format(offset))
+    yield code, key[start:pos], offset
+
+
+def split_salt(key):
+  """
+  Splits a key of encode_key from its salt element
+
+  Returns:
+    (unsalted key, salt) tuple, salt being None if the key isn't salted
+  """
+  for code, data, offset in _iter_elements(key):
+    if code == SALT:
+      return key[:offset], struct.unpack('>I', data)[0]
+  return key, None
+
+
+def decode_key(key):
+  """
+  Decodes a key generated by encode_key, salt elements are skipped
+
+  Returns:
+    tuple of values, strings are returned as unicode
+  """
+  values = []
+  for code, data, _ in _iter_elements(key):
+    if code == NULL:
+      values.append(None)
+    elif code in (FALSE, TRUE):
+      values.append(code == TRUE)
+    elif code == NUMBER:
+      if data[8] == _INTEGRAL and data[17] == _INT_MARKER:
+        values.append(int(_decode_int(data[9:17])))
+      else:
+        values.append(_decode_float(data[:8]))
+    elif code == DATETIME:
+      values.append(_decode_datetime(data))
+    elif code == DATE:
+      values.append(datetime.date.fromordinal(struct.unpack('>I', data)[0]))
+    elif code == STRING:
+      values.append(data.decode('utf-8'))
+
+  return tuple(values)
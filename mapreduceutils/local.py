@@ -0,0 +1,445 @@
+"""
+Local execution of record_map
+
+Runs the matching, filtering, modifiers and writers of a MapperPlan over
+any iterable of records, without an App Engine mapreduce context. Useful for
+small exports and backfills, tests and profiling.
+
+Usage:
+  runner = LocalRunner({'property_map': property_map, 'output_format': 'csv'})
+  stats = runner.run(read_json_lines('input.jsonl'), 'output.csv')
+
+Large newline delimited files are processed by a pool of processes with
+run_sharded, every process handling byte ranges of the file.
+
+Jobs defining mapper keys run with run_mapreduce, which shuffles the pairs
+with an external sort and writes the reducer output as KeyValue records,
+and post_process applies post processing functions to them.
+"""
+import csv
+import hashlib
+import multiprocessing
+import os
+import shutil
+from mapreduceutils import MapperPlan
+from mapreduceutils.grouping import ExternalSorter, group_pairs
+from mapreduceutils.jsonlines import MappedJSONLines
+from mapreduceutils.postprocess import map_groups
+from mapreduceutils.reduced import KeyGrouper, KeyValue
+from mapreduceutils.utils import handler_for_name
+from mapreduce.records import RecordsReader, RecordsWriter
+
+__all__ = [
+  "LocalRunner",
+  "post_process",
+  "read_json_lines",
+  "run_mapreduce",
+  "run_sharded",
+  "split_shards"
+]
+
+INPUT_FORMATS = ('json', 'csv')
+
+
+def read_json_lines(path):
+  """ Yields the non empty lines of a newline delimited JSON file """
+  with open(path, 'rb') as f:
+    for line in f:
+      if line.strip():
+        yield line
+
+
+class LocalRunner(object):
+  """
+  Runs a MapperPlan over local records
+
+  Map only rows are written in blocks to the output, exactly as
+  RecordMapper does for a single shard and slice. (key, data) pairs of
+  rules defining a mapper_key_spec, including combined partial aggregates,
+  are handed to a callback.
+  """
+
+  def __init__(self, params, shard_id='local'):
+    """
+    Args:
+      - params: (dict) mapper params, see MapperPlan, or a MapperPlan
+      - shard_id: (str) shard name, the Avro sync marker is derived from it
+    """
+    self.plan = params if isinstance(params, MapperPlan) else MapperPlan(params)
+    self.sync_marker = hashlib.md5(str(shard_id)).digest()
+
+  def map(self, records):
+    """
+    Processes records
+
+    Args:
+      - records: iterable of dicts, JSON strings or models
+
+    Yields:
+      written blocks (the first one prefixed with the output header) and
+      (key, data) tuples
+    """
+    output = self.plan.open_output(sync_marker=self.sync_marker)
+    combiner = self.plan.create_combiner()
+    salter = self.plan.create_salter()
+    header = output.header()
+
+    # JSON strings are decoded by the plan, with its json_decoder
+    if self.plan.concurrency_window > 1:
+      outputs = self.plan.process_window(records, output=output,
+                                         combiner=combiner, salter=salter)
+    else:
+      outputs = (out for record in records
+                 for out in self.plan.process(record, output=output,
+                                              combiner=combiner,
+                                              salter=salter))
+
+    for out in outputs:
+      if isinstance(out, tuple):
+        yield out
+      else:
+        yield header + out
+        header = ''
+
+    for pair in self.plan.write_partials(combiner.flush()):
+      yield pair
+
+    data = header + output.flush()
+    if data:
+      yield data
+
+  def run(self, records, output, on_pair=None):
+    """
+    Processes records writing map only rows to output
+
+    Args:
+      - records: iterable of dicts, JSON strings or models
+      - output: path or file object the blocks are written to
+      - on_pair: callable receiving (key, data) of keyed rows, they are
+        dropped if not given
+
+    Returns:
+      dict with the number of "records" read, "pairs" generated and "bytes"
+      written
+    """
+    stats = {'records': 0, 'pairs': 0, 'bytes': 0}
+
+    def counted(records):
+      for record in records:
+        stats['records'] += 1
+        yield record
+
+    f = open(output, 'wb') if isinstance(output, basestring) else output
+    try:
+      for out in self.map(counted(records)):
+        if isinstance(out, tuple):
+          stats['pairs'] += 1
+          if on_pair is not None:
+            on_pair(*out)
+        else:
+          f.write(out)
+          stats['bytes'] += len(out)
+    finally:
+      if f is not output:
+        f.close()
+
+    return stats
+
+
+class KeyValueWriter(object):
+  """ Writes (key, data) pairs as KeyValue records, as the shuffle reads them """
+
+  def __init__(self, path):
+    self.path = path
+    self._file = open(path, 'wb')
+    self._writer = RecordsWriter(self._file)
+
+  def write_record(self, record):
+    """ Writes an already serialized record """
+    self._writer.write(record)
+
+  def write(self, key, data):
+    if isinstance(key, unicode):
+      key = key.encode('utf-8')
+    if isinstance(data, unicode):
+      data = data.encode('utf-8')
+    proto = KeyValue()
+    proto.set_key(key)
+    proto.set_value(data)
+    self.write_record(proto.Encode())
+
+  def close(self):
+    self._file.close()
+
+
+def split_shards(path, num_shards, skip_header=False):
+  """
+  Splits a newline delimited file into byte ranges starting on lines
+
+  Args:
+    - path: (str) input file
+    - num_shards: (int) number of ranges wanted, less are returned when the
+      file has not enough lines
+    - skip_header: (bool) True to leave the first line out of every range
+
+  Returns:
+    list of (start, end) byte offsets
+  """
+  size = os.path.getsize(path)
+  with open(path, 'rb') as f:
+    first = len(f.readline()) if skip_header else 0
+    boundaries = [first]
+    for idx in range(1, num_shards):
+      pos = first + (size - first) * idx // num_shards
+      # the range starts on the line following the one containing pos - 1
+      f.seek(max(pos - 1, first))
+      f.readline()
+      boundaries.append(max(f.tell(), boundaries[-1]))
+    boundaries.append(size)
+
+  return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+          if end > start]
+
+
+def read_range(path, start, end):
+  """ Yields the non empty lines starting in the byte range [start, end) """
+  with open(path, 'rb') as f:
+    f.seek(start)
+    pos = start
+    while pos < end:
+      line = f.readline()
+      if not line:
+        break
+      pos += len(line)
+      if line.strip():
+        yield line
+
+
+def read_csv_range(path, start, end, columns):
+  """
+  Yields the CSV rows in the byte range [start, end)
+
+  Rows can't contain quoted new lines, every line must be a row.
+
+  Args:
+    - columns: (CSVColumns) column index of the file, see
+      MapperPlan.csv_columns
+  """
+  return columns.rows(read_range(path, start, end))
+
+
+def _csv_fieldnames(path):
+  with open(path, 'rb') as f:
+    return [name.decode('utf-8') for name in next(csv.reader([f.readline()]))]
+
+
+# MapperPlan of the worker process, created once by _init_worker
+_worker_plan = None
+
+
+def _init_worker(params):
+  global _worker_plan
+  _worker_plan = MapperPlan(params)
+
+
+def _run_shard(shard):
+  """ Processes a shard, returning its stats and output paths """
+  path, start, end, input_format, fieldnames, line_index, prefix, idx = shard
+  lines = None
+  if input_format == 'csv':
+    records = read_csv_range(path, start, end,
+                             _worker_plan.csv_columns(fieldnames))
+  elif line_index:
+    # start and end are line numbers, read from the mapping with the index
+    # persisted by run_sharded
+    lines = MappedJSONLines(path, decoder=_worker_plan.json_decoder)
+    records = lines.records(start, end)
+  else:
+    records = read_range(path, start, end)
+
+  runner = LocalRunner(_worker_plan)
+  pairs_path = '{}-{:05d}.pairs'.format(prefix, idx)
+  pairs = []  # lazily opened KeyValueWriter
+
+  def on_pair(key, data):
+    if not pairs:
+      pairs.append(KeyValueWriter(pairs_path))
+    pairs[0].write(key, data)
+
+  output = '{}-{:05d}'.format(prefix, idx)
+  try:
+    stats = runner.run(records, output, on_pair=on_pair)
+  finally:
+    for writer in pairs:
+      writer.close()
+    if lines is not None:
+      lines.close()
+
+  stats['output'] = output
+  stats['pairs_output'] = pairs_path if pairs else None
+  stats['header'] = len(runner.plan.open_output(runner.sync_marker).header())
+  return stats
+
+
+def _merge_outputs(shards, path):
+  """ Concatenates shard outputs, keeping the header of the first one """
+  with open(path, 'wb') as out:
+    for idx, stats in enumerate(shards):
+      with open(stats['output'], 'rb') as f:
+        if idx:
+          f.seek(stats['header'])
+        shutil.copyfileobj(f, out)
+
+
+def run_sharded(params, path, prefix, input_format='json', num_shards=None,
+                processes=None, merge=False, line_index=False):
+  """
+  Processes a newline delimited file with a pool of processes
+
+  The file is split into num_shards byte ranges aligned on lines. Every
+  shard writes its map only output to "<prefix>-NNNNN" and its (key, data)
+  pairs as KeyValue records to "<prefix>-NNNNN.pairs". The mapper params are
+  sent once to every process.
+
+  Args:
+    - params: (dict) mapper params, see MapperPlan
+    - path: (str) input file
+    - prefix: (str) path prefix of the output files
+    - input_format: (str) "json" (JSON lines) or "csv" (with a header line)
+    - num_shards: (int) number of shards, processes by default
+    - processes: (int) size of the pool, the number of CPUs by default. A
+      single process runs the shards in the calling process.
+    - merge: (bool) True to concatenate shard outputs into "<prefix>"
+    - line_index: (bool) True to split JSON lines input in shards with the
+      same number of lines, read by every shard from the memory mapped
+      input with the line index persisted next to it (see
+      jsonlines.MappedJSONLines) so reruns don't scan the file
+
+  Returns:
+    list of shard stats, see LocalRunner.run, with the paths of their
+    "output" and "pairs_output" files
+  """
+  if input_format not in INPUT_FORMATS:
+    msg = "Unsupported input format '{}', use one of {}"
+    raise ValueError(msg.format(input_format, INPUT_FORMATS))
+
+  processes = processes or multiprocessing.cpu_count()
+  num_shards = num_shards or processes
+  fieldnames = _csv_fieldnames(path) if input_format == 'csv' else None
+  line_index = line_index and input_format == 'json'
+  if line_index:
+    with MappedJSONLines(path) as lines:
+      ranges = lines.index.split(num_shards)
+  else:
+    ranges = split_shards(path, num_shards, skip_header=fieldnames is not None)
+  shards = [(path, start, end, input_format, fieldnames, line_index, prefix,
+             idx) for idx, (start, end) in enumerate(ranges)]
+
+  if processes == 1:
+    _init_worker(params)
+    results = [_run_shard(shard) for shard in shards]
+  else:
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(params,))
+    try:
+      results = pool.map(_run_shard, shards, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  if merge:
+    _merge_outputs(results, prefix)
+
+  for stats in results:
+    del stats['header']
+  return results
+
+
+def run_mapreduce(params, records, reducer, output, map_output=os.devnull,
+                  max_items=100000, tmpdir=None):
+  """
+  Runs map, shuffle and reduce in process
+
+  Pairs generated by the mapper are sorted by key with an external sort,
+  spilling to temporary files after max_items pairs, and grouped. Every
+  group is given to the reducer, its output is written as KeyValue records,
+  the format PostProcess reads.
+
+  Args:
+    - params: (dict) mapper params, see MapperPlan
+    - records: iterable of dicts, JSON strings or models
+    - reducer: reduce function or its fully qualified name. It's called
+      with (key, values) and yields (key, value) tuples or serialized
+      KeyValue records.
+    - output: (str) path of the reduced KeyValue records file
+    - map_output: path or file object for map only rows, discarded by
+      default
+    - max_items: (int) pairs kept in memory by the sort
+    - tmpdir: (str) directory for the sort temporary files
+
+  Returns:
+    dict with the map stats (see LocalRunner.run), the number of "keys"
+    reduced and "reduced" records written
+  """
+  if isinstance(reducer, basestring):
+    reducer = handler_for_name(reducer)
+
+  sorter = ExternalSorter(max_items=max_items, tmpdir=tmpdir)
+  stats = LocalRunner(params).run(records, map_output, on_pair=sorter.add)
+  stats['keys'] = stats['reduced'] = 0
+
+  writer = KeyValueWriter(output)
+  try:
+    for key, values in group_pairs(sorter, sorted_input=True):
+      stats['keys'] += 1
+      for out in reducer(key, values):
+        if isinstance(out, tuple):
+          writer.write(*out)
+        else:
+          writer.write_record(out)
+        stats['reduced'] += 1
+  finally:
+    writer.close()
+
+  return stats
+
+
+def post_process(filenames, postproc_funcs, reduced_record_ctx=None):
+  """
+  Applies post processing functions to local KeyValue record files
+
+  Records are grouped and processed as PostProcess does, but instead of
+  being stored as ReducedRecords they are yielded.
+
+  Args:
+    - filenames: (list) paths of KeyValue record files
+    - postproc_funcs: (list) post processing functions, qualified names or
+      [name, options] pairs, see postprocess.resolve
+    - reduced_record_ctx: (dict) PostProcess context, only the keys and
+      grouping params are used
+
+  Yields:
+    (groupings, value) tuples
+  """
+  ctx = reduced_record_ctx or {}
+  grouper = KeyGrouper.from_context(ctx)
+  files = [open(f, 'rb') for f in filenames]
+  try:
+    groups = grouper.group(
+      [RecordsReader(f) for f in files],
+      sorted_input=ctx.get('sorted_input', False),
+      max_items=ctx.get('group_max_items', 100000)
+    )
+    results = map_groups(groups, postproc_funcs,
+                         workers=ctx.get('workers', 0),
+                         executor=ctx.get('executor', 'thread'))
+    for group_key, records in results:
+      grp_part = grouper.explode_group_key(group_key)
+      for k, v in records:
+        groupings = list(grp_part)
+        if k:
+          groupings.append(k)
+        yield groupings, v
+  finally:
+    for f in files:
+      f.close()
@@ -7,6 +7,8 @@ __all__ = ['FieldModifier']
 
 
 class FieldModifier(object):
+  # True for modifiers waiting on I/O, they implement _evaluate_async
+  ASYNC = False
 
   def __init__(self, identifier, operands=None, arguments=None):
     self.identifier = identifier
@@ -61,6 +63,33 @@ class FieldModifier(object):
     self.modifier_chain = modifier_chain
     modifier_chain[self.identifier] = self._evaluate()
 
+  def eval_async(self, record, modifier_chain):
+    """
+    Evaluates the modifier, yielding the futures it waits for
+
+    Asynchronous modifiers yield the future returned by _evaluate_async and
+    store its result once resumed, so callers can start the I/O of several
+    records before waiting on any of them. Other modifiers are evaluated
+    without yielding.
+
+    Args:
+      - record: (Model) model object
+      - modifier_chain: (dict) dictionary containing previous modifiers from
+        the chain
+    """
+    self.record = record
+    self.modifier_chain = modifier_chain
+    if self.ASYNC:
+      future = self._evaluate_async()
+      yield future
+      modifier_chain[self.identifier] = future.get_result()
+    else:
+      modifier_chain[self.identifier] = self._evaluate()
+
+  def _evaluate_async(self):
+    """ Returns a future (with get_result) of the modifier value """
+    raise NotImplementedError()
+
   def get_value_from_chain(self, identifier):
     """
     Retrieves a value from a previous modifier in the chain
@@ -632,6 +632,7 @@ class NdbKeyIdModifier(FieldModifier):
 class NdbQueryModifier(FieldModifier):
   """ Executes an ndb.Query() with given params """
 
+  ASYNC = True
   META_NAME = "Query Modifier"
   META_DESCRIPTION = "Evaluates an ndb.Query()"
   META_OPERANDS = dict()
@@ -667,7 +668,7 @@ class NdbQueryModifier(FieldModifier):
         pass
     return key
 
-  def _evaluate(self):
+  def _query(self):
     namespace = self.get_argument('namespace')
     kind = self.get_argument('kind')
     raw_filters = self.get_argument('filters')
@@ -703,12 +704,20 @@ class NdbQueryModifier(FieldModifier):
     else:
       orders = None
 
-    q = ndb.Query(kind=kind, filters=filters, namespace=namespace, orders=orders)
-    entity = q.get()
+    return ndb.Query(kind=kind, filters=filters, namespace=namespace,
+                     orders=orders)
+
+  def _evaluate(self):
+    entity = self._query().get()
     #dbg_msg = u"Query result for {}, {}, {}, {} : {}"
     #logging.warn(dbg_msg.format(namespace, kind, filters, orders, entity))
     if entity:
       return entity.to_dict()
 
+  @ndb.tasklet
+  def _evaluate_async(self):
+    entity = yield self._query().get_async()
+    raise ndb.Return(entity.to_dict() if entity else None)
+
   def guess_return_type(self):
     dict.__name__
@@ -0,0 +1,68 @@
+"""
+Mutation pools
+
+Buffers datastore writes so they are sent in batches through asynchronous
+RPCs, keeping a bounded number of them in flight.
+"""
+import collections
+from google.appengine.ext import db
+
+__all__ = ["PutPool"]
+
+# Maximum number of entities accepted by a single datastore put
+MAX_BATCH_SIZE = 500
+
+
+class PutPool(object):
+  """
+  Batches db.Model puts
+
+  Entities are buffered until `batch_size` are pending, they are then stored
+  with a single `db.put_async` call. At most `max_in_flight` RPCs are pending
+  at any time, the oldest one is waited for before issuing a new one.
+
+  Usage:
+    pool = PutPool(batch_size=200)
+    for entity in entities:
+      pool.put(entity)
+    pool.flush()
+  """
+
+  def __init__(self, batch_size=200, max_in_flight=4):
+    """
+    Args:
+      - batch_size: (int) number of entities per put RPC, 500 at most
+      - max_in_flight: (int) maximum number of concurrent put RPCs
+    """
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+      msg = "batch_size should be between 1 and {}"
+      raise ValueError(msg.format(MAX_BATCH_SIZE))
+
+    self.batch_size = batch_size
+    self.max_in_flight = max(1, max_in_flight)
+    self.num_puts = 0
+    self._entities = []
+    self._rpcs = collections.deque()
+
+  def put(self, entity):
+    """ Adds an entity to the pool, sending the batch when full """
+    self._entities.append(entity)
+    if len(self._entities) >= self.batch_size:
+      self._send()
+
+  def _send(self):
+    if not self._entities:
+      return
+
+    while len(self._rpcs) >= self.max_in_flight:
+      self._rpcs.popleft().get_result()
+
+    self._rpcs.append(db.put_async(self._entities))
+    self.num_puts += len(self._entities)
+    self._entities = []
+
+  def flush(self):
+    """ Sends pending entities and waits for every RPC to complete """
+    self._send()
+    while self._rpcs:
+      self._rpcs.popleft().get_result()
@@ -0,0 +1,145 @@
+"""
+Post processing execution
+
+Chains post processing functions into lazy pipelines and applies them to
+groups of reduced records, optionally fanning the groups out to a pool of
+threads or processes.
+"""
+import functools
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from utils import handler_for_name
+
+__all__ = [
+  "compose",
+  "map_groups",
+  "resolve",
+  "streaming"
+]
+
+EXECUTORS = ('thread', 'process')
+
+
+def streaming(func):
+  """
+  Marks a post processing function as able to consume its input lazily
+
+  Functions not marked as streaming receive their input as a list, so they
+  can iterate it more than once.
+  """
+  func.streaming = True
+  return func
+
+
+def resolve(func_spec):
+  """
+  Resolves a post processing function
+
+  Args:
+    - func_spec: (str) qualified name of the function, or a [name, options]
+      pair binding the options dict as keyword arguments, e.g.
+      ["mapreduceutils.aggregates.top_k", {"k": 5}]
+  """
+  if isinstance(func_spec, basestring):
+    return handler_for_name(func_spec)
+
+  name, options = func_spec
+  func = handler_for_name(name)
+  bound = functools.partial(func, **options)
+  bound.streaming = getattr(func, 'streaming', False)
+  return bound
+
+
+def compose(funcs):
+  """
+  Composes post processing functions into a lazy pipeline
+
+  Args:
+    - funcs: (list) post processing functions, already resolved
+
+  Returns:
+    Function which receives the records of a group and returns an iterable
+    with the output of the last function
+  """
+  def pipeline(records):
+    for func in funcs:
+      if not getattr(func, 'streaming', False) and not isinstance(records, list):
+        records = list(records)
+      records = func(records)
+    return records
+
+  return pipeline
+
+
+# Pipeline of a pool process, resolved once by _init_worker. Thread pools
+# share the module, so they get their pipeline with every task instead.
+_worker_pipeline = None
+
+
+def _init_worker(func_names):
+  global _worker_pipeline
+  _worker_pipeline = compose([resolve(f) for f in func_names])
+
+
+def _process_group(group, pipeline=None):
+  group_key, records = group
+  return group_key, list((pipeline or _worker_pipeline)(records))
+
+
+def _windows(iterable, size):
+  iterator = iter(iterable)
+  while True:
+    window = list(itertools.islice(iterator, size))
+    if not window:
+      return
+    yield window
+
+
+def map_groups(groups, func_names, workers=0, executor='thread',
+               chunksize=8):
+  """
+  Applies the post processing functions to every group
+
+  Groups are independent, with workers > 1 they are processed concurrently
+  by a thread pool (functions doing I/O) or a process pool (CPU bound
+  functions). Groups are fed to the pool in bounded windows, so memory does
+  not depend on the number of groups.
+
+  Args:
+    - groups: iterable of (group_key, records) tuples
+    - func_names: (list) post processing functions, see resolve
+    - workers: (int) size of the pool, groups are processed in the calling
+      thread if lower than 2
+    - executor: (str) "thread" or "process"
+    - chunksize: (int) groups sent to a worker at once
+
+  Yields:
+    (group_key, results) tuples in the order of groups, results being an
+    iterable of (key, value) tuples. Results are lists when a pool is used.
+  """
+  if workers < 2:
+    pipeline = compose([resolve(f) for f in func_names])
+    for group_key, records in groups:
+      yield group_key, pipeline(records)
+    return
+
+  if executor == 'thread':
+    pipeline = compose([resolve(f) for f in func_names])
+    task = functools.partial(_process_group, pipeline=pipeline)
+    pool = ThreadPool(workers)
+  elif executor == 'process':
+    task = _process_group
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(func_names,))
+  else:
+    raise ValueError("Executor '{}' is not supported, use one of {}".format(
+      executor, EXECUTORS))
+
+  try:
+    for window in _windows(groups, workers * chunksize * 2):
+      for result in pool.imap(task, window, chunksize):
+        yield result
+  finally:
+    pool.terminate()
+    pool.join()
@@ -4,8 +4,11 @@ import jinja2
 from app.config import notification_templates_path
 from mapreduce import base_handler
 from mapreduce.input_readers import RecordsReader
-from mapreduce.lib.files import file_service_pb
-from utils import handler_for_name
+# sketch based functions, kept importable under their former names
+from aggregates import approx_distinct, approx_quantiles, heavy_hitters, top_k
+from pools import PutPool
+from reduced import KeyGrouper, LevelOptions, scan_level_options
+from postprocess import map_groups, streaming
 from google.appengine.ext import db
 from app.models import ReducedRecord, IndicatorEntry, Notification, SystemUser
 from webapp2_extras import json
@@ -24,6 +27,7 @@ def unique(seq):
   return [x for x in seq if x not in seen and not seen_add(x)]
 
 
+@streaming
 def bypass(values):
   """
   Returns Key Value Pairs untouched
@@ -45,7 +49,17 @@ def percent(values):
         yield k, p
 
 
-def store_reduced_record(groupings, value, params):
+def store_reduced_record(groupings, value, params, pool=None):
+  """
+  Stores a ReducedRecord for the given groupings and value
+
+  Args:
+    - groupings: (list) level values of the record
+    - value: value of the record
+    - params: (dict) reduced record context
+    - pool: (PutPool) optional pool batching the puts, the record is put
+      synchronously if not given
+  """
   data = {
     'batch_id': params['batch_id'],
     'indicator_entry': db.Key(params['indicator_entry']),
@@ -58,33 +72,44 @@ def store_reduced_record(groupings, value, params):
     data["level%s" % idx] = p
 
   record = ReducedRecord(**data)
-  record.put()
-  #yield op.db.Put(record) does not insert
+  if pool is None:
+    record.put()
+  else:
+    pool.put(record)
 
 
 class PostProcess(base_handler.PipelineBase):
   def run(self, filenames, postproc_funcs, reduced_record_ctx):
-    self.key_concat_seq = reduced_record_ctx['key_concat_seq']
-
-    reader = RecordsReader(filenames, 0)
+    self.grouper = KeyGrouper.from_context(reduced_record_ctx)
 
     """ Run all the postproc funcs using results as args """
-    for group_key, records in self.group_records(reader).iteritems():
-      grp_part = [] if group_key == '__stub__' else group_key.split(self.key_concat_seq)
-
-      for fname in postproc_funcs:
-        func = handler_for_name(fname)
-        processed = []
-        for t in func(records):
-          processed.append(t)
-        records = processed
+    groups = self.group_records(
+      filenames,
+      sorted_input=reduced_record_ctx.get('sorted_input', False),
+      max_items=reduced_record_ctx.get('group_max_items', 100000)
+    )
+    pool = PutPool(
+      batch_size=reduced_record_ctx.get('put_batch_size', 200),
+      max_in_flight=reduced_record_ctx.get('max_put_rpcs', 4)
+    )
+    level_options = LevelOptions()
+    results = map_groups(
+      groups, postproc_funcs,
+      workers=reduced_record_ctx.get('workers', 0),
+      executor=reduced_record_ctx.get('executor', 'thread')
+    )
+    for group_key, records in results:
+      grp_part = self.grouper.explode_group_key(group_key)
 
       for k, v in records:
         groupings = list(grp_part)
         if k:
           groupings.append(k)
-        logging.warn("set for storage (%s,%s)" % (groupings, v))
-        store_reduced_record(groupings, v, reduced_record_ctx)
+        logging.debug("set for storage (%s,%s)" % (groupings, v))
+        store_reduced_record(groupings, v, reduced_record_ctx, pool=pool)
+        level_options.add(groupings)
+
+    pool.flush()
 
     # Actualiza las propiedades de control del indicator_entry
     indicator_entry = IndicatorEntry.get(reduced_record_ctx['indicator_entry'])
@@ -109,59 +134,34 @@ class PostProcess(base_handler.PipelineBase):
       notification.put()
 
     # Obtiene todas las opciones de los niveles y las guarda en el indicator_entry
+    # Las opciones se recolectan al almacenar los registros, en ejecuciones
+    # incrementales se leen todos los registros del indicator_path
     indicator_path = indicator_entry.indicator_path
-
-    levels = {}
-
     number_levels = len(indicator_path.grouping_mappings)
-    for i in range(1, number_levels + 1):
-      levels['level%s' % i] = []
-
-    limit = 100
-    offset = 0
-    while True:
-      reduced_records = ReducedRecord.all().filter('indicator_path =', indicator_path.key()).fetch(limit=limit,
-                                                                                                   offset=offset)
-      if len(reduced_records) == 0:
-        break
-
-      for reduced_record in reduced_records:
-        for i in range(1, number_levels + 1):
-          levels['level%s' % i].append(getattr(reduced_record, 'level%s' % i))
-
-      offset += 100
-
-    new_levels = {}
-    for key, value in levels.iteritems():
-      value = unique(value)
-      value.sort()
-      new_levels[key] = value
-    del levels
+    if reduced_record_ctx.get('incremental', False):
+      query = ReducedRecord.all().filter('indicator_path =',
+                                         indicator_path.key())
+      level_options = scan_level_options(query, number_levels)
+    new_levels = level_options.options(number_levels)
 
     indicator_entry.level_options = json.encode(new_levels)
     indicator_entry.put()
 
-  def group_records(self, reader):
-    groups = {}
-    for binary_record in reader:
-      proto = file_service_pb.KeyValue()
-      proto.ParseFromString(binary_record)
-      key, val = self.explode_key(proto.key()), proto.value().decode('utf-8')
-      if len(key) == 1:
-        if '__stub__' not in groups:
-          groups['__stub__'] = []
-        groups['__stub__'].append((key, val))
-      else:
-        gk = self.key_concat_seq.join(key[:-1])
-        if gk not in groups:
-          groups[gk] = []
-        groups[gk].append((key[-1], val))
-
-    return groups
-
-    """ Pop the low level key and group with the rest  """
+  def group_records(self, filenames, sorted_input=False, max_items=100000):
+    """
+    Groups the reduced records by all the key parts but the last one
+
+    Groups are yielded as soon as they are complete, see KeyGrouper.group.
+    Files are merged as they are read if every file is sorted by key
+    (sorted_input).
+    """
+    if sorted_input:
+      readers = [RecordsReader([f], 0) for f in filenames]
+    else:
+      readers = [RecordsReader(filenames, 0)]
+
+    return self.grouper.group(readers, sorted_input=sorted_input,
+                              max_items=max_items)
 
   def explode_key(self, key):
-    key = key.decode('utf-8')
-    parts = key.split(self.key_concat_seq)
-    return parts
+    return self.grouper.explode_key(key)
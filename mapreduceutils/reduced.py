@@ -0,0 +1,236 @@
+"""
+Reduced records
+
+Reads the KeyValue records generated by reducers and groups them by all
+their key parts but the last one, as PostProcess consumes them, and
+collects the level options of the stored records. Kept apart from the
+pipeline so local runs share the same logic.
+"""
+import collections
+from grouping import ExternalSorter, group_pairs, merge_sorted
+import itertools
+from keys import decode_key, encode_key
+from skew import merge_salted, unsalt_key
+
+try:
+  from mapreduce.lib.files.file_service_pb import KeyValue
+except ImportError:
+  from mapreduce.kv_pb import KeyValue
+
+__all__ = [
+  "KeyGrouper",
+  "KeyValue",
+  "LevelOptions",
+  "scan_level_options"
+]
+
+
+class KeyGrouper(object):
+  """
+  Splits reduced record keys and groups records by key prefix
+
+  Usage:
+    grouper = KeyGrouper.from_context(reduced_record_ctx)
+    for group_key, records in grouper.group(readers):
+      levels = grouper.explode_group_key(group_key)
+  """
+
+  def __init__(self, key_concat_seq=u'|', key_encoding='text',
+               salt_merge=None):
+    """
+    Args:
+      - key_concat_seq: (unicode) separator of text key parts
+      - key_encoding: (str) "text" or "tuple", see keys.encode_key
+      - salt_merge: (str) name of the aggregate merging the records of
+        salted keys, salts are kept if not given. See skew.KeySalter.
+    """
+    self.key_concat_seq = key_concat_seq
+    self.key_encoding = key_encoding
+    self.salt_merge = salt_merge
+
+  @classmethod
+  def from_context(cls, reduced_record_ctx):
+    return cls(
+      key_concat_seq=reduced_record_ctx.get('key_concat_seq', u'|'),
+      key_encoding=reduced_record_ctx.get('key_encoding', 'text'),
+      salt_merge=reduced_record_ctx.get('salt_merge')
+    )
+
+  def group(self, readers, sorted_input=False, max_items=100000):
+    """
+    Groups the records of readers by all the key parts but the last one
+
+    Groups are yielded as soon as they are complete. If every reader is
+    sorted by key (sorted_input) readers are merged by key and the groups
+    of the depth of the first key are grouped as they are read, groups of
+    other depths interleave with them and are sorted and yielded last.
+    Otherwise records are sorted with an external sort which spills to
+    temporary files after max_items records.
+
+    Args:
+      - readers: (list) iterables of binary KeyValue records
+
+    Yields:
+      (group_key, records) tuples, records being (last key part, value)
+      tuples. Records with a single key part are grouped under '__stub__'.
+    """
+    if sorted_input:
+      keyed = merge_sorted([self._read_records(r) for r in readers])
+      groups = self._group_sorted(keyed, max_items)
+    else:
+      pairs = (pair for reader in readers for pair in self.read_pairs(reader))
+      groups = group_pairs(pairs, max_items=max_items)
+    if self.key_encoding == 'text':
+      groups = ((self._strip_separator(group_key), records)
+                for group_key, records in groups)
+    if self.salt_merge:
+      # records of salted keys are merged before the post processing
+      groups = ((group_key, merge_salted(records, self.salt_merge))
+                for group_key, records in groups)
+    return groups
+
+  def _group_sorted(self, keyed, max_items):
+    sorter = ExternalSorter(max_items=max_items)
+    streamed = self._split_depths(keyed, sorter)
+    for group_key, pairs in itertools.groupby(streamed, key=lambda p: p[0]):
+      yield group_key, [record for _, record in pairs]
+    for group in group_pairs(sorter, sorted_input=True):
+      yield group
+
+  def _split_depths(self, keyed, sorter):
+    """
+    Yields the (group_key, record) pairs of the depth of the first key
+
+    Keys are checked to be ascending. Groups of one depth are contiguous in
+    key order, but groups of different depths interleave ("a|b|c|y" sorts
+    between "a|b|a" and "a|b|x"), so pairs of other depths are added to
+    sorter.
+    """
+    depth = previous = None
+    for key, (key_depth, group_key, record) in keyed:
+      if previous is not None and key < previous:
+        msg = u"Input is not sorted, key {!r} found after {!r}"
+        raise ValueError(msg.format(key, previous))
+      previous = key
+
+      if depth is None:
+        depth = key_depth
+      if key_depth == depth:
+        yield group_key, record
+      else:
+        sorter.add(group_key, record)
+
+  def _strip_separator(self, group_key):
+    if group_key == '__stub__':
+      return group_key
+    return group_key[:-len(self.key_concat_seq)]
+
+  def read_pairs(self, reader):
+    """
+    Reads (group_key, (key, value)) pairs from binary KeyValue records
+
+    Text group keys keep the separator following them ("r1|" for "r1|a"),
+    so they sort as the keys they prefix: "r10|b" sorts before "r1|a" and
+    so does "r10|" before "r1|". group strips it.
+    """
+    for _, (_, group_key, record) in self._read_records(reader):
+      yield group_key, record
+
+  def _read_records(self, reader):
+    """ Yields (record key, (key depth, group_key, (key, value))) """
+    for binary_record in reader:
+      proto = KeyValue()
+      proto.ParseFromString(binary_record)
+      raw_key = key = proto.key()
+      if self.salt_merge:
+        key = unsalt_key(key, self.key_encoding)
+      key, val = self.explode_key(key), proto.value().decode('utf-8')
+      if self.key_encoding == 'tuple':
+        # encoded group keys sort as the tuples they encode, levels are
+        # stored as text like with the text encoding
+        last = unicode(key[-1]) if key else None
+        group_key, record = encode_key(key[:-1]), (last, val)
+      elif len(key) == 1:
+        group_key, record = '__stub__', (key[0], val)
+      else:
+        group_key = self.key_concat_seq.join(key[:-1]) + self.key_concat_seq
+        record = (key[-1], val)
+      yield raw_key, (len(key), group_key, record)
+
+  def explode_key(self, key):
+    """
+    Splits a reduced record key into its parts
+
+    Keys generated with the "tuple" key_encoding are decoded into typed
+    values, text keys are split by key_concat_seq.
+    """
+    if self.key_encoding == 'tuple':
+      return list(decode_key(key))
+
+    key = key.decode('utf-8')
+    parts = key.split(self.key_concat_seq)
+    return parts
+
+  def explode_group_key(self, group_key):
+    """ Returns the key parts of a group key generated by read_pairs """
+    if self.key_encoding == 'tuple':
+      return [unicode(part) for part in decode_key(group_key)]
+    if group_key == '__stub__':
+      return []
+    return group_key.split(self.key_concat_seq)
+
+
+class LevelOptions(object):
+  """ Collects the distinct level values of reduced records """
+
+  def __init__(self):
+    self._values = collections.defaultdict(set)
+    self._lengths = set()
+
+  def add(self, groupings):
+    """ Registers the level values of a stored record """
+    self._lengths.add(len(groupings))
+    for idx, value in enumerate(groupings, start=1):
+      self._values[idx].add(value)
+
+  def options(self, number_levels):
+    """
+    Returns a dict with the sorted distinct values of every level
+
+    Records with less groupings than number_levels have None as value for
+    the missing levels, as the datastore does.
+    """
+    levels = {}
+    for idx in range(1, number_levels + 1):
+      values = set(self._values[idx])
+      if any(length < idx for length in self._lengths):
+        values.add(None)
+      levels['level%s' % idx] = sorted(values)
+    return levels
+
+
+def scan_level_options(query, number_levels, batch_size=500):
+  """
+  Collects level options from every reduced record of a query
+
+  Records are read in batches using query cursors, so the cost is linear on
+  the number of records.
+
+  Args:
+    - query: (db.Query) reduced records, e.g. the ones of an indicator path
+    - number_levels: (int) number of "levelN" properties of the records
+    - batch_size: (int) records fetched per batch
+  """
+  options = LevelOptions()
+  while True:
+    reduced_records = query.fetch(limit=batch_size)
+    if not reduced_records:
+      break
+
+    for reduced_record in reduced_records:
+      options.add([getattr(reduced_record, 'level%s' % i)
+                   for i in range(1, number_levels + 1)])
+
+    query.with_cursor(query.cursor())
+
+  return options
@@ -0,0 +1,255 @@
+"""
+Probabilistic sketches
+
+Fixed size summaries of arbitrarily large collections of values:
+HyperLogLog estimates distinct counts, t-digest estimates quantiles and
+Space Saving finds the most frequent values. All of them can be merged and
+serialized to compact JSON compatible values.
+"""
+import base64
+import bisect
+import hashlib
+import math
+import struct
+import zlib
+
+__all__ = [
+  "HyperLogLog",
+  "SpaceSaving",
+  "TDigest"
+]
+
+
+def _hash64(value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  elif not isinstance(value, str):
+    value = repr(value)
+  return struct.unpack('<Q', hashlib.sha1(value).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+  """
+  Distinct count estimation with 2 ** precision registers
+
+  The relative error is about 1.04 / sqrt(2 ** precision), 1.6% with the
+  default precision of 12, which takes 4 KB.
+  """
+
+  def __init__(self, precision=12):
+    if not 4 <= precision <= 16:
+      raise ValueError("precision should be between 4 and 16")
+
+    self.precision = precision
+    self.registers = bytearray(1 << precision)
+
+  def add(self, value):
+    h = _hash64(value)
+    bits = 64 - self.precision
+    idx = h >> bits
+    rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+    if rank > self.registers[idx]:
+      self.registers[idx] = rank
+
+  def merge(self, other):
+    if other.precision != self.precision:
+      raise ValueError("Can't merge HyperLogLog of different precision")
+
+    self.registers = bytearray(
+      max(a, b) for a, b in zip(self.registers, other.registers))
+
+  def count(self):
+    """ Estimated number of distinct values """
+    m = len(self.registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+    zeros = self.registers.count('\x00')
+    if estimate <= 2.5 * m and zeros:
+      # linear counting is more accurate for small cardinalities
+      estimate = m * math.log(float(m) / zeros)
+    return int(round(estimate))
+
+  def serialize(self):
+    """ Returns [precision, base64 of the compressed registers] """
+    data = zlib.compress(bytes(self.registers), 9)
+    return [self.precision, base64.b64encode(data)]
+
+  @classmethod
+  def deserialize(cls, data):
+    hll = cls(int(data[0]))
+    hll.registers = bytearray(zlib.decompress(base64.b64decode(data[1])))
+    return hll
+
+
+class TDigest(object):
+  """
+  Quantile estimation with a merging t-digest
+
+  Values are buffered and periodically merged into at most `compression`
+  centroids, which are smaller towards the extremes so tail quantiles stay
+  accurate.
+  """
+
+  def __init__(self, compression=100, buffer_size=500):
+    self.compression = compression
+    self.buffer_size = buffer_size
+    self.means = []
+    self.counts = []
+    self.min = None
+    self.max = None
+    self._buffer = []
+
+  def add(self, value, count=1):
+    value = float(value)
+    self._buffer.append((value, count))
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+    if len(self._buffer) >= self.buffer_size:
+      self._compress()
+
+  def merge(self, other):
+    for mean, count in zip(other.means, other.counts):
+      self._buffer.append((mean, count))
+    self._buffer.extend(other._buffer)
+    for value in (other.min, other.max):
+      if value is not None:
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+    self._compress()
+
+  def _k(self, q):
+    """ Scale function, centroids span at most one unit of k """
+    return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+  def _q(self, k):
+    if k >= self.compression / 4.0:
+      return 1.0
+    return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+  def _compress(self):
+    if not self._buffer:
+      return
+
+    points = sorted(zip(self.means, self.counts) + self._buffer)
+    self._buffer = []
+    total = float(sum(count for _, count in points))
+    means, counts = [points[0][0]], [points[0][1]]
+    cumulative = 0
+    q_limit = self._q(self._k(0) + 1)
+    for mean, count in points[1:]:
+      weight = counts[-1] + count
+      if (cumulative + weight) / total <= q_limit:
+        means[-1] += (mean - means[-1]) * count / weight
+        counts[-1] = weight
+      else:
+        cumulative += counts[-1]
+        means.append(mean)
+        counts.append(count)
+        q_limit = self._q(self._k(cumulative / total) + 1)
+
+    self.means, self.counts = means, counts
+
+  def quantile(self, q):
+    """ Estimated value of the q quantile, None if empty """
+    self._compress()
+    if not self.counts:
+      return None
+    if len(self.counts) == 1:
+      return self.means[0]
+
+    total = float(sum(self.counts))
+    target = q * total
+    # centroid centers, with the extremes at both ends
+    centers = [0.0]
+    cumulative = 0
+    for count in self.counts:
+      centers.append(cumulative + count / 2.0)
+      cumulative += count
+    centers.append(total)
+    values = [self.min] + self.means + [self.max]
+
+    idx = bisect.bisect_left(centers, target)
+    if idx == 0:
+      return self.min
+    if idx >= len(centers):
+      return self.max
+
+    low, high = centers[idx - 1], centers[idx]
+    if high == low:
+      return values[idx]
+    fraction = (target - low) / (high - low)
+    return values[idx - 1] + fraction * (values[idx] - values[idx - 1])
+
+  def serialize(self):
+    """ Returns [compression, min, max, means, counts] """
+    self._compress()
+    return [self.compression, self.min, self.max, self.means, self.counts]
+
+  @classmethod
+  def deserialize(cls, data):
+    digest = cls(data[0])
+    digest.min, digest.max = data[1], data[2]
+    digest.means, digest.counts = list(data[3]), list(data[4])
+    return digest
+
+
+class SpaceSaving(object):
+  """
+  Heavy hitters with the Space Saving algorithm
+
+  At most `capacity` counters are kept. When a new item arrives and every
+  counter is taken, the smallest counter is given to it, so counts are
+  overestimated by at most the recorded error. Every item with a frequency
+  above total / capacity is guaranteed to be tracked.
+  """
+
+  def __init__(self, capacity=100):
+    self.capacity = capacity
+    # item -> [count, error]
+    self.counters = {}
+
+  def add(self, item, weight=1):
+    counter = self.counters.get(item)
+    if counter is not None:
+      counter[0] += weight
+    elif len(self.counters) < self.capacity:
+      self.counters[item] = [weight, 0]
+    else:
+      victim = min(self.counters, key=lambda i: self.counters[i][0])
+      count = self.counters.pop(victim)[0]
+      self.counters[item] = [count + weight, count]
+
+  def _floor(self):
+    """ Upper bound of the count of untracked items """
+    if len(self.counters) < self.capacity:
+      return 0
+    return min(count for count, _ in self.counters.itervalues())
+
+  def merge(self, other):
+    floor, other_floor = self._floor(), other._floor()
+    merged = {}
+    for item in set(self.counters) | set(other.counters):
+      count, error = self.counters.get(item, (floor, floor))
+      other_count, other_error = other.counters.get(item, (other_floor, other_floor))
+      merged[item] = [count + other_count, error + other_error]
+
+    top = sorted(merged.iteritems(), key=lambda i: -i[1][0])[:self.capacity]
+    self.counters = dict(top)
+
+  def top(self, k=None):
+    """ Returns up to k (item, count, error) tuples, most frequent first """
+    items = sorted(self.counters.iteritems(), key=lambda i: (-i[1][0], i[0]))
+    return [(item, count, error) for item, (count, error) in items[:k]]
+
+  def serialize(self):
+    """ Returns [capacity, [[item, count, error], ...]] """
+    return [self.capacity, [list(entry) for entry in self.top()]]
+
+  @classmethod
+  def deserialize(cls, data):
+    summary = cls(int(data[0]))
+    summary.counters = dict((item, [count, error])
+                            for item, count, error in data[1])
+    return summary
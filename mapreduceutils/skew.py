@@ -0,0 +1,140 @@
+"""
+Skewed mapper keys
+
+A few very frequent mapper keys send most records to a single reducer
+shard. KeySalter samples the keys of a map shard, detects the hot ones and
+spreads their records over several salted sub-keys. Reducers process every
+sub-key independently and the partial results are merged back by key with
+`merge_salted`, which PostProcess applies when its context sets
+"salt_merge".
+"""
+from collections import OrderedDict
+import json
+import random
+from aggregates import create_aggregate
+from keys import salt_encoded_key, split_salt
+from sketches import SpaceSaving
+
+__all__ = [
+  "KeySalter",
+  "merge_salted",
+  "salt_key",
+  "unsalt_key"
+]
+
+SALT_SEPARATOR = '\x1f'
+
+
+def salt_key(key, salt, key_encoding='text'):
+  """
+  Appends a salt to a mapper key
+
+  Text keys end with SALT_SEPARATOR and the salt number, keys of the
+  "tuple" encoding with a salt element, see keys.salt_encoded_key.
+  """
+  if key_encoding == 'tuple':
+    return salt_encoded_key(key, salt)
+  return key + SALT_SEPARATOR + str(salt)
+
+
+def unsalt_key(key, key_encoding='text'):
+  """ Removes the salt added by salt_key, unsalted keys are returned as is """
+  if key_encoding == 'tuple':
+    return split_salt(key)[0]
+  idx = key.rfind(SALT_SEPARATOR)
+  if idx >= 0 and key[idx + 1:].isdigit():
+    return key[:idx]
+  return key
+
+
+class KeySalter(object):
+  """
+  Detects hot keys of a shard and salts them
+
+  A sample of the keys is counted in a Space Saving summary. Once
+  `min_samples` keys were sampled, keys representing more than `threshold`
+  of the sample are hot: their records are assigned round robin to `salts`
+  sub-keys.
+
+  Usage:
+    salter = KeySalter(salts=8)
+    for key, data in pairs:
+      yield salter.salt(key), data
+  """
+
+  def __init__(self, salts=8, threshold=0.01, sample_rate=0.1,
+               min_samples=1000, capacity=100, seed=None, key_encoding='text'):
+    """
+    Args:
+      - salts: (int) number of sub-keys of every hot key
+      - threshold: (float) sampled fraction from which a key is hot
+      - sample_rate: (float) fraction of the keys sampled
+      - min_samples: (int) samples needed before keys are considered hot
+      - capacity: (int) counters of the Space Saving summary
+      - seed: optional seed of the sampling random generator
+      - key_encoding: (str) encoding of the mapper keys, see salt_key
+    """
+    if salts < 2:
+      raise ValueError("salts should be 2 or more")
+
+    self.salts = salts
+    self.threshold = threshold
+    self.sample_rate = sample_rate
+    self.min_samples = min_samples
+    self.key_encoding = key_encoding
+    self.samples = 0
+    self._sketch = SpaceSaving(capacity)
+    self._random = random.Random(seed)
+    self._next_salt = {}
+
+  def is_hot(self, key):
+    """ True if the key is frequent enough to be salted """
+    if self.samples < self.min_samples:
+      return False
+    counter = self._sketch.counters.get(key)
+    if counter is None:
+      return False
+    # count - error is a lower bound of the sampled occurrences
+    count, error = counter
+    return count - error >= self.threshold * self.samples
+
+  @property
+  def hot_keys(self):
+    """ Keys currently considered hot """
+    return sorted(k for k in self._sketch.counters if self.is_hot(k))
+
+  def salt(self, key):
+    """ Samples the key and returns it salted if it's hot """
+    if self._random.random() < self.sample_rate:
+      self._sketch.add(key)
+      self.samples += 1
+
+    if not self.is_hot(key):
+      return key
+
+    salt = self._next_salt.get(key, 0)
+    self._next_salt[key] = (salt + 1) % self.salts
+    return salt_key(key, salt, self.key_encoding)
+
+
+def merge_salted(records, aggregate):
+  """
+  Merges records sharing the same key
+
+  Args:
+    - records: iterable of (key, value) tuples, values being serialized
+      partial aggregates (or JSON strings of them)
+    - aggregate: (str) name of the aggregate of the values
+
+  Returns:
+    list of (key, serialized value) tuples, in order of first appearance
+  """
+  merged = OrderedDict()
+  for k, v in records:
+    if k not in merged:
+      merged[k] = create_aggregate(aggregate)
+    if isinstance(v, basestring):
+      v = json.loads(v)
+    merged[k].merge(type(merged[k]).deserialize(v))
+
+  return [(k, agg.serialize()) for k, agg in merged.iteritems()]
@@ -1153,6 +1153,33 @@ class TestNdbQueryModifier(unittest.TestCase):
     self.assertIsInstance(chain['xxxx001'], dict)
     self.assertEqual(rec3.to_dict(), chain['xxxx001'])
 
+  def test_async_query(self):
+    """ NdbQueryModifier yields a future when evaluated asynchronously """
+    rec1 = NdbRecord(
+      key=ndb.Key("NdbRecord", 1, namespace="testapp"),
+      abc="Hello World1",
+      bcd=1
+    )
+    rec1.put()
+
+    chain = {}
+    modifier = primitives.NdbQueryModifier(
+      identifier='xxxx001',
+      arguments={
+        "namespace": "testapp",
+        "kind": "NdbRecord",
+        "filters": [
+          ("bcd", "=", 1)
+        ]
+      }
+    )
+    evaluation = modifier.eval_async(Record(), chain)
+    future = next(evaluation)
+    self.assertIsInstance(future, ndb.Future)
+    self.assertNotIn('xxxx001', chain)
+    self.assertRaises(StopIteration, next, evaluation)
+    self.assertEqual(rec1.to_dict(), chain['xxxx001'])
+
 
 class TestNdbQueryChaining(unittest.TestCase):
   def setUp(self):
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import json
+import math
+from mapreduceutils.aggregates import create_aggregate, merge_serialized, \
+  finalize_stddev, approx_distinct, approx_quantiles, heavy_hitters, top_k
+from mapreduceutils._code_to_review import average_values, sum_values
+import unittest
+
+
+VALUES = [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]
+
+
+class TestAggregates(unittest.TestCase):
+
+  def _aggregate(self, name, values):
+    agg = create_aggregate(name)
+    for value in values:
+      agg.add(value)
+    return agg
+
+  def _merged(self, name, values, parts=3):
+    """ Aggregates values split in parts, merging serialized partials """
+    partials = [json.dumps(self._aggregate(name, values[i::parts]).serialize())
+                for i in range(parts)]
+    return merge_serialized(name, partials)
+
+  def test_merge_matches_single_pass(self):
+    """ Merging partial states gives the single pass result """
+    for name in ('count', 'sum', 'avg', 'mean', 'variance', 'stddev',
+                 'min', 'max'):
+      expected = self._aggregate(name, VALUES).finalize()
+      self.assertAlmostEqual(expected, self._merged(name, VALUES).finalize())
+
+  def test_welford(self):
+    """ Mean and sample variance are computed online """
+    self.assertEqual(5.0, self._aggregate('mean', VALUES).finalize())
+    self.assertAlmostEqual(32.0 / 7, self._aggregate('variance', VALUES).finalize())
+    self.assertIsNone(self._aggregate('variance', [1.0]).finalize())
+
+  def test_compensated_sum(self):
+    """ Sums don't lose precision on values of different magnitude """
+    values = [1e16, 1.0, -1e16] * 3 + [0.1] * 10
+    self.assertEqual(math.fsum(values), self._aggregate('sum', values).finalize())
+    merged = create_aggregate('sum')
+    for i in range(3):
+      merged.merge(self._aggregate('sum', values[i::3]))
+    self.assertEqual(math.fsum(values), merged.finalize())
+
+  def test_none_ignored(self):
+    """ None values don't affect counts, sums, averages or extremes """
+    values = [3, None, 1]
+    self.assertEqual(2, self._aggregate('count', values).finalize())
+    self.assertEqual(2.0, self._aggregate('mean', values).finalize())
+    self.assertEqual(4.0, self._aggregate('sum', values).finalize())
+    self.assertEqual(2.0, self._aggregate('avg', values).finalize())
+    self.assertEqual(1, self._aggregate('min', values).finalize())
+    self.assertEqual(3, self._aggregate('max', values).finalize())
+
+  def test_empty(self):
+    """ Empty states finalize to neutral values """
+    self.assertEqual(0, create_aggregate('count').finalize())
+    self.assertIsNone(create_aggregate('avg').finalize())
+    self.assertIsNone(create_aggregate('mean').finalize())
+    self.assertIsNone(merge_serialized('min', []).finalize())
+
+  def test_unknown_aggregate(self):
+    """ Unknown aggregates raise ValueError """
+    self.assertRaises(ValueError, create_aggregate, 'mode')
+
+  def test_finalize_post_function(self):
+    """ Serialized partials are finalized by post processing functions """
+    data = json.dumps(self._aggregate('stddev', VALUES).serialize())
+    [(k, v)] = list(finalize_stddev([("a", data)]))
+    self.assertEqual("a", k)
+    self.assertAlmostEqual(math.sqrt(32.0 / 7), v)
+
+  def test_approx_post_functions(self):
+    """ Distinct values and quantiles of a group are estimated """
+    records = [("r%s" % i, i % 50) for i in range(1, 1001)]
+    self.assertEqual([('', 50)], list(approx_distinct(iter(records))))
+
+    quantiles = dict(approx_quantiles(iter(records)))
+    self.assertEqual(['p50', 'p95', 'p99'], sorted(quantiles))
+    self.assertAlmostEqual(25, quantiles['p50'], delta=2)
+    self.assertAlmostEqual(47, quantiles['p95'], delta=2)
+
+  def test_top_k(self):
+    """ The k highest values are kept in a heap and merge across shards """
+    shards = [self._aggregate('top_k', range(i, 100, 3) + [None])
+              for i in range(3)]
+    self.assertEqual(range(99, 39, -3), shards[0].finalize())
+
+    data = [json.dumps(agg.serialize()) for agg in shards]
+    self.assertEqual(range(99, 79, -1), merge_serialized('top_k', data).finalize())
+    self.assertEqual([], create_aggregate('top_k').finalize())
+
+  def test_top_k_post_functions(self):
+    """ top_k and heavy_hitters yield the k highest records """
+    records = [("r%s" % i, str(i)) for i in range(100)]
+    self.assertEqual([("r99", "99"), ("r98", "98"), ("r97", "97")],
+                     list(top_k(iter(records), k=3)))
+    self.assertEqual(20, len(list(top_k(iter(records)))))
+
+    partials = []
+    for shard in range(2):
+      agg = create_aggregate('heavy_hitters')
+      for value in range(10):
+        for _ in range(value + shard):
+          agg.add(u"v%s" % value)
+      partials.append(("", json.dumps(agg.serialize())))
+    self.assertEqual([(u"v9", 19), (u"v8", 17)],
+                     list(heavy_hitters(iter(partials), k=2)))
+
+  def test_reduce_values(self):
+    """ Reduce functions stream values """
+    self.assertEqual(5.0, average_values(str(v) for v in VALUES))
+    self.assertEqual(40.0, sum_values(iter(VALUES)))
+    self.assertRaises(ZeroDivisionError, average_values, [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+import datetime
+from mapreduceutils.avrofile import (
+  AvroContainerWriter,
+  AvroReader,
+  schema_for_property_list
+)
+from mapreduceutils.writers import OutputWriter
+import unittest
+
+
+class TestAvroSchema(unittest.TestCase):
+
+  def test_schema_from_property_list(self):
+    """ Avro schema is derived from plain attributes and modifiers """
+    property_list = [
+      "attr1",
+      "record_entry.name",
+      [{
+        "method": "mapreduceutils.modifiers.primitives.DateFormatModifier",
+        "identifier": "year",
+        "operands": {"value": "model.created_time"},
+        "args": {"date_format": "%Y"}
+      }],
+      [{
+        "method": "mapreduceutils.modifiers.primitives.RoundNumberModifier",
+        "identifier": "rounded",
+        "operands": {"value": "model.amount"},
+        "args": {"ndigits": 2}
+      }]
+    ]
+    schema = schema_for_property_list(property_list)
+
+    names = [f['name'] for f in schema['fields']]
+    self.assertEqual(['attr1', 'record_entry_name', 'year', 'rounded'], names)
+
+    types = [f['type'] for f in schema['fields']]
+    self.assertEqual(["null", "long", "double", "boolean", "string"], types[0])
+    self.assertEqual(["null", "long", "string"], types[2])
+    self.assertEqual(["null", "double", "string"], types[3])
+    self.assertEqual('record_entry.name', schema['fields'][1]['source'])
+
+
+class TestAvroContainerWriter(unittest.TestCase):
+
+  def setUp(self):
+    self.property_list = ["name", "quality", "score", "created", "flag"]
+    self.rows = [
+      OrderedDict([
+        ("name", u"caf\xe9"),
+        ("quality", 3),
+        ("score", 1.5),
+        ("created", datetime.datetime(2014, 8, 1, 0, 0, 0)),
+        ("flag", True)
+      ]),
+      OrderedDict([
+        ("name", None),
+        ("quality", -12345678901),
+        ("score", None),
+        ("created", None),
+        ("flag", False)
+      ])
+    ]
+
+  def _roundtrip(self, codec, block_size=64 * 1024):
+    writer = OutputWriter.get_writer('avro').open(
+      self.property_list, codec=codec, block_size=block_size)
+    data = writer.header()
+    for row in self.rows:
+      data += writer.write(row)
+    data += writer.flush()
+    return list(AvroReader(data))
+
+  def test_deflate_roundtrip(self):
+    """ Records written with deflate codec are read back """
+    records = self._roundtrip('deflate')
+
+    self.assertEqual(2, len(records))
+    self.assertEqual(u"caf\xe9", records[0]['name'])
+    self.assertEqual(3, records[0]['quality'])
+    self.assertEqual(1.5, records[0]['score'])
+    self.assertEqual(u"2014-08-01 00:00:00", records[0]['created'])
+    self.assertEqual(True, records[0]['flag'])
+    self.assertEqual(None, records[1]['name'])
+    self.assertEqual(-12345678901, records[1]['quality'])
+    self.assertEqual(False, records[1]['flag'])
+
+  def test_multiple_blocks_roundtrip(self):
+    """ Records spanning several blocks are read back in order """
+    self.rows = self.rows * 50
+    records = self._roundtrip('null', block_size=64)
+
+    self.assertEqual(100, len(records))
+    self.assertEqual([3, -12345678901] * 50, [r['quality'] for r in records])
+
+  def test_empty_flush(self):
+    """ Flushing without pending records generates no block """
+    schema = schema_for_property_list(self.property_list)
+    writer = AvroContainerWriter(schema)
+    self.assertEqual('', writer.flush())
+    self.assertEqual([], list(AvroReader(writer.header())))
+
+  def test_invalid_codec(self):
+    """ Unsupported codecs are rejected """
+    schema = schema_for_property_list(self.property_list)
+    self.assertRaises(ValueError, AvroContainerWriter, schema, codec='snappy')
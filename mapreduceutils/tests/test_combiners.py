@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+from mapreduceutils.combiners import Combiner
+import unittest
+
+
+class TestCombiner(unittest.TestCase):
+
+  def _rows(self):
+    return [
+      ("a", OrderedDict([("x", 1), ("y", 10)])),
+      ("b", OrderedDict([("x", 2), ("y", None)])),
+      ("a", OrderedDict([("x", 3), ("y", 30)]))
+    ]
+
+  def _combine(self, operation):
+    combiner = Combiner()
+    for key, row in self._rows():
+      self.assertEqual([], combiner.add(key, row, operation))
+    return dict((k, dict(v)) for k, v in combiner.flush())
+
+  def test_sum(self):
+    """ Columns are summed by key """
+    self.assertEqual({"a": {"x": 4.0, "y": 40.0}, "b": {"x": 2.0, "y": 0.0}},
+                     self._combine("sum"))
+
+  def test_count(self):
+    """ Non null values are counted by key """
+    self.assertEqual({"a": {"x": 2, "y": 2}, "b": {"x": 1, "y": 0}},
+                     self._combine("count"))
+
+  def test_avg(self):
+    """ Averages are reported as mergeable [sum, count] partials """
+    self.assertEqual({"a": {"x": [4.0, 2], "y": [40.0, 2]},
+                      "b": {"x": [2.0, 1], "y": [0.0, 0]}},
+                     self._combine("avg"))
+
+  def test_min_max(self):
+    """ Minimum and maximum values are kept by key """
+    self.assertEqual({"x": 1, "y": 10}, self._combine("min")["a"])
+    self.assertEqual({"x": 3, "y": 30}, self._combine("max")["a"])
+
+  def test_rejected_row(self):
+    """ Rows with an invalid value leave the states and keys untouched """
+    combiner = Combiner()
+    self.assertRaises(ValueError, combiner.add, "a",
+                      OrderedDict([("x", 5), ("y", "n/a")]), "sum")
+    self.assertEqual(0, len(combiner))
+
+    combiner.add("a", OrderedDict([("x", 1), ("y", "2")]), "sum")
+    self.assertRaises(ValueError, combiner.add, "a",
+                      OrderedDict([("x", 5), ("y", object())]), "mean")
+    self.assertEqual([("a", {"x": 1.0, "y": 2.0})],
+                     [(k, dict(v)) for k, v in combiner.flush()])
+
+  def test_flush_clears_keys(self):
+    """ Flushing returns and clears the partial aggregates """
+    combiner = Combiner(max_keys=1)
+    self.assertEqual([], combiner.add("a", OrderedDict([("x", 1)]), "sum"))
+    flushed = combiner.add("b", OrderedDict([("x", 1)]), "sum")
+    self.assertEqual(["a", "b"], [k for k, _ in flushed])
+    self.assertEqual(0, len(combiner))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+from mapreduceutils.compression import CompressedOutput, decompress
+from mapreduceutils.writers import OutputWriter
+import unittest
+import zlib
+
+
+class TestCompressedOutput(unittest.TestCase):
+
+  def setUp(self):
+    self.rows = [
+      OrderedDict([
+        ("sprop_abc", idx),
+        ("sprop_bcd", "test message"),
+        ("sprop_cde", None)
+      ]) for idx in range(10)
+    ]
+
+  def test_frames_are_batched(self):
+    """ Rows are compressed in frames of batch_rows rows """
+    output = CompressedOutput(OutputWriter.get_writer('csv'), batch_rows=4)
+    frames = [output.write(row) for row in self.rows]
+    frames.append(output.flush())
+    frames = [f for f in frames if f]
+
+    self.assertEqual(3, len(frames))
+    expected = ''.join("{},test message,\r\n".format(i) for i in range(10))
+    self.assertEqual(expected, decompress(''.join(frames)))
+
+  def test_frames_are_independent(self):
+    """ Every frame can be decompressed on its own """
+    output = CompressedOutput(OutputWriter.get_writer('json'), batch_rows=5)
+    frames = [f for f in (output.write(row) for row in self.rows) if f]
+
+    self.assertEqual(2, len(frames))
+    second = zlib.decompress(frames[1], 16 + zlib.MAX_WBITS)
+    self.assertTrue(second.startswith('{"sprop_abc": 5'))
+
+  def test_header_frame(self):
+    """ The header of the wrapped writer is compressed in its own frame """
+    output = CompressedOutput(OutputWriter.get_writer('json_array'),
+                              header='["a", "b"]\r\n')
+    header = output.header()
+    self.assertEqual(header, output.header())
+    self.assertEqual('["a", "b"]\r\n', decompress(header))
+
+    frame = output.write(self.rows[0]) + output.flush()
+    self.assertEqual('["a", "b"]\r\n[0, "test message", null]\r\n',
+                     decompress(header + frame))
+    self.assertEqual('', CompressedOutput(OutputWriter.get_writer('csv')).header())
+
+  def test_compression_ratio(self):
+    """ Compression ratio is reported for generated frames """
+    output = CompressedOutput(OutputWriter.get_writer('csv'))
+    self.assertEqual(0.0, output.ratio)
+
+    for row in self.rows * 10:
+      output.write(row)
+    output.flush()
+    self.assertTrue(output.ratio > 1.0)
+    self.assertEqual('gz', output.extension)
+
+  def test_invalid_codec(self):
+    """ Unsupported codecs are rejected """
+    writer = OutputWriter.get_writer('csv')
+    self.assertRaises(ValueError, CompressedOutput, writer, codec='lzma')
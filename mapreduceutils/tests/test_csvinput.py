@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+from mapreduceutils import CSVRecord, MapperPlan, MapperRecord
+from mapreduceutils.csvinput import CSVColumns, CSVRow
+import unittest
+
+
+PROPERTY_MAP = [{
+  "model_match_rule": {
+    "properties": [("record_type", "sale")]
+  },
+  "property_list": [
+    "name",
+    "amount",
+    [{
+      "identifier": "total",
+      "method": "mapreduceutils.modifiers.primitives.ArithmeticModifier",
+      "operands": {"value": "model.quantity"},
+      "args": {"expression": "value * 2"}
+    }]
+  ],
+  "defaults": {"name": u"unknown"}
+}]
+
+
+class TestCSVColumns(unittest.TestCase):
+
+  def setUp(self):
+    self.columns = CSVColumns.from_header(
+      'record_type,name,amount,quantity,active,extra\r\n',
+      {"amount": "float", "quantity": "int", "active": "bool",
+       "extra": "json"})
+
+  def test_values(self):
+    """ Columns are resolved by name and converted to their type """
+    row = self.columns.row(['sale', 'caf\xc3\xa9', '1.5', '3', 'yes',
+                            '{"a": 1}'])
+    self.assertEqual(
+      [u"sale", u"caf\xe9", 1.5, 3, True, {"a": 1}],
+      [self.columns.value(row, name) for name in self.columns.fieldnames])
+
+  def test_empty_and_missing(self):
+    """ Empty typed cells, short rows and unknown columns are None """
+    row = self.columns.row(['sale', '', '', 'three'])
+    self.assertEqual(u"", self.columns.value(row, "name"))
+    self.assertIsNone(self.columns.value(row, "amount"))
+    self.assertIsNone(self.columns.value(row, "quantity"))
+    self.assertIsNone(self.columns.value(row, "active"))
+    self.assertIsNone(self.columns.value(row, "missing"))
+
+  def test_rows(self):
+    """ Lines are parsed into rows of the file """
+    rows = list(self.columns.rows(['sale,"a, b",2\n', 'sale,c,3\n']))
+    self.assertTrue(all(isinstance(row, CSVRow) for row in rows))
+    self.assertIs(self.columns, rows[0].columns)
+    self.assertEqual([u"a, b", u"c"],
+                     [self.columns.value(row, "name") for row in rows])
+
+  def test_invalid_type(self):
+    """ Unknown column types raise ValueError """
+    self.assertRaises(ValueError, CSVColumns, [u"a"], {"a": "decimal"})
+
+
+class TestCSVRecord(unittest.TestCase):
+
+  def setUp(self):
+    self.plan = MapperPlan({'property_map': PROPERTY_MAP,
+                            'output_format': 'csv',
+                            'csv_column_types': {"amount": "float",
+                                                 "quantity": "int"}})
+    self.columns = self.plan.csv_columns(['record_type', 'name', 'amount',
+                                          'quantity', 'blob'])
+
+  def test_referenced_fields(self):
+    """ Columns read by the plan are compiled with the header """
+    self.assertEqual(
+      frozenset(["record_type", "name", "amount", "quantity"]),
+      self.plan.referenced_fields)
+    self.assertEqual(
+      sorted(self.plan.referenced_fields), sorted(self.columns._resolvers))
+
+  def test_dotted_columns(self):
+    """ Dotted names resolve the column of that name before nested values """
+    property_map = [{
+      "model_match_rule": {"properties": [("record_type", "sale")]},
+      "property_list": ["name", "parent.child", "meta.tag"]
+    }]
+    plan = MapperPlan({'property_map': property_map, 'output_format': 'csv',
+                       'csv_column_types': {"meta": "json"}})
+    self.assertTrue("parent.child" in plan.referenced_names)
+    columns = plan.csv_columns(['record_type', 'name', 'parent.child', 'meta'])
+    self.assertTrue("parent.child" in columns._resolvers)
+
+    row = columns.row(['sale', 'x', 'hello', '{"tag": "t"}'])
+    self.assertEqual(["x,hello,t\r\n"], list(plan.process(row)))
+
+  def test_record(self):
+    """ CSV rows are mapped as CSVRecords """
+    row = self.columns.row(['sale', '', '2.5', '4', 'x' * 100])
+    record = MapperRecord.create(row)
+    self.assertIsInstance(record, CSVRecord)
+
+    record, rule = self.plan.match(row)
+    props = record.pick_properties(rule["property_list"])
+    self.assertEqual([u"unknown", 2.5, 8], props.values())
+    self.assertEqual(["unknown,2.5,8\r\n"], list(self.plan.process(row)))
+
+  def test_not_matching(self):
+    """ Rows are matched with their column values """
+    row = self.columns.row(['refund', 'a', '2.5', '4', ''])
+    self.assertIsNone(self.plan.match(row))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,9 +1,11 @@
 import unittest
 import datetime
+import json
 from google.appengine.ext import db
 from google.appengine.ext import ndb
 from google.appengine.ext import testbed
-from mapreduceutils import MapperRecord
+from mapreduceutils import DictRecord, EntityProtoRecord, GAE_DBRecord, \
+  GAE_NDBRecord, JSONRecord, MapperRecord
 
 class SampleDbModel(db.Expando):
   pass
@@ -181,6 +183,119 @@ class TestDatastoreRecordAttributeResolution(unittest.TestCase):
     self.assertEqual("This is a, test string", props['schema_name'])
     self.assertEqual("Some value here", props['expando_attr'])
 
+  def test_json_attribute_resolution(self):
+    """ MapperRecord resolves values from JSON strings """
+
+    data = json.dumps({
+      "record_type": "test_record",
+      "data_quality": 3,
+      "nested": {"schema_name": "aves"}
+    })
+    record = MapperRecord.create(data)
+    self.assertIsInstance(record, DictRecord)
+    props = record.pick_properties([
+      'record_type',
+      'data_quality',
+      'nested.schema_name',
+      'missing'
+    ])
+    self.assertEqual([u"test_record", 3, u"aves", None], props.values())
+
+    self.assertIsNone(MapperRecord.create('{not json}'))
+
+
+class Address(ndb.Model):
+  city = ndb.StringProperty()
+
+
+class SampleProtoModel(ndb.Expando):
+  address = ndb.StructuredProperty(Address)
+
+
+class TestEntityProtoRecord(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+    key = ndb.Key('ABC', 1, 'SampleProtoModel', 10)
+    self.entity = SampleProtoModel(
+      key=key, record_type=u"test_record", data_quality=3,
+      created_time=datetime.datetime(2010, 8, 12, 18, 23, 20),
+      tags=[u"a", u"b"], ref=ndb.Key('ABC', 2), address=Address(city=u"c"),
+      blob=u"x" * 1000)
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_attribute_resolution(self):
+    """ Raw entities resolve the values of their model """
+    names = ['record_type', 'data_quality', 'created_time', 'tags', 'ref',
+             'address.city', 'key', 'missing']
+    record = MapperRecord.create(self.entity._to_pb())
+    self.assertIsInstance(record, EntityProtoRecord)
+    self.assertEqual(
+      MapperRecord.create(self.entity).pick_properties(names),
+      record.pick_properties(names))
+    self.assertEqual((('ABC', 1), ('SampleProtoModel', 10)), record._key_pairs)
+
+  def test_lazy_conversion(self):
+    """ Only the properties read are converted """
+    record = EntityProtoRecord.from_bytes(self.entity._to_pb().Encode())
+    record.set_defaults({"missing": 0})
+    self.assertEqual([3, 0], record.pick_properties(
+      ['data_quality', 'missing']).values())
+    self.assertEqual(['data_quality'], record._values.keys())
+
+
+class Point(object):
+  def __init__(self, x, y):
+    self.x = x
+    self.y = y
+
+
+class PointRecord(MapperRecord):
+  def _resolve_value(self, obj, name):
+    return getattr(obj, name, self._defaults.get(name))
+
+
+class TestRecordDispatch(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.record_types = list(MapperRecord._record_types)
+
+  def tearDown(self):
+    MapperRecord._record_types[:] = self.record_types
+    MapperRecord._dispatch.clear()
+    self.testbed.deactivate()
+
+  def test_record_classes(self):
+    """ Record classes are looked up once per concrete input type """
+    self.assertIs(GAE_NDBRecord,
+                  MapperRecord.lookup_record_class(SampleNDBModel))
+    self.assertIs(GAE_DBRecord, MapperRecord.lookup_record_class(SampleDbModel))
+    self.assertIs(JSONRecord, MapperRecord.lookup_record_class(unicode))
+    self.assertIs(DictRecord, MapperRecord.lookup_record_class(dict))
+    self.assertIs(GAE_NDBRecord, MapperRecord._dispatch[SampleNDBModel])
+
+  def test_unsupported_type(self):
+    """ Inputs of unregistered types raise TypeError """
+    self.assertRaises(TypeError, MapperRecord.create, Point(1, 2))
+    self.assertRaises(TypeError, MapperRecord.create, None)
+
+  def test_register(self):
+    """ New input types are supported once registered """
+    MapperRecord.register(Point, PointRecord)
+    record = MapperRecord.create(Point(1, 2))
+    self.assertIsInstance(record, PointRecord)
+    self.assertEqual([1, 2], record.pick_properties(['x', 'y']).values())
+
 
 class TestDatastoreRecordFilterMatching(unittest.TestCase):
 
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+import json
+from mapreduceutils.decoders import JSON_DECODERS, get_json_decoder
+import unittest
+
+
+class TestDecoders(unittest.TestCase):
+
+  def test_get_json_decoder(self):
+    """ Decoders are resolved by name or qualified name """
+    self.assertIs(json.loads, get_json_decoder('json'))
+    self.assertIs(json.loads, get_json_decoder('json.loads'))
+    self.assertIn(get_json_decoder('auto'), JSON_DECODERS.values())
+
+  def test_unknown_decoder(self):
+    """ Unavailable decoders raise ValueError """
+    self.assertRaises(ValueError, get_json_decoder, 'yaml')
+    self.assertRaises(ValueError, get_json_decoder, 'missing.loads')
+
+
+if __name__ == '__main__':
+  unittest.main()
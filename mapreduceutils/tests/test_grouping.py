@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+from mapreduceutils.grouping import ExternalSorter, group_pairs, merge_sorted
+import unittest
+
+
+class TestGroupPairs(unittest.TestCase):
+
+  def setUp(self):
+    self.pairs = [
+      ("b", 1), ("a", 2), ("c", 3), ("a", 4), ("b", 5), ("a", 6), ("c", 7)
+    ]
+    self.expected = [("a", [2, 4, 6]), ("b", [1, 5]), ("c", [3, 7])]
+
+  def test_unsorted_input_in_memory(self):
+    """ Unsorted pairs are grouped keeping items order """
+    self.assertEqual(self.expected, list(group_pairs(self.pairs)))
+
+  def test_unsorted_input_spilled(self):
+    """ Pairs spilled to temporary files are grouped keeping items order """
+    sorter = ExternalSorter(max_items=2)
+    for key, item in self.pairs:
+      sorter.add(key, item)
+
+    self.assertEqual(3, sorter.num_runs)
+    self.assertEqual(self.expected, list(group_pairs(sorter, sorted_input=True)))
+    self.assertEqual(self.expected, list(group_pairs(self.pairs, max_items=2)))
+
+  def test_sorted_input_is_streamed(self):
+    """ Groups of sorted input are yielded before reading the whole input """
+    read = []
+
+    def pairs():
+      for pair in sorted(self.pairs, key=lambda p: p[0]):
+        read.append(pair)
+        yield pair
+
+    groups = group_pairs(pairs(), sorted_input=True)
+    self.assertEqual(("a", [2, 4, 6]), next(groups))
+    self.assertTrue(len(read) < len(self.pairs))
+
+  def test_sorted_input_order_is_checked(self):
+    """ Unsorted input given as sorted raises ValueError """
+    groups = group_pairs(self.pairs, sorted_input=True)
+    self.assertRaises(ValueError, list, groups)
+
+  def test_merge_sorted(self):
+    """ Sorted iterables are merged keeping the order of equal keys """
+    merged = merge_sorted([
+      [("a", 1), ("b", 2)],
+      [("a", 3), ("c", 4)]
+    ])
+    self.assertEqual([("a", 1), ("a", 3), ("b", 2), ("c", 4)], list(merged))
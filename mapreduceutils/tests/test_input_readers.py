@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import (
+  ndb,
+  testbed
+)
+from mapreduce import model
+from mapreduceutils.input_readers import EntityProtoInputReader
+import unittest
+
+
+class SampleModel(ndb.Expando):
+  pass
+
+
+class TestEntityProtoInputReader(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_yields_entity_protos(self):
+    """ Entities of the kind are read as raw protocol buffers """
+    ndb.put_multi([SampleModel(id=i, value=i) for i in range(1, 11)])
+    mapper_spec = model.MapperSpec(
+      "mapreduceutils.record_map",
+      "mapreduceutils.input_readers.EntityProtoInputReader",
+      {"input_reader": {"entity_kind": "SampleModel"}}, 2)
+
+    protos = [proto for reader in EntityProtoInputReader.split_input(mapper_spec)
+              for proto in reader]
+    self.assertTrue(all(isinstance(p, entity_pb.EntityProto) for p in protos))
+    self.assertEqual(range(1, 11),
+                     sorted(ndb.Key(reference=p.key()).id() for p in protos))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import struct
+import tempfile
+from mapreduceutils.jsonlines import LineIndex, MappedJSONLines
+import unittest
+
+
+class TestMappedJSONLines(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'input.jsonl')
+    with open(self.path, 'wb') as f:
+      for i in range(10):
+        f.write(json.dumps({"n": i}) + '\n')
+      f.write('\n{broken\n{"n": 10}')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_records(self):
+    """ Lines are decoded, empty and invalid ones are skipped """
+    with MappedJSONLines(self.path) as lines:
+      self.assertEqual(13, len(lines))
+      self.assertEqual(range(11), [r["n"] for r in lines.records()])
+      self.assertEqual('{"n": 3}\n', lines.line(3))
+
+  def test_restart(self):
+    """ Reading can start from any line """
+    with MappedJSONLines(self.path) as lines:
+      self.assertEqual([7, 8], [r["n"] for r in lines.records(7, 9)])
+      self.assertEqual([10], [r["n"] for r in lines.records(11)])
+
+  def test_persisted_index(self):
+    """ The index is saved next to the file and reused until it changes """
+    MappedJSONLines(self.path).close()
+    self.assertTrue(os.path.exists(self.path + '.idx'))
+
+    original = LineIndex.build
+    LineIndex.build = classmethod(lambda cls, data: self.fail("rescanned"))
+    try:
+      with MappedJSONLines(self.path) as lines:
+        self.assertEqual(13, len(lines))
+    finally:
+      LineIndex.build = original
+
+    with open(self.path, 'ab') as f:
+      f.write('\n{"n": 11}\n')
+    with MappedJSONLines(self.path) as lines:
+      self.assertEqual(range(12), [r["n"] for r in lines.records()])
+
+  def test_index_format(self):
+    """ Offsets are saved as little endian unsigned 64 bits integers """
+    with MappedJSONLines(self.path) as lines:
+      offsets = list(lines.index.offsets)
+    with open(self.path + '.idx', 'rb') as f:
+      data = f.read()
+    self.assertEqual(24 + 8 * len(offsets), len(data))
+    self.assertEqual(offsets,
+                     list(struct.unpack_from('<%sQ' % len(offsets), data, 24)))
+
+  def test_split(self):
+    """ Lines are split into contiguous ranges """
+    index = LineIndex.build('a\nb\nc\nd\ne')
+    self.assertEqual(5, len(index))
+    self.assertEqual([(0, 1), (1, 3), (3, 5)], index.split(3))
+    self.assertEqual([(0, 1), (1, 2)], LineIndex.build('a\nb\n').split(4))
+
+  def test_empty_file(self):
+    """ Empty files have no lines """
+    path = os.path.join(self.tmpdir, 'empty.jsonl')
+    open(path, 'wb').close()
+    with MappedJSONLines(path) as lines:
+      self.assertEqual([], list(lines.records()))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+import datetime
+from mapreduceutils.keys import decode_key, encode_key, salt_encoded_key, \
+  split_salt
+import unittest
+
+
+class TestKeys(unittest.TestCase):
+
+  def test_round_trip(self):
+    """ Decoding returns the encoded values """
+    values = (None, True, False, -3, 2 ** 40, -1.5, 0.0, 1e100,
+              datetime.date(2014, 3, 1),
+              datetime.datetime(1960, 5, 4, 3, 2, 1, 123456),
+              u"a|b", u"nul\x00char", u"\xf1and\xfa", u"")
+    self.assertEqual(values, decode_key(encode_key(values)))
+
+  def test_salt(self):
+    """ Salt elements are split from keys and skipped when decoding """
+    key = encode_key([u"a\x00", 1.5, None])
+    self.assertEqual((key, None), split_salt(key))
+    self.assertEqual((key, 7), split_salt(salt_encoded_key(key, 7)))
+    self.assertEqual((u"a\x00", 1.5, None),
+                     decode_key(salt_encoded_key(key, 7)))
+    self.assertRaises(ValueError, decode_key, key[:-3] + '\x50')
+
+  def test_bytes_decoded_as_unicode(self):
+    """ Byte strings and other types are decoded as unicode strings """
+    self.assertEqual((u"abc", u"[1, 2]"), decode_key(encode_key(["abc", [1, 2]])))
+
+  def test_order(self):
+    """ Keys sort as the tuples they encode """
+    tuples = [
+      (u"a", -10), (u"a", -2), (u"a", 3), (u"a", 10), (u"a", 100),
+      (u"a\x00", 1), (u"ab", 1), (u"b",),
+    ]
+    keys = [encode_key(t) for t in tuples]
+    self.assertEqual(keys, sorted(keys))
+
+    floats = [-1e10, -2.5, -0.5, 0.0, 0.25, 3.0, 1e10]
+    keys = [encode_key([f]) for f in floats]
+    self.assertEqual(keys, sorted(keys))
+
+    dates = [datetime.datetime(1900, 1, 1), datetime.datetime(1970, 1, 1),
+             datetime.datetime(2010, 8, 12, 18, 23, 20)]
+    keys = [encode_key([d]) for d in dates]
+    self.assertEqual(keys, sorted(keys))
+
+  def test_mixed_numbers_order(self):
+    """ Integers and floats of a column sort by value """
+    numbers = [-1e300, -2 ** 63, -10, -2.5, -0.0, 0, 0.0, 1e-9, 2, 2.5, 10,
+               2 ** 53, 2 ** 53 + 1, 9007199254740994.0, 2 ** 63 - 1,
+               float('inf')]
+    keys = [encode_key([u"a", n]) for n in numbers]
+    self.assertEqual(keys, sorted(keys))
+    self.assertTrue(encode_key([10]) > encode_key([2.5]))
+
+    decoded = [decode_key(key)[1] for key in keys]
+    self.assertEqual(numbers, decoded)
+    self.assertEqual([isinstance(n, float) for n in numbers],
+                     [isinstance(n, float) for n in decoded])
+
+  def test_prefix_order(self):
+    """ Shorter tuples sort before the tuples they prefix """
+    self.assertLess(encode_key([u"a"]), encode_key([u"a", None]))
+    self.assertLess(encode_key([]), encode_key([None]))
+
+  def test_invalid(self):
+    """ Out of range integers and corrupt keys raise ValueError """
+    self.assertRaises(ValueError, encode_key, [2 ** 64])
+    self.assertRaises(ValueError, decode_key, '\xee')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import tempfile
+from mapreduceutils.avrofile import AvroReader
+from mapreduceutils.compression import decompress
+from mapreduceutils.local import KeyValue, LocalRunner, post_process, \
+  read_json_lines, read_range, run_mapreduce, run_sharded, split_shards
+from mapreduceutils.keys import decode_key
+from mapreduce.records import RecordsReader
+from mapreduceutils.tests.test_record_mapper import PROPERTY_MAP
+import unittest
+
+
+GROUPED_MAP = [{
+  "model_match_rule": {
+    "properties": [("record_type", "sale")]
+  },
+  "property_list": ["amount"],
+  "mapper_key_spec": ["region", "product"]
+}]
+
+
+def sum_reducer(key, values):
+  """ Sums the CSV amounts of a key """
+  yield key, str(sum(float(v) for v in values))
+
+
+def double(values):
+  for k, v in values:
+    yield k, float(v) * 2
+
+
+class TestLocalRunner(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _path(self, name):
+    return os.path.join(self.tmpdir, name)
+
+  def _records(self, num, record_type="test_record"):
+    return [{"record_type": record_type, "name": "name%s" % i, "quality": i + 1}
+            for i in range(num)]
+
+  def test_json_lines_to_csv(self):
+    """ JSON lines are mapped to a local CSV file """
+    with open(self._path('input.jsonl'), 'wb') as f:
+      for record in self._records(5):
+        f.write(json.dumps(record) + '\n')
+      f.write('\n{not json}\n')
+
+    runner = LocalRunner({'property_map': PROPERTY_MAP, 'output_format': 'csv',
+                          'chunk_rows': 2})
+    stats = runner.run(read_json_lines(self._path('input.jsonl')),
+                       self._path('out.csv'))
+
+    with open(self._path('out.csv')) as f:
+      lines = f.read().splitlines()
+    self.assertEqual(["name%s,%s" % (i, i + 1) for i in range(5)], lines)
+    self.assertEqual(6, stats['records'])
+    self.assertEqual(0, stats['pairs'])
+
+  def test_json_decoder(self):
+    """ JSON lines are decoded with the configured decoder """
+    lines = [json.dumps(record) for record in self._records(3)]
+    runner = LocalRunner({'property_map': PROPERTY_MAP, 'output_format': 'csv',
+                          'json_decoder': 'auto'})
+    runner.run(lines + ['{not json}'], self._path('out.csv'))
+
+    with open(self._path('out.csv')) as f:
+      lines = f.read().splitlines()
+    self.assertEqual(["name%s,%s" % (i, i + 1) for i in range(3)], lines)
+
+  def test_avro_header(self):
+    """ Batch writers get their header before the first block """
+    runner = LocalRunner({'property_map': PROPERTY_MAP[:1],
+                          'output_format': 'avro'})
+    runner.run(self._records(3), self._path('out.avro'))
+
+    with open(self._path('out.avro'), 'rb') as f:
+      rows = list(AvroReader(f))
+    self.assertEqual([u"name0", u"name1", u"name2"], [r["name"] for r in rows])
+
+  def test_pairs(self):
+    """ Keyed and combined rows are handed to on_pair """
+    pairs = []
+    records = self._records(2, "keyed_record") + \
+      self._records(2, "combined_record") * 2
+    runner = LocalRunner({'property_map': PROPERTY_MAP, 'output_format': 'csv'})
+    stats = runner.run(records, self._path('out.csv'),
+                       on_pair=lambda k, v: pairs.append((k, v)))
+
+    self.assertEqual([(u"name0", "name0,1\r\n"), (u"name1", "name1,2\r\n"),
+                      (u"name0", '{"quality": 2.0}'),
+                      (u"name1", '{"quality": 4.0}')], pairs)
+    self.assertEqual(4, stats['pairs'])
+    self.assertEqual(0, os.path.getsize(self._path('out.csv')))
+
+
+class TestShardedRunner(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.input = os.path.join(self.tmpdir, 'input.jsonl')
+    with open(self.input, 'wb') as f:
+      for i in range(50):
+        record_type = "keyed_record" if i % 5 == 0 else "test_record"
+        f.write(json.dumps({"record_type": record_type, "name": "name%s" % i,
+                            "quality": i + 1}) + '\n')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_split_shards(self):
+    """ Byte ranges start on lines and cover every line once """
+    ranges = split_shards(self.input, 7)
+    self.assertEqual(7, len(ranges))
+    lines = []
+    for start, end in ranges:
+      shard = list(read_range(self.input, start, end))
+      self.assertTrue(shard[0].startswith('{'))
+      lines.extend(shard)
+    with open(self.input, 'rb') as f:
+      self.assertEqual(f.readlines(), lines)
+
+  def test_more_shards_than_lines(self):
+    """ Empty ranges are dropped """
+    path = os.path.join(self.tmpdir, 'small.jsonl')
+    with open(path, 'wb') as f:
+      f.write('{"a": 1}\n{"a": 2}\n')
+    self.assertEqual(2, len(split_shards(path, 10)))
+
+  def test_json_pool(self):
+    """ Shards are processed by a pool and merged """
+    prefix = os.path.join(self.tmpdir, 'out')
+    params = {'property_map': PROPERTY_MAP, 'output_format': 'csv'}
+    shards = run_sharded(params, self.input, prefix, num_shards=4,
+                         processes=2, merge=True)
+
+    self.assertEqual(4, len(shards))
+    self.assertEqual(50, sum(s['records'] for s in shards))
+    with open(prefix) as f:
+      names = [line.split(',')[0] for line in f.read().splitlines()]
+    self.assertEqual(["name%s" % i for i in range(50) if i % 5], names)
+
+    pairs = []
+    for stats in shards:
+      if stats['pairs_output']:
+        with open(stats['pairs_output'], 'rb') as f:
+          for record in RecordsReader(f):
+            proto = KeyValue()
+            proto.ParseFromString(record)
+            pairs.append(proto.key())
+    self.assertEqual(["name%s" % i for i in range(0, 50, 5)], pairs)
+
+  def test_compressed_merge(self):
+    """ Compressed json_array shards merge with a single header """
+    prefix = os.path.join(self.tmpdir, 'out')
+    params = {'property_map': PROPERTY_MAP, 'output_format': 'json_array',
+              'output_compression': 'gzip'}
+    run_sharded(params, self.input, prefix, num_shards=3, processes=1,
+                merge=True)
+
+    with open(prefix, 'rb') as f:
+      lines = decompress(f.read()).splitlines()
+    self.assertEqual('["name", "quality"]', lines[0])
+    self.assertEqual(40, len(lines[1:]))
+
+  def test_line_index(self):
+    """ JSON lines shards can be split by the persisted line index """
+    prefix = os.path.join(self.tmpdir, 'out')
+    params = {'property_map': PROPERTY_MAP, 'output_format': 'csv'}
+    shards = run_sharded(params, self.input, prefix, num_shards=5,
+                         processes=1, merge=True, line_index=True)
+
+    self.assertEqual([10] * 5, [s['records'] for s in shards])
+    self.assertTrue(os.path.exists(self.input + '.idx'))
+    with open(prefix) as f:
+      names = [line.split(',')[0] for line in f.read().splitlines()]
+    self.assertEqual(["name%s" % i for i in range(50) if i % 5], names)
+
+  def test_csv_avro_merge(self):
+    """ CSV input is mapped by column name, Avro shards merge into a file """
+    path = os.path.join(self.tmpdir, 'input.csv')
+    with open(path, 'wb') as f:
+      f.write('record_type,name\n')
+      for i in range(20):
+        f.write('test_record,name%s\n' % i)
+
+    prefix = os.path.join(self.tmpdir, 'out')
+    property_map = [dict(PROPERTY_MAP[0], property_list=["name"])]
+    run_sharded({'property_map': property_map, 'output_format': 'avro'},
+                path, prefix, input_format='csv', num_shards=3, processes=1,
+                merge=True)
+
+    with open(prefix, 'rb') as f:
+      names = [row["name"] for row in AvroReader(f)]
+    self.assertEqual([u"name%s" % i for i in range(20)], names)
+
+  def test_invalid_format(self):
+    """ Unknown input formats raise ValueError """
+    self.assertRaises(ValueError, run_sharded, {}, self.input, 'out',
+                      input_format='xml')
+
+
+class TestLocalMapReduce(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.output = os.path.join(self.tmpdir, 'reduced')
+    self.records = []
+    for i in range(30):
+      self.records.append({"record_type": "sale", "region": "r%s" % (i % 2),
+                           "product": "p%s" % (i % 3), "amount": i + 1})
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _read(self):
+    with open(self.output, 'rb') as f:
+      for record in RecordsReader(f):
+        proto = KeyValue()
+        proto.ParseFromString(record)
+        yield proto.key(), proto.value()
+
+  def test_map_shuffle_reduce(self):
+    """ Pairs are sorted, grouped and reduced into KeyValue records """
+    stats = run_mapreduce({'property_map': GROUPED_MAP, 'output_format': 'csv'},
+                          self.records, __name__ + ".sum_reducer", self.output,
+                          max_items=7, tmpdir=self.tmpdir)
+
+    self.assertEqual(6, stats['keys'])
+    self.assertEqual(30, stats['pairs'])
+    expected = {}
+    for r in self.records:
+      key = "%s|%s" % (r["region"], r["product"])
+      expected[key] = expected.get(key, 0.0) + r["amount"]
+    reduced = list(self._read())
+    self.assertEqual(sorted(expected), [k for k, _ in reduced])
+    self.assertEqual(expected, dict((k, float(v)) for k, v in reduced))
+
+  def test_tuple_keys(self):
+    """ Tuple encoded keys are reduced in value order """
+    records = [{"record_type": "sale", "region": i, "product": "p",
+                "amount": 1} for i in (10, 9, 100, 10)]
+    run_mapreduce({'property_map': GROUPED_MAP, 'output_format': 'csv',
+                   'key_encoding': 'tuple'}, records, sum_reducer, self.output)
+
+    keys = [decode_key(k) for k, _ in self._read()]
+    self.assertEqual([(9, u"p"), (10, u"p"), (100, u"p")], keys)
+
+  def test_post_process(self):
+    """ Post processing functions are applied to local reduced records """
+    run_mapreduce({'property_map': GROUPED_MAP, 'output_format': 'csv'},
+                  self.records, sum_reducer, self.output)
+    results = list(post_process([self.output], [__name__ + ".double"],
+                                {'key_concat_seq': u'|'}))
+
+    self.assertEqual(6, len(results))
+    self.assertEqual([u"r0", u"p0"], results[0][0])
+    self.assertEqual(2 * sum(range(1, 31, 6)), results[0][1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,4 +1,5 @@
 from mapreduceutils import MapperRecord
+from mapreduceutils.keys import decode_key
 import datetime
 from google.appengine.ext import (
   ndb,
@@ -126,3 +127,26 @@ class TestModelMapperKey(unittest.TestCase):
       'test_record|2010|08',
       record.mapper_key(mapper_key_spec)
     )
+
+  def test_mapper_key_tuple_encoding(self):
+    """ MapperRecord generates order preserving keys with typed values """
+    data = {
+      "record_type": "test|record",
+      "created_time": datetime.datetime(2010, 8, 12, 18, 23, 20),
+      "data_quality": 3
+    }
+
+    mapper_key_spec = [
+      'record_type',
+      'created_time',
+      'data_quality'
+    ]
+
+    entity = DummyModel(**data)
+    entity.put()
+    record = MapperRecord.create(entity)
+    key = record.mapper_key(mapper_key_spec, encoding='tuple')
+    self.assertEqual(
+      (u"test|record", datetime.datetime(2010, 8, 12, 18, 23, 20), 3),
+      decode_key(key)
+    )
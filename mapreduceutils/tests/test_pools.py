@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+from google.appengine.ext import db, testbed
+from mapreduceutils.pools import PutPool
+import unittest
+
+
+class PooledModel(db.Model):
+  value = db.IntegerProperty()
+
+
+class TestPutPool(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_entities_are_stored_on_flush(self):
+    """ Pending entities are stored when the pool is flushed """
+    pool = PutPool(batch_size=10, max_in_flight=2)
+    for idx in range(25):
+      pool.put(PooledModel(value=idx))
+
+    self.assertEqual(20, pool.num_puts)
+    pool.flush()
+    self.assertEqual(25, pool.num_puts)
+    values = sorted(m.value for m in PooledModel.all())
+    self.assertEqual(range(25), values)
+
+  def test_empty_flush(self):
+    """ Flushing an empty pool does nothing """
+    pool = PutPool()
+    pool.flush()
+    self.assertEqual(0, pool.num_puts)
+
+  def test_invalid_batch_size(self):
+    """ Batches bigger than the datastore limit are rejected """
+    self.assertRaises(ValueError, PutPool, batch_size=501)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+from mapreduceutils.postprocess import compose, map_groups, resolve, \
+  streaming
+import unittest
+
+PREFIX = __name__ + "."
+
+
+@streaming
+def double(values):
+  for k, v in values:
+    yield k, v * 2
+
+
+def share(values):
+  total = sum(v for k, v in values)
+  for k, v in values:
+    yield k, v * 100 / total
+
+
+class TestCompose(unittest.TestCase):
+
+  def test_functions_are_chained(self):
+    """ Functions are applied in order """
+    pipeline = compose([double, share])
+    self.assertEqual([("a", 25), ("b", 75)],
+                     list(pipeline([("a", 1), ("b", 3)])))
+
+  def test_non_streaming_functions_get_lists(self):
+    """ Functions not marked as streaming receive a list """
+    received = []
+
+    def spy(values):
+      received.append(values)
+      return values
+
+    pipeline = compose([double, spy])
+    list(pipeline([("a", 1)]))
+    self.assertEqual([[("a", 2)]], received)
+
+
+  def test_options_are_bound(self):
+    """ [name, options] pairs bind the options as keyword arguments """
+    func = resolve(["mapreduceutils.aggregates.top_k", {u"k": 2}])
+    self.assertTrue(func.streaming)
+    self.assertEqual([("b", 3), ("c", 2)],
+                     list(func(iter([("a", 1), ("b", 3), ("c", 2)]))))
+
+
+class TestMapGroups(unittest.TestCase):
+
+  def setUp(self):
+    self.groups = [("g%03d" % i, [("a", i + 1), ("b", 3 * (i + 1))])
+                   for i in range(50)]
+    self.funcs = [PREFIX + "double", PREFIX + "share"]
+    self.expected = [(key, [("a", 25), ("b", 75)]) for key, _ in self.groups]
+
+  def _run(self, **kwargs):
+    return [(key, list(records)) for key, records in
+            map_groups(iter(self.groups), self.funcs, **kwargs)]
+
+  def test_sequential(self):
+    """ Groups are processed in the calling thread """
+    self.assertEqual(self.expected, self._run())
+
+  def test_thread_pool(self):
+    """ Groups processed by a thread pool keep their order """
+    self.assertEqual(self.expected, self._run(workers=4, chunksize=2))
+
+  def test_concurrent_thread_pools(self):
+    """ Interleaved thread pools keep their own functions """
+    doubled = map_groups(iter(self.groups), [PREFIX + "double"], workers=2,
+                         chunksize=1)
+    first = next(doubled)
+    shares = self._run(workers=2, chunksize=1)
+
+    expected = [(key, [(k, v * 2) for k, v in records])
+                for key, records in self.groups]
+    self.assertEqual(expected, [first] + list(doubled))
+    self.assertEqual(self.expected, shares)
+
+  def test_process_pool(self):
+    """ Groups processed by a process pool keep their order """
+    self.assertEqual(self.expected,
+                     self._run(workers=2, executor='process', chunksize=3))
+
+  def test_invalid_executor(self):
+    """ Unknown executors are rejected """
+    self.assertRaises(ValueError, self._run, workers=2, executor='fiber')
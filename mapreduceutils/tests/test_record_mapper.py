@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+import datetime
+import json
+import math
+import pickle
+from mapreduceutils import MapperPlan, RecordMapper, record_map
+from mapreduceutils.aggregates import AGGREGATES, create_aggregate, \
+  merge_partials, merge_serialized
+from mapreduceutils.avrofile import AvroReader
+from mapreduceutils.compression import decompress
+from mapreduceutils.skew import salt_key, unsalt_key
+from mapreduceutils.modifiers import FieldModifier
+from mapreduce import context
+import unittest
+
+
+class _Spec(object):
+  def __init__(self, mapreduce_id, params):
+    self.mapreduce_id = mapreduce_id
+    self.mapper = type('MapperSpec', (object,), {'params': params})()
+
+
+class _Context(object):
+  def __init__(self, mapreduce_id, params):
+    self.mapreduce_spec = _Spec(mapreduce_id, params)
+
+
+class _SliceContext(object):
+  def __init__(self, number=0):
+    self.number = number
+    self.shard_context = type('ShardContext', (object,), {'id': 'job-0'})()
+    self.emitted = []
+
+  def emit(self, value):
+    self.emitted.append(value)
+
+
+class _StandInFuture(object):
+  """ Future resolved when waited for, tracking how many are in flight """
+  in_flight = 0
+  max_in_flight = 0
+
+  def __init__(self, value):
+    self.value = value
+    self.done = False
+    cls = _StandInFuture
+    cls.in_flight += 1
+    cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+
+  def get_result(self):
+    if not self.done:
+      self.done = True
+      _StandInFuture.in_flight -= 1
+    if isinstance(self.value, Exception):
+      raise self.value
+    return self.value
+
+
+class LookupModifier(FieldModifier):
+  """ Asynchronous stand-in of an I/O modifier, upper cases its operand """
+  ASYNC = True
+
+  def _evaluate(self):
+    return self._evaluate_async().get_result()
+
+  def _evaluate_async(self):
+    value = self.get_operand('value')
+    if value == 'bad':
+      return _StandInFuture(ValueError("lookup failed"))
+    return _StandInFuture(value.upper())
+
+
+VALUES = [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]
+
+
+LOOKUP = {
+  "method": __name__ + ".LookupModifier",
+  "operands": {"value": "model.name"}
+}
+
+
+PROPERTY_MAP = [
+  {
+    "model_match_rule": {
+      "properties": [("record_type", "test_record")]
+    },
+    "property_list": ["name", "quality"]
+  },
+  {
+    "model_match_rule": {
+      "properties": [("record_type", "keyed_record")]
+    },
+    "property_list": ["name", "quality"],
+    "mapper_key_spec": ["name"]
+  },
+  {
+    "model_match_rule": {
+      "properties": [("record_type", "combined_record")]
+    },
+    "property_list": ["quality"],
+    "mapper_key_spec": ["name"],
+    "combine": "sum"
+  }
+]
+
+
+class TestRecordMapper(unittest.TestCase):
+
+  def _run(self, params, records, slices=1, mapreduce_id=None):
+    params.setdefault('property_map', PROPERTY_MAP)
+    context.Context._set(_Context(mapreduce_id or self.id(), params))
+    mapper = RecordMapper()
+    mapper.begin_shard(None)
+    out = []
+    per_slice = len(records) // slices
+    for number in range(slices):
+      slice_ctx = _SliceContext(number)
+      mapper.begin_slice(slice_ctx)
+      for rec in records[number * per_slice:(number + 1) * per_slice]:
+        out.extend(mapper(rec))
+      mapper.end_slice(slice_ctx)
+      out.extend(slice_ctx.emitted)
+      # the framework serializes the handler between slices
+      mapper = pickle.loads(pickle.dumps(mapper))
+    return out
+
+  def tearDown(self):
+    context.Context._set(None)
+
+  def _records(self, num, record_type="test_record"):
+    return [{"record_type": record_type, "name": "name%s" % i, "quality": i}
+            for i in range(num)]
+
+  def test_rows_are_yielded_in_blocks(self):
+    """ Map only rows are yielded in blocks of chunk_rows """
+    out = self._run({'output_format': 'csv', 'chunk_rows': 4},
+                    self._records(10))
+
+    self.assertEqual(3, len(out))
+    self.assertEqual("name0,0\r\nname1,1\r\nname2,2\r\nname3,3\r\n", out[0])
+    self.assertEqual("name8,8\r\nname9,9\r\n", out[2])
+
+  def test_pending_rows_flushed_every_slice(self):
+    """ Pending rows are emitted at the end of each slice """
+    out = self._run({'output_format': 'csv', 'chunk_rows': 100},
+                    self._records(10), slices=2)
+
+    self.assertEqual(2, len(out))
+    self.assertEqual(10, ''.join(out).count("\r\n"))
+
+  def test_keyed_rows_are_not_chunked(self):
+    """ (key, data) tuples are yielded as record_map does """
+    out = self._run({'output_format': 'csv', 'chunk_rows': 100},
+                    self._records(3, "keyed_record"))
+
+    self.assertEqual([("name0", "name0,0\r\n"), ("name1", "name1,1\r\n"),
+                      ("name2", "name2,2\r\n")], out)
+
+  def test_hot_keys_salted(self):
+    """ Hot keys are salted across slices when salt_hot_keys is set """
+    records = [{"record_type": "keyed_record", "name": "hot", "quality": i + 1}
+               for i in range(400)]
+    out = self._run({'output_format': 'csv', 'salt_hot_keys': 4,
+                     'hot_key_sample_rate': 1.0}, records, slices=2)
+
+    keys = [key for key, _ in out]
+    self.assertEqual(set([u"hot"]), set(unsalt_key(key) for key in keys))
+    # salting starts once 1000 keys are sampled
+    self.assertEqual(set([u"hot"]), set(keys))
+
+    out = self._run({'output_format': 'csv', 'salt_hot_keys': 4,
+                     'hot_key_sample_rate': 1.0}, records * 3, slices=2)
+    keys = [key for key, _ in out]
+    self.assertEqual(5, len(set(keys)))
+    counts = [keys.count(salt_key(u"hot", i)) for i in range(4)]
+    self.assertEqual(1200, keys.count(u"hot") + sum(counts))
+    self.assertTrue(max(counts) - min(counts) <= 1)
+
+  def _lookup_map(self):
+    return [{
+      "model_match_rule": {
+        "properties": [("record_type", "test_record")]
+      },
+      "property_list": [
+        [dict(LOOKUP, identifier="first")],
+        [dict(LOOKUP, identifier="upper"),
+         dict(LOOKUP, identifier="second", operands={"value": "identifier.upper"})]
+      ]
+    }]
+
+  def test_concurrency_window(self):
+    """ Asynchronous modifiers of a window run concurrently, in order """
+    _StandInFuture.max_in_flight = 0
+    records = self._records(10)
+    records[3]["name"] = "bad"
+    params = {'property_map': self._lookup_map(), 'output_format': 'csv',
+              'concurrency_window': 4}
+    out = self._run(params, records, slices=2)
+
+    expected = ["NAME%s,NAME%s\r\n" % (i, i) for i in range(10) if i != 3]
+    self.assertEqual(''.join(expected), ''.join(out))
+    self.assertEqual(4, _StandInFuture.max_in_flight)
+    self.assertEqual(0, _StandInFuture.in_flight)
+
+  def test_sequential_modifiers(self):
+    """ Without a window asynchronous modifiers are waited one by one """
+    _StandInFuture.max_in_flight = 0
+    params = {'property_map': self._lookup_map(), 'output_format': 'csv'}
+    out = self._run(params, self._records(3))
+
+    expected = ["NAME%s,NAME%s\r\n" % (i, i) for i in range(3)]
+    self.assertEqual(''.join(expected), ''.join(out))
+    self.assertEqual(1, _StandInFuture.max_in_flight)
+
+  def test_compressed_blocks(self):
+    """ Blocks are compressed when output_compression is given """
+    out = self._run({'output_format': 'json', 'chunk_rows': 4,
+                     'output_compression': 'gzip'}, self._records(10))
+
+    lines = decompress(''.join(out)).splitlines()
+    self.assertEqual(10, len(lines))
+
+  def test_compressed_json_array(self):
+    """ The json_array header is compressed once per shard """
+    out = self._run({'output_format': 'json_array', 'chunk_rows': 3,
+                     'output_compression': 'gzip'}, self._records(6),
+                    slices=2)
+
+    lines = decompress(''.join(out)).splitlines()
+    self.assertEqual('["name", "quality"]', lines[0])
+    self.assertEqual(['["name%s", %s]' % (i, i) for i in range(6)], lines[1:])
+
+  def test_avro_output_across_slices(self):
+    """ Avro header is written once per shard and blocks share the marker """
+    out = self._run({'property_map': PROPERTY_MAP[:1],
+                     'output_format': 'avro', 'chunk_rows': 3},
+                    self._records(10), slices=2)
+
+    records = list(AvroReader(''.join(out)))
+    self.assertEqual(range(10), [r['quality'] for r in records])
+
+  def test_batch_writer_can_not_be_compressed(self):
+    """ Block writers are not compressed twice """
+    params = {'property_map': PROPERTY_MAP[:1], 'output_format': 'avro',
+              'output_compression': 'gzip'}
+    self.assertRaises(ValueError, MapperPlan, params)
+
+  def test_batch_writer_map_only(self):
+    """ Block writers reject keyed rules and record_map """
+    params = {'property_map': PROPERTY_MAP, 'output_format': 'avro'}
+    self.assertRaises(ValueError, MapperPlan, params)
+
+    params = {'property_map': PROPERTY_MAP[:1], 'output_format': 'avro'}
+    context.Context._set(_Context(self.id(), params))
+    self.assertRaises(ValueError, list, record_map(self._records(1)[0]))
+
+  def test_keyed_json_array(self):
+    """ Keyed json_array jobs only emit pairs, never a bare header """
+    out = self._run({'output_format': 'json_array'},
+                    self._records(4, "keyed_record"), slices=2)
+
+    self.assertEqual(4, len(out))
+    self.assertTrue(all(isinstance(o, tuple) for o in out))
+    self.assertEqual('["name0", 0]\r\n', out[0][1])
+
+  def test_json_array_header_needs_record_mapper(self):
+    """ record_map can't write the json_array header of map only rows """
+    params = {'property_map': PROPERTY_MAP, 'output_format': 'json_array'}
+    context.Context._set(_Context(self.id(), params))
+    self.assertRaises(ValueError, list, record_map(self._records(1)[0]))
+
+    params = {'property_map': PROPERTY_MAP[1:], 'output_format': 'json_array'}
+    context.Context._set(_Context(self.id() + 'keyed', params))
+    self.assertEqual([("name0", '["name0", 0]\r\n')],
+                     list(record_map(self._records(1, "keyed_record")[0])))
+
+  def test_combined_rows_are_emitted_per_slice(self):
+    """ Rows of rules with combine are aggregated by key within a slice """
+    records = [{"record_type": "combined_record", "name": "k%s" % (i % 2),
+                "quality": i + 1} for i in range(8)]
+    out = self._run({'output_format': 'json'}, records, slices=2)
+
+    self.assertEqual([
+      ("k0", '{"quality": 4.0}'),
+      ("k1", '{"quality": 6.0}'),
+      ("k0", '{"quality": 12.0}'),
+      ("k1", '{"quality": 14.0}')
+    ], out)
+
+  def _assert_close(self, expected, actual):
+    if isinstance(expected, float):
+      self.assertAlmostEqual(expected, actual, places=9)
+    elif isinstance(expected, list):
+      self.assertEqual(len(expected), len(actual))
+      for e, a in zip(expected, actual):
+        self._assert_close(e, a)
+    else:
+      self.assertEqual(expected, actual)
+
+  def test_combined_partials_merge(self):
+    """ Partials of every combine operation merge into the unsplit result """
+    values = [v for v in range(1, 9) for _ in range(v)]
+    records = [{"record_type": "combined_record", "name": "k", "quality": v}
+               for v in values]
+    for output_format in ('csv', 'json'):
+      for name in sorted(AGGREGATES):
+        property_map = [dict(PROPERTY_MAP[2], combine=name)]
+        out = self._run({'property_map': property_map,
+                         'output_format': output_format}, records, slices=3,
+                        mapreduce_id='{}-{}'.format(output_format, name))
+        self.assertEqual(3, len(out))
+
+        expected = create_aggregate(name)
+        for value in values:
+          expected.add(value)
+        states = [json.loads(data)["quality"] for _, data in out]
+        self._assert_close(expected.finalize(),
+                           merge_serialized(name, states).finalize())
+        merged = merge_partials(name, [data for _, data in out])
+        self._assert_close(expected.finalize(), merged["quality"].finalize())
+
+  def test_combined_statistics_merge(self):
+    """ Counts and Welford states of combined columns merge across slices """
+    property_map = [dict(PROPERTY_MAP[2], property_list=["quality", "bonus"])]
+    records = [{"record_type": "combined_record", "name": "k", "quality": v,
+                "bonus": v if v % 2 else None} for v in VALUES]
+    expected = {
+      'count': {"quality": 8, "bonus": 4},
+      'mean': {"quality": 5.0, "bonus": 6.5},
+      'variance': {"quality": 32.0 / 7, "bonus": 11.0 / 3},
+      'stddev': {"quality": math.sqrt(32.0 / 7), "bonus": math.sqrt(11.0 / 3)}
+    }
+    for name, columns in sorted(expected.items()):
+      out = self._run({'property_map': [dict(property_map[0], combine=name)],
+                       'output_format': 'csv'}, records, slices=4,
+                      mapreduce_id=name)
+      self.assertEqual(4, len(out))
+      merged = merge_partials(name, [data for _, data in out])
+      for col, value in columns.iteritems():
+        self.assertAlmostEqual(value, merged[col].finalize())
+
+  def test_combined_sketches_merge(self):
+    """ Distinct and heavy_hitters sketches of combined text columns merge """
+    property_map = [dict(PROPERTY_MAP[2], property_list=["label"])]
+    records = [{"record_type": "combined_record", "name": "k",
+                "label": "v%s" % v} for v in range(1, 9) for _ in range(v)]
+    for name in ('distinct', 'heavy_hitters', 'top_k'):
+      out = self._run({'property_map': [dict(property_map[0], combine=name)],
+                       'output_format': 'json'}, records, slices=3,
+                      mapreduce_id=name)
+      self.assertEqual(3, len(out))
+      merged = merge_partials(name, [data for _, data in out])["label"]
+      if name == 'distinct':
+        self.assertEqual(8, merged.finalize())
+      elif name == 'top_k':
+        expected = [u"v%s" % v for v in range(8, 0, -1) for _ in range(v)]
+        self.assertEqual(expected[:20], merged.finalize())
+      else:
+        self.assertEqual([[u"v%s" % v, v] for v in range(8, 0, -1)],
+                         merged.finalize())
+
+  def test_combined_datetimes(self):
+    """ Date and datetime states are encoded as the row writers do """
+    property_map = [dict(PROPERTY_MAP[2], property_list=["created", "day"])]
+    records = [{"record_type": "combined_record", "name": "k",
+                "created": datetime.datetime(2010, 8, d, 18, 23, 20),
+                "day": datetime.date(2010, 8, d)} for d in (12, 3, 21)]
+    for name in ('min', 'max'):
+      out = self._run({'property_map': [dict(property_map[0], combine=name)],
+                       'output_format': 'json'}, records, slices=3,
+                      mapreduce_id=name)
+      merged = merge_partials(name, [data for _, data in out])
+      day = "03" if name == 'min' else "21"
+      self.assertEqual("2010-08-%s 18:23:20" % day,
+                       merged["created"].finalize())
+      self.assertEqual("2010-08-%s" % day, merged["day"].finalize())
+
+  def test_rejected_combined_row(self):
+    """ Rows skipped for an invalid value don't change the other columns """
+    property_map = [dict(PROPERTY_MAP[2], property_list=["quality", "label"])]
+    records = [{"record_type": "combined_record", "name": "k", "quality": 5,
+                "label": "n/a"},
+               {"record_type": "combined_record", "name": "k", "quality": 1,
+                "label": "2"}]
+    out = self._run({'property_map': property_map, 'output_format': 'json'},
+                    records)
+    self.assertEqual([("k", '{"quality": 1.0, "label": 2.0}')], out)
+
+  def test_combiner_memory_limit(self):
+    """ Partial aggregates are yielded when combine_max_keys is exceeded """
+    records = [{"record_type": "combined_record", "name": "k%s" % i,
+                "quality": i + 1} for i in range(5)]
+    out = self._run({'output_format': 'csv', 'combine_max_keys': 2}, records)
+
+    self.assertEqual(["k0", "k1", "k2", "k3", "k4"], [k for k, _ in out])
+
+  def test_invalid_combine_operation(self):
+    """ Unknown combine operations are rejected """
+    property_map = [dict(PROPERTY_MAP[2], combine="mode")]
+    params = {'property_map': property_map}
+    self.assertRaises(ValueError, MapperPlan, params)
+
+  def test_invalid_key_encoding(self):
+    """ Unknown key encodings are rejected """
+    params = {'property_map': PROPERTY_MAP, 'key_encoding': 'binary'}
+    self.assertRaises(ValueError, MapperPlan, params)
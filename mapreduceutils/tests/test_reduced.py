@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+from google.appengine.ext import db, testbed
+from mapreduceutils.reduced import KeyGrouper, KeyValue, LevelOptions, \
+  scan_level_options
+import unittest
+
+
+def _records(pairs):
+  records = []
+  for key, value in pairs:
+    proto = KeyValue()
+    proto.set_key(key)
+    proto.set_value(value)
+    records.append(proto.Encode())
+  return records
+
+
+def _grouped(groups):
+  return sorted((key, sorted(records)) for key, records in groups)
+
+
+class TestKeyGrouper(unittest.TestCase):
+
+  def test_sorted_prefix_keys(self):
+    """ Sorted keys whose group prefixes prefix each other are grouped """
+    # sorted as the shuffle sorts them, "0" < "|"
+    reader = _records([("r10|b", "1"), ("r1|a", "2"), ("r1|c", "3")])
+    grouper = KeyGrouper()
+    groups = list(grouper.group([reader], sorted_input=True))
+    self.assertEqual([
+      (u"r10", [(u"b", u"1")]),
+      (u"r1", [(u"a", u"2"), (u"c", u"3")])
+    ], groups)
+    self.assertEqual([u"r10"], grouper.explode_group_key(groups[0][0]))
+
+  def test_sorted_readers_are_merged(self):
+    """ Sorted readers are merged as the shuffle orders keys """
+    readers = [_records([("r10|b", "1"), ("r1|a", "2")]),
+               _records([("r10|a", "3"), ("r1|c", "4")])]
+    groups = list(KeyGrouper().group(readers, sorted_input=True))
+    self.assertEqual([u"r10", u"r1"], [key for key, _ in groups])
+    self.assertEqual([(u"a", u"3"), (u"b", u"1")], groups[0][1])
+    self.assertEqual(_grouped(groups), _grouped(KeyGrouper().group(readers)))
+
+  def test_sorted_mixed_depths(self):
+    """ Sorted keys of different depths are grouped as unsorted ones """
+    for keys in (["a|b|c|y", "a|b|x"],
+                 ["a|b|a", "a|b|c|y", "a|b|x"],
+                 ["a|x", "b", "c|y", "d"],
+                 ["__stub__", "a|x", "c|y"]):
+      readers = [_records([(key, str(i)) for i, key in enumerate(keys)])]
+      grouped = list(KeyGrouper().group(readers, sorted_input=True))
+      self.assertEqual(_grouped(KeyGrouper().group(readers)), _grouped(grouped))
+      self.assertEqual(len(set(k for k, _ in grouped)), len(grouped))
+
+  def test_unsorted_input(self):
+    """ Unsorted input is rejected when declared sorted """
+    readers = [_records([("r1|a", "1"), ("r0|b", "2")])]
+    self.assertRaises(ValueError, list,
+                      KeyGrouper().group(readers, sorted_input=True))
+
+  def test_stub_group(self):
+    """ Single part keys are grouped under "__stub__" """
+    groups = list(KeyGrouper().group([_records([("a", "1"), ("b", "2")])]))
+    self.assertEqual([("__stub__", [(u"a", u"1"), (u"b", u"2")])], groups)
+    self.assertEqual([], KeyGrouper().explode_group_key("__stub__"))
+
+
+class LeveledRecord(db.Model):
+  path = db.StringProperty()
+  level1 = db.StringProperty()
+  level2 = db.StringProperty()
+
+
+class TestLevelOptions(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_options(self):
+    """ Level values are sorted, shorter groupings add None """
+    options = LevelOptions()
+    options.add([u"b", u"y"])
+    options.add([u"a", u"x"])
+    options.add([u"b", u"x"])
+    self.assertEqual({'level1': [u"a", u"b"], 'level2': [u"x", u"y"]},
+                     options.options(2))
+
+    options.add([u"c"])
+    self.assertEqual({'level1': [u"a", u"b", u"c"],
+                      'level2': [None, u"x", u"y"],
+                      'level3': [None]}, options.options(3))
+    self.assertEqual({'level1': []}, LevelOptions().options(1))
+
+  def test_scan(self):
+    """ Every record of the query is read, batch by batch """
+    for idx in range(7):
+      LeveledRecord(path=u"p", level1=u"l%s" % (idx % 4),
+                    level2=u"m%s" % idx if idx % 2 else None).put()
+    LeveledRecord(path=u"other", level1=u"z").put()
+
+    query = LeveledRecord.all().filter('path =', u"p")
+    options = scan_level_options(query, 2, batch_size=3)
+    self.assertEqual({'level1': [u"l0", u"l1", u"l2", u"l3"],
+                      'level2': [None, u"m1", u"m3", u"m5"]},
+                     options.options(2))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+import json
+import random
+from mapreduceutils.sketches import HyperLogLog, SpaceSaving, TDigest
+from mapreduceutils.aggregates import create_aggregate, merge_serialized
+import unittest
+
+
+class TestHyperLogLog(unittest.TestCase):
+
+  def test_small_counts(self):
+    """ Small cardinalities are counted almost exactly """
+    hll = HyperLogLog()
+    for i in range(100):
+      hll.add(u"user-%s" % (i % 50))
+    self.assertAlmostEqual(50, hll.count(), delta=1)
+
+  def test_large_counts(self):
+    """ Large cardinalities are estimated within a few percent """
+    hll = HyperLogLog()
+    for i in range(50000):
+      hll.add(i)
+    self.assertAlmostEqual(1.0, hll.count() / 50000.0, delta=0.05)
+
+  def test_merge_serialized(self):
+    """ Serialized sketches are compact and merge as a union """
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+      (a if i % 2 else b).add(i)
+      a.add(i % 10)
+    data = json.dumps(a.serialize())
+    self.assertLess(len(data), 6 * 1024)
+    merged = HyperLogLog.deserialize(json.loads(data))
+    merged.merge(b)
+    self.assertAlmostEqual(1.0, merged.count() / 3000.0, delta=0.05)
+
+  def test_invalid_precision(self):
+    """ Precision outside 4..16 raises ValueError """
+    self.assertRaises(ValueError, HyperLogLog, 20)
+
+
+class TestTDigest(unittest.TestCase):
+
+  def setUp(self):
+    rnd = random.Random(42)
+    self.values = [rnd.random() * 1000 for _ in range(20000)]
+
+  def test_quantiles(self):
+    """ Quantiles are estimated with a bounded number of centroids """
+    digest = TDigest()
+    for value in self.values:
+      digest.add(value)
+    self.assertAlmostEqual(500, digest.quantile(0.5), delta=15)
+    self.assertAlmostEqual(950, digest.quantile(0.95), delta=10)
+    self.assertEqual(min(self.values), digest.quantile(0))
+    self.assertEqual(max(self.values), digest.quantile(1))
+    self.assertLess(len(digest.serialize()[3]), 200)
+
+  def test_merge(self):
+    """ Digests of different shards merge into an accurate digest """
+    digests = [TDigest() for _ in range(4)]
+    for idx, value in enumerate(self.values):
+      digests[idx % 4].add(value)
+    merged = TDigest.deserialize(json.loads(json.dumps(digests[0].serialize())))
+    for digest in digests[1:]:
+      merged.merge(digest)
+    self.assertAlmostEqual(500, merged.quantile(0.5), delta=15)
+    self.assertAlmostEqual(990, merged.quantile(0.99), delta=5)
+
+  def test_small(self):
+    """ Empty and single value digests """
+    digest = TDigest()
+    self.assertIsNone(digest.quantile(0.5))
+    digest.add(3)
+    self.assertEqual(3.0, digest.quantile(0.95))
+
+  def test_aggregates(self):
+    """ Sketches are available as aggregates """
+    partials = []
+    for part in range(2):
+      agg = create_aggregate('p95')
+      for value in self.values[part::2]:
+        agg.add(value)
+      partials.append(json.dumps(agg.serialize()))
+    self.assertAlmostEqual(950, merge_serialized('p95', partials).finalize(),
+                           delta=10)
+
+    agg = create_aggregate('distinct')
+    for value in ["a", "b", "a", None]:
+      agg.add(value)
+    self.assertEqual(2, agg.finalize())
+
+
+class TestSpaceSaving(unittest.TestCase):
+
+  def _stream(self):
+    """ Zipf like stream, item i appears 1000 / i times """
+    rnd = random.Random(7)
+    items = [u"item-%s" % i for i in range(1, 200) for _ in range(1000 // i)]
+    rnd.shuffle(items)
+    return items
+
+  def test_heavy_hitters(self):
+    """ The most frequent items are found with bounded counters """
+    summary = SpaceSaving(capacity=50)
+    for item in self._stream():
+      summary.add(item)
+    self.assertEqual(50, len(summary.counters))
+    top = summary.top(3)
+    self.assertEqual([u"item-1", u"item-2", u"item-3"], [i for i, _, _ in top])
+    for item, count, error in top:
+      self.assertTrue(count - error <= 1000 // int(item[5:]) <= count)
+
+  def test_merge(self):
+    """ Summaries of different shards merge into the global heavy hitters """
+    items = self._stream()
+    summaries = [SpaceSaving(capacity=50) for _ in range(3)]
+    for idx, item in enumerate(items):
+      summaries[idx % 3].add(item)
+    merged = SpaceSaving.deserialize(
+      json.loads(json.dumps(summaries[0].serialize())))
+    for summary in summaries[1:]:
+      merged.merge(summary)
+    self.assertEqual([u"item-1", u"item-2", u"item-3"],
+                     [i for i, _, _ in merged.top(3)])
+
+  def test_heavy_hitters_aggregate(self):
+    """ heavy_hitters aggregates finalize to [value, count] pairs """
+    agg = create_aggregate('heavy_hitters')
+    for value in ["a", "b", "a", None, "c", "a", "b"]:
+      agg.add(value)
+    self.assertEqual([["a", 3], ["b", 2], ["c", 1]], agg.finalize())
+
+
+if __name__ == '__main__':
+  unittest.main()
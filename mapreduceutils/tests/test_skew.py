@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import datetime
+from mapreduceutils.keys import decode_key, encode_key
+from mapreduceutils.reduced import KeyGrouper, KeyValue
+from mapreduceutils.skew import KeySalter, merge_salted, salt_key, unsalt_key
+import unittest
+
+
+class TestSkew(unittest.TestCase):
+
+  def _keys(self):
+    """ Half of the keys are "hot", the rest are unique """
+    keys = []
+    for i in range(5000):
+      keys.append(u"hot")
+      keys.append(u"cold|%s" % i)
+    return keys
+
+  def test_salt_key(self):
+    """ Salted keys are restored by unsalt_key """
+    self.assertEqual(u"a|b", unsalt_key(salt_key(u"a|b", 3)))
+    self.assertEqual(u"a|b", unsalt_key(u"a|b"))
+    self.assertEqual(u"a\x1fb", unsalt_key(u"a\x1fb"))
+
+  def test_salt_tuple_key(self):
+    """ Tuple keys ending like a text salt round trip through salting """
+    day = datetime.date.fromordinal(0x0b1f31)
+    key = encode_key([u"acct", day])
+    self.assertTrue(key.endswith('\x1f1'))
+    self.assertEqual(key, unsalt_key(key, 'tuple'))
+    for salt in (0, 3, 31):
+      salted = salt_key(key, salt, 'tuple')
+      self.assertEqual(key, unsalt_key(salted, 'tuple'))
+      self.assertEqual((u"acct", day), decode_key(salted))
+
+  def test_tuple_keys_salted(self):
+    """ Salted tuple keys are merged back by the reduced record grouper """
+    salter = KeySalter(salts=4, sample_rate=1, min_samples=10, seed=1,
+                       key_encoding='tuple')
+    records = []
+    for i in range(100):
+      key = salter.salt(encode_key([u"acct", 7985, u"total"]))
+      proto = KeyValue()
+      proto.set_key(key)
+      proto.set_value("1.0")
+      records.append(proto.Encode())
+    self.assertEqual(5, len(set(KeyValue(r).key() for r in records)))
+
+    grouper = KeyGrouper(key_encoding='tuple', salt_merge='sum')
+    groups = list(grouper.group([records]))
+    self.assertEqual(1, len(groups))
+    group_key, merged = groups[0]
+    self.assertEqual([u"acct", u"7985"], grouper.explode_group_key(group_key))
+    self.assertEqual([(u"total", 100.0)], merged)
+
+  def test_hot_keys_salted(self):
+    """ Hot keys are spread round robin over the sub-keys """
+    salter = KeySalter(salts=4, sample_rate=0.5, min_samples=100, seed=1)
+    salted = [salter.salt(key) for key in self._keys()]
+    self.assertEqual([u"hot"], salter.hot_keys)
+
+    hot = [key for key in salted if unsalt_key(key) == u"hot"]
+    sub_keys = set(hot)
+    self.assertEqual(5, len(sub_keys))  # unsalted warm up keys and 4 salts
+    counts = [hot.count(salt_key(u"hot", i)) for i in range(4)]
+    self.assertTrue(max(counts) - min(counts) <= 1)
+
+    cold = [key for key in salted if key.startswith(u"cold")]
+    self.assertEqual(cold, [unsalt_key(key) for key in cold])
+
+  def test_disabled_before_min_samples(self):
+    """ Nothing is salted until enough keys are sampled """
+    salter = KeySalter(salts=4, min_samples=10000, seed=1)
+    keys = self._keys()
+    self.assertEqual(keys, [salter.salt(key) for key in keys])
+
+  def test_invalid_salts(self):
+    """ Less than two salts raise ValueError """
+    self.assertRaises(ValueError, KeySalter, salts=1)
+
+  def test_merge_salted(self):
+    """ Partial aggregates of the same key are merged """
+    records = [(u"a", u"1.5"), (u"b", u"[2.0, 1]"), (u"a", u"2.5"),
+               (u"b", [4.0, 1])]
+    self.assertEqual([(u"a", 4.0)], merge_salted(records[::2], 'sum'))
+    self.assertEqual([(u"b", [6.0, 2])], merge_salted(records[1::2], 'avg'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -85,3 +85,76 @@ class TestJSONOutputWriter(unittest.TestCase):
       '}\r\n'
     )
     self.assertEqual(expected, out)
+
+
+class TestOutputWriterRegistry(unittest.TestCase):
+
+  def test_builtin_writers_are_registered(self):
+    """ Built in writers are resolved by format name in any case """
+    self.assertEqual('csv', OutputWriter.get_writer('CSV').FORMAT)
+    self.assertEqual('json', OutputWriter.get_writer('Json').EXTENSION)
+    self.assertTrue(OutputWriter.get_writer('avro').BATCH)
+    self.assertFalse(OutputWriter.get_writer('csv').BATCH)
+
+  def test_custom_writer_registration(self):
+    """ Writers registered by third parties are resolved """
+
+    @OutputWriter.register
+    class TSVWriter(OutputWriter):
+      FORMAT = 'tsv'
+      EXTENSION = 'tsv'
+
+      @classmethod
+      def write(cls, data_obj):
+        return "\t".join(unicode(v) for v in data_obj.values()) + "\n"
+
+    writer = OutputWriter.get_writer('tsv')
+    self.assertEqual(TSVWriter, writer)
+    self.assertEqual("1\ttest\n", writer.write(OrderedDict([("a", 1), ("b", "test")])))
+
+  def test_unknown_format(self):
+    """ Unknown formats raise KeyError """
+    self.assertRaises(KeyError, OutputWriter.get_writer, 'unknown_format')
+
+
+class TestJSONArrayOutputWriter(unittest.TestCase):
+
+  def setUp(self):
+    self.record = OrderedDict([
+      ("sprop_abc", 1),
+      ("sprop_bcd", float('NaN')),
+      ("sprop_cde", None)
+    ])
+
+  def test_simple_output(self):
+    """ Rows are written as arrays of values """
+    writer = OutputWriter.get_writer('json_array')
+    out = writer.write(self.record, nan_to_null=True)
+
+    self.assertEqual('[1, null, null]\r\n', out)
+
+  def test_drop_trailing_nulls(self):
+    """ Trailing null values are left out """
+    writer = OutputWriter.get_writer('json_array')
+    out = writer.write(self.record, nan_to_null=True, drop_trailing_nulls=True)
+
+    self.assertEqual('[1]\r\n', out)
+
+  def test_header_is_written_once(self):
+    """ Streams opened by the writer start with the column names """
+    property_list = [
+      "sprop_abc",
+      "sprop_bcd",
+      [{
+        "method": "mapreduceutils.modifiers.primitives.DateFormatModifier",
+        "identifier": "sprop_cde",
+        "operands": {"value": "model.created_time"},
+        "args": {"date_format": "%Y"}
+      }]
+    ]
+    stream = OutputWriter.get_writer('json_array').open(
+      property_list, drop_trailing_nulls=True)
+    data = stream.header() + stream.write(self.record) + stream.flush()
+
+    self.assertEqual(
+      '["sprop_abc", "sprop_bcd", "sprop_cde"]\r\n[1, NaN]\r\n', data)
@@ -1,15 +1,154 @@
+from avrofile import AvroContainerWriter, schema_for_property_list
 import csv
 from cStringIO import StringIO
 import datetime
 from json import JSONEncoder
 import math
 
+try:
+  import pkg_resources
+except ImportError:
+  pkg_resources = None
+
+ENTRY_POINT_GROUP = 'mapreduceutils.writers'
+
 
 class OutputWriter:
+  """
+  Base class of mapper output writers
+
+  Writers are registered by format name with `OutputWriter.register` and
+  declare:
+    - FORMAT: (str) name used in the `output_format` mapper param
+    - EXTENSION: (str) file extension of the generated output
+    - BATCH: (bool) True if records are written in blocks through
+      `open()` rather than one by one through `write()`, batch formats
+      only support map only rules written by RecordMapper
+
+  Third party writers can be registered through the
+  "mapreduceutils.writers" setuptools entry point group, the entry point
+  name being the format name.
+  """
+  FORMAT = None
+  EXTENSION = None
+  BATCH = False
+
+  _registry = {}
+  _entry_points_loaded = False
+
+  @classmethod
+  def register(cls, writer_cls, out_format=None):
+    """
+    Registers a writer class, can be used as a class decorator
+
+    Args:
+      - writer_cls: (OutputWriter) writer class to register
+      - out_format: (str) format name, writer_cls.FORMAT by default
+    """
+    out_format = out_format or writer_cls.FORMAT
+    if not out_format:
+      raise ValueError("Writer {} does not declare a FORMAT".format(writer_cls))
+
+    cls._registry[out_format.lower()] = writer_cls
+    return writer_cls
+
+  @classmethod
+  def _load_entry_points(cls):
+    cls._entry_points_loaded = True
+    if pkg_resources is None:
+      return
+
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+      if entry_point.name.lower() not in cls._registry:
+        cls.register(entry_point.load(), entry_point.name)
+
+  @classmethod
+  def open(cls, property_list, block_rows=1000, block_size=64 * 1024,
+           **writer_args):
+    """
+    Opens a stream joining rows written by this writer into blocks
+
+    Args:
+      - property_list: (list) property list of the rule generating the
+        records, unused by per row writers
+      - block_rows: (int) maximum number of rows per block
+      - block_size: (int) maximum size in bytes of a block
+      - writer_args: keyword arguments passed to write()
+
+    Returns:
+      Stream object implementing header(), write(data_obj) and flush(),
+      write() returns a block when full and flush() the pending rows.
+    """
+    return RowBuffer(cls, block_rows=block_rows, block_size=block_size,
+                     writer_args=writer_args)
+
   @classmethod
   def get_writer(cls, out_format):
-    cls_name = '{}Writer'.format(out_format.upper())
-    return globals()[cls_name]
+    """
+    Resolves the writer class registered for out_format (case insensitive)
+
+    Raises:
+      KeyError if no writer is registered for the format
+    """
+    try:
+      return cls._registry[out_format.lower()]
+    except KeyError:
+      if cls._entry_points_loaded:
+        raise
+    cls._load_entry_points()
+
+    try:
+      return cls._registry[out_format.lower()]
+    except KeyError:
+      raise KeyError("No output writer registered for format '{}'".format(out_format))
+
+
+class RowBuffer(object):
+  """ Joins rows encoded by a per row writer into blocks """
+
+  def __init__(self, writer, block_rows=1000, block_size=64 * 1024,
+               writer_args=None, header=''):
+    self.writer = writer
+    self.block_rows = block_rows
+    self.block_size = block_size
+    self.writer_args = writer_args or {}
+    self._header = header
+    self._rows = []
+    self._size = 0
+
+  def header(self):
+    return self._header
+
+  def write(self, data_obj):
+    data = self.writer.write(data_obj, **self.writer_args)
+    self._rows.append(data)
+    self._size += len(data)
+
+    if len(self._rows) >= self.block_rows or self._size >= self.block_size:
+      return self.flush()
+    return ''
+
+  def flush(self):
+    block = ''.join(self._rows)
+    self._rows = []
+    self._size = 0
+    return block
+
+
+def property_names(property_list):
+  """
+  Names of the columns generated by a property list
+
+  Plain attributes keep their name, modifier groups are named after the
+  identifier of their last modifier.
+  """
+  names = []
+  for prop in property_list:
+    if isinstance(prop, basestring):
+      names.append(prop)
+    elif isinstance(prop, list) and prop:
+      names.append(prop[-1]['identifier'])
+  return names
 
 
 class MapperJSONEncoder(JSONEncoder):
@@ -27,7 +166,11 @@ class MapperJSONEncoder(JSONEncoder):
     return JSONEncoder.default(self, obj)
 
 
+@OutputWriter.register
 class CSVWriter(OutputWriter):
+  FORMAT = 'csv'
+  EXTENSION = 'csv'
+
   @classmethod
   def encode(cls, values):
     out_values = list()
@@ -62,7 +205,11 @@ class CSVWriter(OutputWriter):
     return data.getvalue()
 
 
+@OutputWriter.register
 class JSONWriter(OutputWriter):
+  FORMAT = 'json'
+  EXTENSION = 'json'
+
   @classmethod
   def write(cls, data_obj, nan_to_null=False):
     """
@@ -79,3 +226,80 @@ class JSONWriter(OutputWriter):
       data_obj = {k: None if isinstance(v, float) and math.isnan(v) else v
                   for k, v in data_obj.items()}
     return "{}\r\n".format(MapperJSONEncoder().encode(data_obj))
+
+
+@OutputWriter.register
+class JSONARRAYWriter(OutputWriter):
+  """
+  Writes rows as JSON arrays of values
+
+  Column names are written once, as a JSON array in the first line of every
+  output file (see `open`), instead of being repeated in every row.
+  """
+  FORMAT = 'json_array'
+  EXTENSION = 'jsonl'
+
+  @classmethod
+  def header(cls, property_list):
+    """ Returns the header line listing the columns of property_list """
+    names = property_names(property_list)
+    return "{}\r\n".format(MapperJSONEncoder().encode(names))
+
+  @classmethod
+  def write(cls, data_obj, nan_to_null=False, drop_trailing_nulls=False):
+    """
+    Encodes the values of given python object as a JSON array
+
+    Args:
+      data_obj:             OrderedDict containing the values to encode
+      nan_to_null:          (Bool) If True NaN values will be converted to
+                            None before encoding to JSON
+      drop_trailing_nulls:  (Bool) If True trailing None values are left out,
+                            readers should pad rows to the header length
+    Returns:
+      JSON string
+    """
+    values = data_obj.values()
+    if nan_to_null:
+      values = [None if isinstance(v, float) and math.isnan(v) else v
+                for v in values]
+    if drop_trailing_nulls:
+      while values and values[-1] is None:
+        values.pop()
+    return "{}\r\n".format(MapperJSONEncoder().encode(values))
+
+  @classmethod
+  def open(cls, property_list, block_rows=1000, block_size=64 * 1024,
+           **writer_args):
+    return RowBuffer(cls, block_rows=block_rows, block_size=block_size,
+                     writer_args=writer_args, header=cls.header(property_list))
+
+
+@OutputWriter.register
+class AVROWriter(OutputWriter):
+  FORMAT = 'avro'
+  EXTENSION = 'avro'
+  BATCH = True
+
+  @classmethod
+  def open(cls, property_list, block_rows=None, block_size=64 * 1024,
+           codec='deflate', sync_marker=None):
+    """
+    Creates an Avro container writer for records generated by property_list
+
+    The schema is derived once from the property list, records are then
+    binary encoded and written in compressed blocks.
+
+    Args:
+      - property_list: (list) property list of the rule generating the records
+      - block_rows: (int) optional maximum number of records per block
+      - block_size: (int) approximate uncompressed size of each block
+      - codec: (str) "deflate" (default) or "null"
+      - sync_marker: (str) 16 bytes sync marker, random by default
+
+    Returns:
+      AvroContainerWriter instance, see `avrofile.AvroContainerWriter`
+    """
+    schema = schema_for_property_list(property_list)
+    return AvroContainerWriter(schema, codec=codec, block_size=block_size,
+                               sync_marker=sync_marker, block_rows=block_rows)